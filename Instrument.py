@@ -0,0 +1,237 @@
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# 可选的性能计数，B+树和外部排序共用：默认不开启，只有挂上Stats对象时才计数（见BplusTree.instrument、
+# ExternalSort.external_sort和Merge.merge的stats参数），没挂时热路径上每处只多一次is None判断
+# 计数分三类：
+#   operations：按操作分开的计数，如每次insert访问的结点数、二分查找的比较次数、分裂/合并/借元素的次数，
+#               一次操作结束时累加到该操作的总计数（calls为调用次数，seconds为总耗时），并交给callback
+#   counters：不属于某次操作的计数，如归并阶段后台线程读写的字节数和块数
+#   timers：累计耗时（秒），如生成顺串、归并、读、写、等待读写
+# 嵌套的操作（如get内部调用scan）只记在最外层的操作上；计数在各线程中分别进行，总计数加锁合并
+# report()返回可以直接写成JSON的dict，sources中的函数在report时调用（如树的高度和结点填充率直方图）
+# callback(操作名, 这次操作的计数)在每次操作结束时调用，可以用来逐次记录、采样或发到别处
+
+
+class Stats:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.operations = {}
+        self.counters = Counter()
+        self.timers = Counter()
+        self.sources = {}
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    # 当前线程正在进行的操作的计数栈
+    def __stack(self):
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    # 计数加n：在某次操作中时记在这次操作上，否则记在counters中
+    def add(self, name, n=1):
+        stack = self.__stack()
+        if stack:
+            stack[-1][name] += n
+        else:
+            with self.__lock:
+                self.counters[name] += n
+
+    def add_time(self, name, seconds):
+        with self.__lock:
+            self.timers[name] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - startTime)
+
+    # 一次操作结束，counts累加到该操作的总计数，调用次数加1，再交给callback
+    def record(self, name, counts):
+        with self.__lock:
+            totals = self.operations.setdefault(name, Counter())
+            totals['calls'] += 1
+            totals.update(counts)
+        if self.callback is not None:
+            self.callback(name, dict(counts))
+
+    # 一次操作，期间add的计数都记在它上面；已经在某次操作中时只算作外层操作的一部分
+    @contextmanager
+    def operation(self, name):
+        stack = self.__stack()
+        if stack:
+            yield stack[-1]
+            return
+        counts = Counter()
+        stack.append(counts)
+        startTime = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            counts['seconds'] += time.perf_counter() - startTime
+            stack.pop()
+            self.record(name, counts)
+
+    # 把函数的每次调用作为一次操作，与operation相同，不经过contextmanager，单次操作的额外开销小一些
+    def wrap(self, name, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = self.__stack()
+            if stack:
+                return function(*args, **kwargs)
+            counts = Counter()
+            stack.append(counts)
+            startTime = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                counts['seconds'] += time.perf_counter() - startTime
+                stack.pop()
+                self.record(name, counts)
+
+        return wrapper
+
+    # 生成器（如scan）的一次遍历作为一次操作，只有生成器执行的时间算在这次操作上，
+    # 两次产出之间调用方做的其他操作各自单独计数；遍历结束或生成器被关闭时记录
+    def wrap_generator(self, name, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = self.__stack()
+            if stack:
+                yield from function(*args, **kwargs)
+                return
+            iterator = function(*args, **kwargs)
+            counts = Counter()
+            try:
+                while True:
+                    stack.append(counts)
+                    startTime = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        counts['seconds'] += time.perf_counter() - startTime
+                        stack.pop()
+                    yield item
+            finally:
+                self.record(name, counts)
+
+        return wrapper
+
+    def reset(self):
+        with self.__lock:
+            self.operations.clear()
+            self.counters.clear()
+            self.timers.clear()
+
+    def report(self):
+        with self.__lock:
+            result = {'operations': {name: dict(counts) for name, counts in self.operations.items()},
+                      'counters': dict(self.counters), 'timers': dict(self.timers)}
+        for name, source in self.sources.items():
+            result[name] = source()
+        return result
+
+    def dump(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# 计数与树的结构变化一致（叶结点个数 = 1 + 叶结点分裂次数 - 叶结点合并次数，内结点同理），
+# 每次点查询访问的结点数等于树高，外部排序归并阶段读写的字节数与计划一致，关闭计数后不再计数
+def test(records=20000, order=8):
+    import os
+    import random
+    import shutil
+    from bPlusTree.BplusTree import BplusTree
+    from bPlusTree.KeyValue import KeyValue
+    from mergeSort import ExternalSort
+
+    right = True
+    calls = []
+    stats = Stats(lambda name, counts: calls.append(name))
+    tree = BplusTree(order)
+    tree.instrument(stats)
+    keys = random.sample(range(records * 10), records)
+    for key in keys:
+        tree.insert(KeyValue(key, 'abcdefghijkl'))
+    tree.insert_many(KeyValue(key, 'abcdefghijkl') for key in random.sample(range(records * 10), records))
+    for key in keys[:records // 2]:
+        tree.delete(key)
+    tree.delete_many(keys[records // 2:records * 3 // 4])
+    report = stats.report()
+    shape = report['tree']
+    totals = Counter()
+    for counts in report['operations'].values():
+        totals.update(counts)
+    right = right and shape['leaves'] == 1 + totals['leaf_splits'] - totals['leaf_merges']
+    right = right and shape['inter_nodes'] == totals['inter_splits'] + totals['root_splits'] - \
+        totals['inter_merges'] - totals['root_merges']
+    right = right and shape['height'] == 1 + totals['root_splits'] - totals['root_merges']
+    right = right and sum(shape['leaf_fill'].values()) == shape['leaves']
+    right = right and report['operations']['insert']['calls'] == records
+    right = right and len(calls) == records + 1 + records // 2 + 1
+
+    stats.reset()
+    for key in keys[:1000]:
+        tree.get(key)
+    report = stats.report()
+    right = right and report['operations']['get']['calls'] == 1000
+    right = right and report['operations']['get']['node_visits'] == 1000 * shape['height']
+    right = right and list(report['operations']) == ['get']
+    tree.instrument(None)
+    tree.get(keys[0])
+    right = right and stats.report()['operations']['get']['calls'] == 1000
+
+    temp = 'instrument_temp/'
+    os.makedirs(temp, exist_ok=True)
+    data = temp + 'data.bin'
+    with open(data, 'wb') as f:
+        f.write(b''.join(key.to_bytes(4, 'little') + b'abcdefghijkl' for key in keys))
+    stats = Stats()
+    plan = ExternalSort.external_sort(data, temp + 'result.bin', 16 * 1024, temp=temp + 'runs/', verbose=False,
+                                      text=False, stats=stats)
+    report = stats.report()
+    right = right and report['counters']['bytes_read'] == plan.merge_records * ExternalSort.key_size
+    right = right and report['counters']['bytes_written'] == plan.merge_records * ExternalSort.key_size
+    right = right and report['operations']['external_sort']['runs'] == plan.runs
+    right = right and report['timers']['runs'] > 0 and report['timers']['merge'] > 0
+    shutil.rmtree(temp)
+    print('Right!' if right else 'Wrong!!!')
+
+
+# 不挂计数、挂上计数时逐条插入和点查询的耗时
+def benchmark(records=200000, order=64):
+    import random
+    from bPlusTree.BplusTree import BplusTree
+    from bPlusTree.KeyValue import KeyValue
+
+    keyValues = [KeyValue(random.randint(1, records), 'abcdefghijkl') for _ in range(records)]
+    for stats in (None, Stats()):
+        tree = BplusTree(order)
+        tree.instrument(stats)
+        startTime = time.perf_counter()
+        for keyValue in keyValues:
+            tree.insert(keyValue)
+        insertTime = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        for keyValue in keyValues:
+            tree.get(keyValue.key)
+        getTime = time.perf_counter() - startTime
+        print('instrumented' if stats else 'plain', 'insert:', insertTime / records * 1000000, 'us,',
+              'get:', getTime / records * 1000000, 'us')
+    print(json.dumps(stats.report()['operations']['insert'], indent=2))
+
+
+if __name__ == '__main__':
+    test()
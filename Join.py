@@ -0,0 +1,282 @@
+import os
+import shutil
+from array import array
+
+import numpy as np
+
+import ReadData
+from bPlusTree.BplusTree import BplusTree
+from mergeSort import ExternalSort, Record
+
+# 两个记录文件（每条记录为属性A和B，CSV或二进制记录文件.bin）在属性A上的等值连接，结果的每一行为(A, 左边的B, 右边的B)
+# 排序归并连接：两边先用ExternalSort按A排序成二进制记录文件，再各读一块同时向后扫描，
+#   两边最大键值中较小的那个记作bound，小于bound的键值两边都已经全部读入，一次用numpy配对，
+#   等于bound的记录留到下一块读入之后，所以两边都有重复键值、重复键值跨越多块时也正确
+#   （一组重复键值比一块还大时缓冲区随之变大）
+# 索引嵌套循环连接：内表为主键A上的BplusTree（可以已经建好，或者把较小的一边读入内存建树），
+#   外表逐块读入，块内按A排序、去重后用BplusTree.get_many批量探测，相邻的探测共用叶结点
+# plan按记录数和内存大小估计两种方法的代价，选代价小的；树放不进内存时只能用排序归并连接
+
+join_dtype = np.dtype([('key', '<i4'), ('left', 'S12'), ('right', 'S12')])
+
+# 代价以顺序读或写一条16字节记录为单位，下面的系数在本机上实测得到（见benchmark，100万条对100万条）：
+# 排序归并连接每单位约0.12微秒，有序批量探测一次约3微秒，读入并建树每条约2.5微秒
+probe_cost = 25  # 有序批量探测一次树（含组装结果）
+build_cost = 20  # 读入内存、排序、建树，每条记录
+tree_record_size = 64  # 建好的树中每条记录占用的内存（字节），order为64，实测约61
+
+
+class JoinPlan:
+    def __init__(self, method, leftRecords, rightRecords, memory, sortMergeCost, indexCost, swap=False):
+        self.method = method
+        self.leftRecords = leftRecords
+        self.rightRecords = rightRecords
+        self.memory = memory
+        self.sortMergeCost = sortMergeCost
+        self.indexCost = indexCost  # 树放不进内存时为None
+        self.swap = swap  # 索引嵌套循环连接在左边建树，右边为外表
+        self.rows = None  # 实际连接之后为结果的行数
+
+    def __str__(self):
+        lines = ['records: left ' + str(self.leftRecords) + ', right ' + str(self.rightRecords),
+                 'memory: ' + str(self.memory) + ' bytes',
+                 'cost: sort-merge ' + str(self.sortMergeCost) + ', index ' +
+                 ('-' if self.indexCost is None else str(self.indexCost)),
+                 'method: ' + self.method + (' (index on left)' if self.method == 'index' and self.swap else '')]
+        if self.rows is not None:
+            lines.append('rows: ' + str(self.rows))
+        return '\n'.join(lines)
+
+
+# 外部排序n条记录的读写量（记录数）
+def sort_cost(records, memory):
+    sort_plan = ExternalSort.plan(records, memory, payload=True)
+    return sort_plan.read_records + sort_plan.write_records
+
+
+# hasIndex为True时右边已经有建好的树
+def plan(leftRecords, rightRecords, memory=1024 * 1024, hasIndex=False):
+    sortMergeCost = sort_cost(leftRecords, memory) + sort_cost(rightRecords, memory) + leftRecords + rightRecords
+    swap = False
+    if hasIndex:
+        indexCost = leftRecords * (1 + probe_cost)
+    else:
+        # 在较小的一边建树
+        swap = leftRecords < rightRecords
+        inner, outer = (leftRecords, rightRecords) if swap else (rightRecords, leftRecords)
+        if inner * tree_record_size > memory:
+            indexCost = None
+        else:
+            indexCost = inner * (1 + build_cost) + outer * (1 + probe_cost)
+    method = 'index' if indexCost is not None and indexCost < sortMergeCost else 'sort-merge'
+    return JoinPlan(method, leftRecords, rightRecords, memory, sortMergeCost, indexCost, swap)
+
+
+# 两个按键值有序的记录数组中键值相等的记录两两配对，左边每条记录对应右边[start, end)一段
+def match(left, right):
+    leftKeys, rightKeys = left['key'], right['key']
+    start = np.searchsorted(rightKeys, leftKeys, 'left')
+    counts = np.searchsorted(rightKeys, leftKeys, 'right') - start
+    total = int(counts.sum())
+    result = np.empty(total, join_dtype)
+    if total:
+        leftIndex = np.repeat(np.arange(len(leftKeys)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        rightIndex = np.repeat(start, counts) + offsets
+        result['key'] = leftKeys[leftIndex]
+        result['left'] = left['value'][leftIndex]
+        result['right'] = right['value'][rightIndex]
+    return result
+
+
+# 两个按键值有序的二进制记录文件逐块归并连接，逐块产出结果（join_dtype数组）
+def merge_join(leftFile, rightFile, block_size):
+    with open(leftFile, 'rb') as left, open(rightFile, 'rb') as right:
+        files = [left, right]
+        buffers = [Record.read_records(f, block_size) for f in files]
+        ends = [len(buffer) < block_size for buffer in buffers]
+        while len(buffers[0]) and len(buffers[1]):
+            # 没读完的一边缓冲区中最大的键值可能还有记录在后面，小于两边这些最大键值的记录都已经全部读入
+            lasts = [buffers[side]['key'][-1] for side in (0, 1) if not ends[side]]
+            if lasts:
+                bound = min(lasts)
+                cuts = [np.searchsorted(buffer['key'], bound, 'left') for buffer in buffers]
+            else:
+                bound = None
+                cuts = [len(buffer) for buffer in buffers]
+            result = match(buffers[0][:cuts[0]], buffers[1][:cuts[1]])
+            if len(result):
+                yield result
+            for side in (0, 1):
+                buffer = buffers[side][cuts[side]:]
+                # 剩下的都等于bound（或者已经取完），再读一块
+                if not ends[side] and (not len(buffer) or buffer['key'][-1] == bound):
+                    more = Record.read_records(files[side], block_size)
+                    ends[side] = len(more) < block_size
+                    buffer = np.concatenate([buffer, more])
+                buffers[side] = buffer
+
+
+# 排序归并连接：两边分别外部排序到temp中，再归并连接，结束后删除临时文件
+def sort_merge_join(leftFile, rightFile, memory=1024 * 1024, temp='join_temp/'):
+    os.makedirs(temp, exist_ok=True)
+    names = []
+    try:
+        for side, filename in (('left', leftFile), ('right', rightFile)):
+            name = os.path.join(temp, side + '.bin')
+            ExternalSort.external_sort(filename, name, memory, temp=os.path.join(temp, side + '/'), verbose=False,
+                                       payload=True, engine='numpy')
+            names.append(name)
+        # 归并时两边各一块输入，结果最多占两块
+        yield from merge_join(names[0], names[1], max(1, memory // Record.record_size // 4))
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+# 把记录文件读入内存，按A排序后建树，值为B（字节串）
+def build_index(filename, order=64):
+    chunks = list(Record.read_record_chunks(filename, ReadData.chunk_size))
+    records = np.concatenate(chunks) if chunks else np.empty(0, Record.record_dtype)
+    records = records[np.argsort(records['key'], kind='stable')]
+    keys = array('i')
+    keys.frombytes(records['key'].tobytes())
+    return BplusTree.from_columns(keys, records['value'].tolist(), order)
+
+
+# 树中的值可能是字符串（read_data读入的）或字节串
+def to_bytes(values):
+    return np.array([value.encode('utf-8') if isinstance(value, str) else value for value in values], 'S12')
+
+
+# 索引嵌套循环连接：外表逐块读入，块内按A排序、去重后批量探测tree，逐块产出结果
+# swap为True时外表是连接的右边，结果中左右两列对调
+def index_nested_loop_join(outerFile, tree, batch=ReadData.chunk_size, swap=False):
+    for records in Record.read_record_chunks(outerFile, batch):
+        records = records[np.argsort(records['key'], kind='stable')]
+        keys, starts, counts = np.unique(records['key'], return_index=True, return_counts=True)
+        outerIndex, innerValues = [], []
+        for start, count, matches in zip(starts.tolist(), counts.tolist(), tree.get_many(keys.tolist())):
+            if matches:
+                for i in range(start, start + count):
+                    outerIndex.extend([i] * len(matches))
+                    innerValues.extend(matches)
+        if not outerIndex:
+            continue
+        result = np.empty(len(outerIndex), join_dtype)
+        result['key'] = records['key'][outerIndex]
+        result['right' if swap else 'left'] = records['value'][outerIndex]
+        result['left' if swap else 'right'] = to_bytes(innerValues)
+        yield result
+
+
+# 逐块写出结果，输出文件以.bin结尾时为二进制（每行28字节），否则为CSV（表头key,left,right），返回行数
+def write_join(output, blocks):
+    rows = 0
+    binary = Record.is_record_file(output)
+    with open(output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+        if not binary:
+            f.write('key,left,right\n')
+        for block in blocks:
+            rows += len(block)
+            if binary:
+                block.tofile(f)
+            else:
+                left = np.char.decode(block['left'], 'utf-8').tolist()
+                right = np.char.decode(block['right'], 'utf-8').tolist()
+                f.write(''.join(str(key) + ',' + x + ',' + y + '\n'
+                                for key, x, y in zip(block['key'].tolist(), left, right)))
+    return rows
+
+
+# 连接leftFile和rightFile写到output，method为None时按plan选择，tree为右边已经建好的树（可选）
+def join(leftFile, rightFile, output='join.csv', memory=1024 * 1024, method=None, tree=None, temp='join_temp/',
+         order=64, verbose=True):
+    join_plan = plan(ExternalSort.estimate_records(leftFile), ExternalSort.estimate_records(rightFile), memory,
+                     tree is not None)
+    if method is not None:
+        join_plan.method = method
+    if verbose:
+        print(join_plan)
+    batch = max(1024, memory // Record.record_size // 2)
+    if join_plan.method == 'index':
+        swap = tree is None and join_plan.swap
+        if tree is None:
+            tree = build_index(leftFile if swap else rightFile, order)
+        blocks = index_nested_loop_join(rightFile if swap else leftFile, tree, batch, swap)
+    elif join_plan.method == 'sort-merge':
+        blocks = sort_merge_join(leftFile, rightFile, memory, temp)
+    else:
+        raise ValueError('unknown join method ' + str(join_plan.method))
+    join_plan.rows = write_join(output, blocks)
+    return join_plan
+
+
+# 两边都有大量重复键值（或几乎没有重复），小内存使重复键值跨越多块，
+# 两种方法（以及传入建好的树、在左边建树）和逐个配对的结果一致
+def test(records=20000, memory=16 * 1024):
+    import random
+    from collections import defaultdict
+    right = True
+    for distinct in (records // 20, records * 2):
+        rows = []
+        for name in ('join_left.csv', 'join_right.csv', 'join_small.csv'):
+            n = records if name != 'join_small.csv' else records // 20
+            keys = [random.randint(1, distinct) for _ in range(n)]
+            values = ['%012d' % random.randrange(10 ** 12) for _ in range(n)]
+            ExternalSort.write_test_file(name, keys, values)
+            rows.append(list(zip(keys, values)))
+        Record.csv_to_records('join_right.csv', 'join_right.bin')
+        index = defaultdict(list)
+        for key, value in rows[1]:
+            index[key].append(value)
+        expected = sorted((key, x, y) for key, x in rows[0] for y in index[key])
+        for method, tree in (('sort-merge', None), ('index', None), ('index', build_index('join_right.bin'))):
+            for output in ('join_result.csv', 'join_result.bin'):
+                result = join('join_left.csv', 'join_right.bin', output, memory, method, tree, 'join_temp/',
+                              order=8, verbose=False)
+                if output.endswith('.bin'):
+                    data = np.fromfile(output, join_dtype)
+                    actual = list(zip(data['key'].tolist(), np.char.decode(data['left']).tolist(),
+                                      np.char.decode(data['right']).tolist()))
+                else:
+                    with open(output, 'r', encoding='utf-8') as f:
+                        next(f)
+                        actual = [(int(a), b, c) for a, b, c in (line.rstrip('\n').split(',') for line in f)]
+                right = right and sorted(actual) == expected and result.rows == len(expected)
+                os.remove(output)
+        # 左边较小，在左边建树，右边为外表
+        expected = sorted((key, x, y) for key, x in rows[2] for y in index[key])
+        result = join('join_small.csv', 'join_right.bin', 'join_result.csv', 1024 * 1024, 'index', verbose=False)
+        with open('join_result.csv', 'r', encoding='utf-8') as f:
+            next(f)
+            actual = sorted((int(a), b, c) for a, b, c in (line.rstrip('\n').split(',') for line in f))
+        right = right and result.swap and actual == expected
+        os.remove('join_result.csv')
+    for name in ('join_left.csv', 'join_right.csv', 'join_right.bin', 'join_small.csv'):
+        os.remove(name)
+    # 外表很小且已经有树时用索引，两边都很大时用排序归并，树放不进内存时不能用索引
+    right = right and plan(1000, 1000000, 1024 * 1024, True).method == 'index'
+    right = right and plan(1000000, 1000000, 1024 * 1024, True).method == 'sort-merge'
+    right = right and plan(1000000, 1000000, 1024 * 1024).indexCost is None
+    print('Right!' if right else 'Wrong!!!')
+
+
+# n条对n条的连接（键值在1..n中均匀随机），两种方法各自的耗时，以及plan的代价估计
+def benchmark(records=1000000, memory=1024 * 1024):
+    import datetime
+    import CreateData
+    CreateData.create_data('join_left.bin', records, seed=1)
+    CreateData.create_data('join_right.bin', records, seed=2)
+    tree = build_index('join_right.bin')
+    for method, index in (('sort-merge', None), ('index', tree)):
+        startTime = datetime.datetime.now()
+        result = join('join_left.bin', 'join_right.bin', 'join_result.bin', memory, method, index, verbose=False)
+        endTime = datetime.datetime.now()
+        print(method, 'rows =', result.rows, 'time =', (endTime - startTime).total_seconds(), 's')
+    print(plan(records, records, memory, True))
+    for name in ('join_left.bin', 'join_right.bin', 'join_result.bin'):
+        os.remove(name)
+
+
+if __name__ == '__main__':
+    test()
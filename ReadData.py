@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# 流式读取数据文件（每行 键值,值），B+树和外部排序共用
+# 按块读，每次产出至多size条记录，内存只和块大小有关，不会一次把整个文件读进来
+# 键值为int32数组，值为字符串数组；键值和值两边的空格（如ex1.csv中的'1  ,a'、'12, l'）会去掉
+# CreateData.py生成的data.csv没有表头，ex1.csv有表头key,value，按第一行第一列是不是整数判断
+
+chunk_size = 65536
+
+
+def has_header(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        first = f.readline().split(',')[0].strip()
+    return not first.lstrip('-').isdigit()
+
+
+# 逐块产出(键值数组, 值数组)，values为False时只读键值列，值数组为None
+def read_chunks(filename='data.csv', size=chunk_size, values=True):
+    reader = pd.read_csv(filename, sep=',', header=None, names=['key', 'value'],
+                         usecols=None if values else ['key'], skiprows=1 if has_header(filename) else 0,
+                         dtype={'key': np.int32, 'value': str}, keep_default_na=False,
+                         skipinitialspace=True, chunksize=size)
+    with reader:
+        for chunk in reader:
+            keys = chunk['key'].to_numpy()
+            if values:
+                yield keys, np.char.rstrip(chunk['value'].to_numpy(str))
+            else:
+                yield keys, None
+
+
+# 逐块产出键值列表
+def read_keys(filename='data.csv', size=chunk_size):
+    for keys, values in read_chunks(filename, size, False):
+        yield keys.tolist()
+
+
+# 逐条产出(键值, 值)
+def read_pairs(filename='data.csv', size=chunk_size):
+    for keys, values in read_chunks(filename, size):
+        yield from zip(keys.tolist(), values.tolist())
@@ -1,149 +1,346 @@
 import datetime
-from collections import deque
-
-import pandas as pd
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, deque
+from itertools import chain, islice
+from operator import attrgetter
 
+import ReadData
+from bPlusTree.Cursor import Cursor
 from bPlusTree.InterNode import InterNode
 from bPlusTree.KeyValue import KeyValue
 from bPlusTree.LeafNode import LeafNode
+from bPlusTree.PrefixKeys import PrefixKeys, bytes_typecode, key_array, key_column, separator
 
 
 def read_data(filename='../data.csv'):
-    keyValueList = []
-    data = pd.read_csv(filename, sep=',')
-    for number, keyValue in data.iterrows():
-        key = keyValue["key"]
-        value = keyValue["value"]
-        keyValueList.append(KeyValue(key, value))
-    return keyValueList
-
-
-# 二分查找，返回的位置及其之后的元素都是大于element的
-def binary_search_right(sortedList, element, low=0, high=None):
-    if low < 0:
-        raise ValueError('low can not be negative')
-    if high is None:
-        high = len(sortedList)
-    while low < high:
-        mid = (low + high) // 2
-        if element < sortedList[mid]:
-            high = mid
-        else:
-            low = mid + 1
-    return low
-
-
-# 二分查找， 返回的位置之前的都是小于element的
-def binary_search_left(sortedList, element, low=0, high=None):
-    if low < 0:
-        raise ValueError('low can not be negative')
-    if high is None:
-        high = len(sortedList)
-    while low < high:
-        mid = (low + high) // 2
-        if element > sortedList[mid]:
-            low = mid + 1
+    return [KeyValue(key, value) for key, value in ReadData.read_pairs(filename)]
+
+
+# 读取mergeSort生成的有序结果（每行一个键值），逐个产出KeyValue，用于批量建树
+def read_sorted(filename='../mergeSort/result.txt'):
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield KeyValue(int(line.strip()), None)
+
+
+# 将n个元素按每组size个划分，最后一组不足minimum时与前一组合并，放不下则两者平分
+def group_sizes(n, size, capacity, minimum):
+    sizes = [size] * (n // size)
+    if n % size:
+        sizes.append(n % size)
+    if len(sizes) > 1 and sizes[-1] < minimum:
+        total = sizes.pop() + sizes.pop()
+        if total <= capacity:
+            sizes.append(total)
         else:
-            high = mid
-    return low
+            sizes.extend([(total + 1) // 2, total // 2])
+    return sizes
+
+
+# 挂上性能计数时包装的公开操作，见BplusTree.instrument
+operations = ('insert', 'insert_many', 'delete', 'delete_all', 'delete_value', 'delete_many',
+              'get', 'search', 'count', 'rank', 'select')
+generator_operations = ('scan', 'get_many')
 
 
 class BplusTree:
-    def __init__(self, order):
+    # typecode为键值数组的类型，默认'i'对应4字节整型属性A，为None时用list存放任意可比较的键值，
+    # 为'bytes'时键值为字节串（如属性B），叶结点前缀压缩，内结点的索引值截断为最短的分隔值，见PrefixKeys
+    # posting为True时每个键值在叶结点中只出现一次，对应的值为该键值所有值组成的list（倒排表）
+    # 否则重复的键值各自占一个位置
+    def __init__(self, order, typecode='i', posting=False):
         self.__order = order
-        self.__root = LeafNode(order)
+        self.__typecode = typecode
+        self.__posting = posting
+        self.__root = LeafNode(order, typecode)
         self.__leaf = self.__root
+        self.__stats = None
 
-    def insert(self, keyValue):
-        node = self.__root  # 从根结点开始向下搜索找到对应的叶结点
-
-        # 分裂内结点，伴随一个索引值上升到父结点（若无父结点则创建），最后返回父结点
-        def split_inter(interNode):
-            # 创建新结点，复制分裂结点的后半截，注意下方mid-1位置元素要上升到父结点，故不添加到新结点
-            newNode = InterNode(self.__order)
-            mid = self.__order // 2 + 1
-            newNode.indexValueList = interNode.indexValueList[mid:]
-            newNode.pointerList = interNode.pointerList[mid:]
-            # 设置新节点父亲
-            newNode.parent = interNode.parent
-            # 为新节点子女重置父亲
+    # 自底向上批量建树，keyValues为按键值有序的KeyValue序列（可以是生成器）
+    # fill为结点填充率，叶结点最多存放order-1个键值，内结点最多order个子女
+    # 先逐片填满叶结点并串好brother指针，再逐层向上生成内结点
+    @classmethod
+    def bulk_load(cls, keyValues, order, fill=1.0, typecode='i', posting=False):
+        keyList = key_array(typecode)
+        valueList = []
+        for keyValue in keyValues:
+            if keyList and keyValue.key <= keyList[-1]:
+                if keyValue.key < keyList[-1]:
+                    raise ValueError('input is not sorted')
+                if posting:
+                    valueList[-1].append(keyValue.value)
+                    continue
+            keyList.append(keyValue.key)
+            valueList.append([keyValue.value] if posting else keyValue.value)
+        return cls.from_columns(keyList, valueList, order, fill, typecode, posting)
+
+    # 由有序的键值列和值列直接建树（倒排表模式下值列的每个元素为list），不检查是否有序
+    # 快照恢复等已经有整列数据的场合使用，省去逐个构造KeyValue
+    @classmethod
+    def from_columns(cls, keyList, valueList, order, fill=1.0, typecode='i', posting=False):
+        if not 0 < fill <= 1:
+            raise ValueError('fill must be in (0, 1]')
+        tree = cls(order, typecode, posting)
+        leafCapacity = order - 1
+        leafMin = -(-leafCapacity // 2)
+        leafSize = max(leafMin, min(leafCapacity, round(leafCapacity * fill)))
+        interMin = -(-order // 2)
+        interSize = max(interMin, min(order, round(order * fill)))
+        if not keyList:
+            return tree
+        if typecode and typecode != bytes_typecode and not isinstance(keyList, array):
+            keyList = array(typecode, keyList)
+
+        # 生成叶结点
+        level = []
+        start = 0
+        for size in group_sizes(len(keyList), leafSize, leafCapacity, leafMin):
+            leaf = LeafNode(order, typecode)
+            leaf.keyList = keyList[start:start + size]
+            if typecode == bytes_typecode:
+                leaf.keyList = PrefixKeys(leaf.keyList)
+            leaf.valueList = valueList[start:start + size]
+            if level:
+                level[-1].brother = leaf
+            level.append(leaf)
+            start += size
+        tree.__leaf = level[0]
+        # 每个结点子树中的最小键值（字节串键值为与左边叶结点之间的分隔值），作为父结点中的索引值
+        minKeys = [level[0].keyList[0]] + [tree.__separator(left, right) for left, right in zip(level, level[1:])]
+        # 每个结点子树中值的个数，作为父结点中的计数
+        sizes = [tree.__size(leaf) for leaf in level]
+
+        # 逐层向上生成内结点，直到只剩一个结点作为根结点
+        while len(level) > 1:
+            upper = []
+            upperMinKeys = []
+            upperSizes = []
+            start = 0
+            for size in group_sizes(len(level), interSize, order, interMin):
+                interNode = InterNode(order, typecode)
+                interNode.pointerList = level[start:start + size]
+                interNode.indexValueList.extend(minKeys[start + 1:start + size])
+                interNode.countList.extend(sizes[start:start + size])
+                for child in interNode.pointerList:
+                    child.parent = interNode
+                upper.append(interNode)
+                upperMinKeys.append(minKeys[start])
+                upperSizes.append(sum(interNode.countList))
+                start += size
+            level = upper
+            minKeys = upperMinKeys
+            sizes = upperSizes
+        tree.__root = level[0]
+        return tree
+
+    def __new_keys(self):
+        return key_column(self.__typecode)
+
+    # 叶结点right在父结点中的索引值：通常为right的最小键值，字节串键值截断为大于左边叶结点最大键值的最短前缀
+    def __separator(self, left, right):
+        if self.__typecode == bytes_typecode:
+            return separator(left.keyList[-1], right.keyList[0])
+        return right.keyList[0]
+
+    # 结点子树中值的个数，倒排表模式下为倒排表长度之和
+    def __size(self, node):
+        if not node.isLeaf():
+            return sum(node.countList)
+        if self.__posting:
+            return sum(map(len, node.valueList))
+        return len(node.keyList)
+
+    # 叶结点中值的个数变化delta时，更新各祖先中该子树的计数
+    @staticmethod
+    def __add_count(node, delta):
+        while node.parent is not None:
+            parent = node.parent
+            parent.countList[parent.pointerList.index(node)] += delta
+            node = parent
+
+    # 性能计数（见Instrument.py）：记下从根结点到node的一次查找，路径上每个结点访问一次，
+    # 结点内二分查找的比较次数按元素个数的二进制位数计
+    def __visit(self, node):
+        visits = comparisons = 0
+        while node is not None:
+            visits += 1
+            comparisons += len(node.keyList if node.isLeaf() else node.indexValueList).bit_length()
+            node = node.parent
+        self.__stats.add('node_visits', visits)
+        self.__stats.add('comparisons', comparisons)
+
+    # 把分裂出来的新结点及其最小索引值插入到node的父结点中（若无父结点则创建，并成为根结点），返回父结点
+    # 此处父结点可能会满需要分裂，但此处不做处理，留待上一层处理
+    def __add_brothers(self, node, indexValues, newNodes):
+        if node.parent is None:
+            newRoot = InterNode(self.__order, self.__typecode)
+            newRoot.pointerList = [node]
+            newRoot.countList.append(0)
+            node.parent = newRoot
+            self.__root = newRoot
+            if self.__stats is not None:
+                self.__stats.add('root_splits')
+        parent = node.parent
+        index = parent.pointerList.index(node)
+        parent.indexValueList[index:index] = indexValues
+        parent.pointerList[index + 1:index + 1] = newNodes
+        # 分裂前的计数拆分给分裂出来的各个结点
+        parent.countList[index] = self.__size(node)
+        parent.countList[index + 1:index + 1] = array('q', map(self.__size, newNodes))
+        for newNode in newNodes:
+            newNode.parent = parent
+        return parent
+
+    # 把n个元素平均分成若干份，每份不超过capacity，返回每份的起始位置
+    @staticmethod
+    def __split_points(n, capacity):
+        pieces = -(-n // capacity)
+        return [n * i // pieces for i in range(pieces)] + [n]
+
+    # 分裂叶结点，新叶结点的最小键值的副本插入到父结点中，最后返回父结点
+    # 单个插入时叶结点只多出一个键值，一分为二；批量插入时可能多出很多，一次分成多片
+    def __split_leaf(self, leafNode):
+        points = self.__split_points(len(leafNode.keyList), self.__order - 1)
+        newLeaves = []
+        indexValues = key_array(self.__typecode)
+        for start, end in zip(points[1:-1], points[2:]):
+            newLeaf = LeafNode(self.__order, self.__typecode)
+            newLeaf.keyList = leafNode.keyList[start:end]
+            newLeaf.valueList = leafNode.valueList[start:end]
+            newLeaves.append(newLeaf)
+        # 分裂结点只剩下第一片
+        del leafNode.keyList[points[1]:]
+        del leafNode.valueList[points[1]:]
+        for left, right in zip([leafNode] + newLeaves, newLeaves):
+            indexValues.append(self.__separator(left, right))
+        # 设置叶结点之间指针
+        newLeaves[-1].brother = leafNode.brother
+        for leaf, newLeaf in zip([leafNode] + newLeaves, newLeaves):
+            leaf.brother = newLeaf
+        if self.__stats is not None:
+            self.__stats.add('leaf_splits', len(newLeaves))
+        return self.__add_brothers(leafNode, indexValues, newLeaves)
+
+    # 分裂内结点，相邻两片之间的索引值上升到父结点（不保留在子结点中），最后返回父结点
+    def __split_inter(self, interNode):
+        points = self.__split_points(len(interNode.pointerList), self.__order)
+        newNodes = []
+        indexValues = key_array(self.__typecode)
+        for start, end in zip(points[1:-1], points[2:]):
+            newNode = InterNode(self.__order, self.__typecode)
+            newNode.indexValueList = interNode.indexValueList[start:end - 1]
+            newNode.pointerList = interNode.pointerList[start:end]
+            newNode.countList = interNode.countList[start:end]
+            # 为新结点子女重置父亲
             for pointer in newNode.pointerList:
                 pointer.parent = newNode
-            # 如果没有父亲则创建，并将该父亲设为根结点，子女为分裂出来的这两个节点
-            if interNode.parent is None:
-                newRoot = InterNode(self.__order)
-                newRoot.indexValueList = [interNode.indexValueList[mid - 1]]
-                newRoot.pointerList = [interNode, newNode]
-                interNode.parent = newRoot
-                newNode.parent = newRoot
-                self.__root = newRoot
-            else:
-                # 如果已有，则将mid-1位置元素上升到父节点
-                # 此处暂不监测父节点是否合法，待具体插入时做处理
-                parent = interNode.parent
-                index = parent.pointerList.index(interNode)
-                parent.indexValueList.insert(index, interNode.indexValueList[mid - 1])
-                parent.pointerList.insert(index + 1, newNode)
-            # 分裂后的结点只剩下前半截
-            interNode.indexValueList = interNode.indexValueList[:mid - 1]
-            interNode.pointerList = interNode.pointerList[:mid]
-            return interNode.parent
-
-        # 分裂叶结点，分裂后的两个叶结点的最小索引值为p小的，q大的，将q的副本插入到父结点中（若无则创建）
-        # 最后返回父结点
-        def split_leaf(leafNode):
-            # 创建新叶节点
-            mid = self.__order // 2
-            newLeaf = LeafNode(self.__order)
-            newLeaf.keyValueList = leafNode.keyValueList[mid:]
-            # 如果还没有父亲，则新建内结点作为父亲，并成为树根
-            if leafNode.parent is None:
-                newRoot = InterNode(self.__order)
-                newRoot.indexValueList = [leafNode.keyValueList[mid].key]
-                newRoot.pointerList = [leafNode, newLeaf]
-                leafNode.parent = newRoot
-                newLeaf.parent = newRoot
-                self.__root = newRoot
-            else:
-                # 如果已有，将新建结点的最小值副本插入父亲
-                # 此处父亲结点可能会满需要分裂，但此处不做处理，留待具体插入时进行
-                parent = leafNode.parent
-                index = parent.pointerList.index(leafNode)
-                parent.indexValueList.insert(index, leafNode.keyValueList[mid].key)
-                parent.pointerList.insert(index + 1, newLeaf)
-                newLeaf.parent = leafNode.parent
-            # 设置分裂结点元素
-            leafNode.keyValueList = leafNode.keyValueList[:mid]
-            # 设置叶结点之间指针
-            newLeaf.brother = leafNode.brother
-            leafNode.brother = newLeaf
-            return leafNode.parent
-
-        # 递归插入，从根结点递归嵌套进入叶结点完成插入，插入之后再做处理（逐步向上）使结点数目合法
-        def insert_node(n, canInsert=True):
-            if n.isLeaf():
-                # 如果是叶结点，找到合适的位置完成插入
-                if canInsert:
-                    sortedList = [x.key for x in n.keyValueList]
-                    index = binary_search_right(sortedList, keyValue.key)
-                    n.keyValueList.insert(index, keyValue)
-                # 如果叶结点满了，分裂叶结点，并再次从父结点开始插入（假插入，为的是解决父节点可能会满的问题）
-                if n.isFull():
-                    insert_node(split_leaf(n), False)
-                else:
-                    return
-            else:
-                # 如果是内结点，满了，就分裂，从其父节点开始插入
-                # 如果父节点也满了，分裂并从父节点的父节点开始插入，以此类推，确保所有结点数目合法
-                if n.isFull():
-                    insert_node(split_inter(n), canInsert)
-                else:
-                    if canInsert:
-                        # 内结点不满，寻找适合插入的子女结点进行插入
-                        index = binary_search_right(n.indexValueList, keyValue.key)
-                        insert_node(n.pointerList[index], canInsert)
+            indexValues.append(interNode.indexValueList[start - 1])
+            newNodes.append(newNode)
+        # 分裂后的结点只剩下第一片
+        del interNode.indexValueList[points[1] - 1:]
+        del interNode.pointerList[points[1]:]
+        del interNode.countList[points[1]:]
+        if self.__stats is not None:
+            self.__stats.add('inter_splits', len(newNodes))
+        return self.__add_brothers(interNode, indexValues, newNodes)
+
+    # 叶结点满了就分裂，父结点多了子女也可能满，逐层向上分裂，确保所有结点数目合法
+    def __split_up(self, leaf):
+        if leaf.isFull():
+            node = self.__split_leaf(leaf)
+            while node.isFull():
+                node = self.__split_inter(node)
+
+    def insert(self, keyValue):
+        # 从根结点开始向下搜索找到对应的叶结点，在合适的位置完成插入
+        # 插入一定成功，向下查找时沿途的计数直接加1
+        key = keyValue.key
+        node = self.__root
+        while not node.isLeaf():
+            i = bisect_right(node.indexValueList, key)
+            node.countList[i] += 1
+            node = node.pointerList[i]
+        if self.__stats is not None:
+            self.__visit(node)
+        if self.__posting:
+            # 键值已存在时追加到倒排表末尾，叶结点元素个数不变
+            index = bisect_left(node.keyList, key)
+            if index < len(node.keyList) and node.keyList[index] == key:
+                node.valueList[index].append(keyValue.value)
+                return
+            node.keyList.insert(index, key)
+            node.valueList.insert(index, [keyValue.value])
+        else:
+            index = bisect_right(node.keyList, key)
+            node.keyList.insert(index, key)
+            node.valueList.insert(index, keyValue.value)
+        self.__split_up(node)
 
-        insert_node(node)
+    # 批量插入，先按键值排序，每片受影响的叶结点只从根结点向下查找一次
+    # 落在同一叶结点的键值一次归并进去，然后该叶结点及其祖先最多各分裂一次
+    def insert_many(self, keyValues):
+        batch = sorted(keyValues, key=attrgetter('key'))
+        keyList = [keyValue.key for keyValue in batch]
+        j = 0
+        node = self.__root
+        while j < len(batch):
+            # 键值有序，下一片叶结点在右边，从上一片叶结点向上找到包含该键值的最近祖先，再向下查找
+            # 向下查找时记录叶结点键值范围的上界（路径上右侧最近的索引值）
+            key = keyList[j]
+            node = node.parent
+            while node is not None and (not node.indexValueList or key >= node.indexValueList[-1]):
+                node = node.parent
+            if node is None:
+                node = self.__root
+            bound = None
+            while not node.isLeaf():
+                i = bisect_right(node.indexValueList, key)
+                if i < len(node.indexValueList):
+                    bound = node.indexValueList[i]
+                node = node.pointerList[i]
+            if self.__stats is not None:
+                self.__visit(node)
+            end = len(batch) if bound is None else bisect_left(keyList, bound, j)
+            # 相同键值时新键值排在后面，与单个插入一致
+            # 新键值少时直接在数组中插入，多时与叶结点原有的键值一次归并
+            # 倒排表模式下已存在的键值（包括本批前面刚插入的）直接追加到倒排表
+            oldKeys, oldValues = node.keyList, node.valueList
+            if end - j <= 8:
+                p = 0
+                for i in range(j, end):
+                    p = bisect_right(oldKeys, keyList[i], p)
+                    if self.__posting:
+                        if p and oldKeys[p - 1] == keyList[i]:
+                            oldValues[p - 1].append(batch[i].value)
+                            continue
+                        oldValues.insert(p, [batch[i].value])
+                    else:
+                        oldValues.insert(p, batch[i].value)
+                    oldKeys.insert(p, keyList[i])
+                    p += 1
+            else:
+                newKeys, newValues = self.__new_keys(), []
+                p = 0
+                for i in range(j, end):
+                    q = bisect_right(oldKeys, keyList[i], p)
+                    newKeys.extend(oldKeys[p:q])
+                    newValues.extend(oldValues[p:q])
+                    p = q
+                    if self.__posting:
+                        if newKeys and newKeys[-1] == keyList[i]:
+                            newValues[-1].append(batch[i].value)
+                            continue
+                        newValues.append([batch[i].value])
+                    else:
+                        newValues.append(batch[i].value)
+                    newKeys.append(keyList[i])
+                newKeys.extend(oldKeys[p:])
+                newValues.extend(oldValues[p:])
+                node.keyList, node.valueList = newKeys, newValues
+            self.__add_count(node, end - j)
+            self.__split_up(node)
+            j = end
 
     # 打印整棵树
     def show(self):
@@ -159,269 +356,556 @@ class BplusTree:
             else:
                 if not w.isLeaf():
                     if w.parent is None:
-                        print(w.indexValueList, 'inter height = ', h, 'parent = None')
+                        print(list(w.indexValueList), 'inter height = ', h, 'parent = None')
                     else:
-                        print(w.indexValueList, 'inter height = ', h, 'parent = ', w.parent.indexValueList)
+                        print(list(w.indexValueList), 'inter height = ', h, 'parent = ', list(w.parent.indexValueList))
                     if h == height:
                         height += 1
                     queue.extend([[i, height] for i in w.pointerList])
                 else:
                     if w.parent is None:
-                        print([v.key for v in w.keyValueList], 'leaf height =', h, 'parent = None')
+                        print(list(w.keyList), 'leaf height =', h, 'parent = None')
                     else:
-                        print([v.key for v in w.keyValueList], 'leaf height =', h, 'parent = ', w.parent.indexValueList)
+                        print(list(w.keyList), 'leaf height =', h, 'parent = ', list(w.parent.indexValueList))
+
+    # 依次给出每片叶结点的(键值列, 值列)，直接引用结点内部的数组，只读，遍历期间不要修改树
+    def columns(self):
+        leaf = self.__leaf
+        while leaf is not None:
+            yield leaf.keyList, leaf.valueList
+            leaf = leaf.brother
+
+    @property
+    def order(self):
+        return self.__order
+
+    @property
+    def typecode(self):
+        return self.__typecode
+
+    @property
+    def posting(self):
+        return self.__posting
+
+    # 挂上性能计数（见Instrument.py），stats为None时取下
+    # 挂上时用实例属性包装各个公开操作，每次调用作为一次操作计数；没挂时不经过包装，内部只多一次is None判断
+    def instrument(self, stats=None):
+        for name in operations + generator_operations:
+            self.__dict__.pop(name, None)
+        self.__stats = stats
+        if stats is not None:
+            for name in operations:
+                setattr(self, name, stats.wrap(name, getattr(self, name)))
+            for name in generator_operations:
+                setattr(self, name, stats.wrap_generator(name, getattr(self, name)))
+            stats.sources['tree'] = self.shape
+        return stats
+
+    @property
+    def stats(self):
+        return self.__stats
+
+    # 树的形状：高度，叶结点和内结点的个数，填充率（叶结点为键值个数/(order-1)，内结点为子女个数/order）的直方图，
+    # 直方图按10%分桶，键为桶的下界
+    def shape(self):
+        leafFill, interFill = Counter(), Counter()
+        height = 1
+        level = [self.__root]
+        while not level[0].isLeaf():
+            for node in level:
+                interFill[min(9, len(node.pointerList) * 10 // self.__order) / 10] += 1
+            level = [child for node in level for child in node.pointerList]
+            height += 1
+        for node in level:
+            leafFill[min(9, len(node.keyList) * 10 // (self.__order - 1)) / 10] += 1
+        return {'height': height, 'leaves': len(level), 'inter_nodes': sum(interFill.values()),
+                'leaf_fill': {str(bucket): leafFill[bucket] for bucket in sorted(leafFill)},
+                'inter_fill': {str(bucket): interFill[bucket] for bucket in sorted(interFill)}}
 
     # 依次输出所有叶结点存储的键值对
     def leaves(self):
         result = []
         leaf = self.__leaf
         while True:
-            result.extend(leaf.keyValueList)
+            result.extend(self.__key_values(leaf.keyList, leaf.valueList))
             if leaf.brother is None:
                 return result
             else:
                 leaf = leaf.brother
 
+    # 查找第一个键值>=key（after为True时为>key）的位置，返回所在叶结点及下标
+    # 存在重复键值时，相同的键值可能跨越多个叶结点，故内结点按左边界向下查找，再沿brother指针修正
+    def __locate(self, key, after=False):
+        bisect = bisect_right if after else bisect_left
+        node = self.__root
+        while not node.isLeaf():
+            node = node.pointerList[bisect(node.indexValueList, key)]
+        if self.__stats is not None:
+            self.__visit(node)
+        i = bisect(node.keyList, key)
+        while i == len(node.keyList) and node.brother is not None:
+            node = node.brother
+            i = 0
+            if self.__stats is not None:
+                self.__stats.add('brother_visits')
+        return node, i
+
+    # 查找最后一个键值<=key（before为True时为<key）的位置，返回所在叶结点及下标，不存在时下标为-1
+    def __locate_last(self, key, before=False):
+        bisect = bisect_left if before else bisect_right
+        node = self.__root
+        while not node.isLeaf():
+            node = node.pointerList[bisect(node.indexValueList, key)]
+        if self.__stats is not None:
+            self.__visit(node)
+        i = bisect(node.keyList, key) - 1
+        while i < 0:
+            prev = self.__prev_leaf(node)
+            if prev is None:
+                break
+            node = prev
+            i = len(node.keyList) - 1
+        return node, i
+
+    # 叶结点只有指向后一片的brother指针，前一片叶结点通过parent向上找到左兄弟子树，再沿最右子女向下
+    @staticmethod
+    def __prev_leaf(leaf):
+        node = leaf
+        while node.parent is not None:
+            parent = node.parent
+            i = parent.pointerList.index(node)
+            if i > 0:
+                node = parent.pointerList[i - 1]
+                while not node.isLeaf():
+                    node = node.pointerList[-1]
+                return node
+            node = parent
+        return None
+
+    # 把叶结点中一段键值列和值列展开成KeyValue，倒排表模式下每个值对应一个KeyValue
+    def __key_values(self, keyList, valueList):
+        if self.__posting:
+            return (KeyValue(key, value) for key, values in zip(keyList, valueList) for value in values)
+        return map(KeyValue, keyList, valueList)
+
+    # 沿叶结点链依次给出落在范围内的(叶结点, 起始下标, 结束下标)，reverse为True时从大到小
+    def __ranges(self, low, high, reverse, lowInclusive, highInclusive):
+        if not reverse:
+            if low is None:
+                leaf, index = self.__leaf, 0
+            else:
+                leaf, index = self.__locate(low, not lowInclusive)
+            while leaf is not None:
+                keyList = leaf.keyList
+                if high is None:
+                    end = len(keyList)
+                elif highInclusive:
+                    end = bisect_right(keyList, high, index)
+                else:
+                    end = bisect_left(keyList, high, index)
+                yield leaf, index, end
+                if end < len(keyList):
+                    return
+                leaf = leaf.brother
+                index = 0
+        else:
+            if high is None:
+                leaf = self.__root
+                while not leaf.isLeaf():
+                    leaf = leaf.pointerList[-1]
+                index = len(leaf.keyList) - 1
+            else:
+                leaf, index = self.__locate_last(high, not highInclusive)
+            while leaf is not None:
+                keyList = leaf.keyList
+                if low is None:
+                    begin = 0
+                elif lowInclusive:
+                    begin = bisect_left(keyList, low, 0, index + 1)
+                else:
+                    begin = bisect_right(keyList, low, 0, index + 1)
+                yield leaf, begin, index + 1
+                if begin > 0:
+                    return
+                leaf = self.__prev_leaf(leaf)
+                if leaf is not None:
+                    index = len(leaf.keyList) - 1
+
+    # 惰性范围查询，沿叶结点链逐个产出KeyValue，代价为O(log n + k)
+    # reverse为True时从大到小遍历，limit限制产出的个数，lowInclusive/highInclusive控制边界是否包含
+    # 分页时可用上一页最后的键值作为新的开区间边界继续查询，见Cursor
+    # 遍历期间不要修改树
+    def scan(self, low=None, high=None, reverse=False, limit=None,
+             lowInclusive=True, highInclusive=True):
+        if low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        ranges = self.__ranges(low, high, reverse, lowInclusive, highInclusive)
+        if not reverse:
+            items = chain.from_iterable(self.__key_values(leaf.keyList[begin:end], leaf.valueList[begin:end])
+                                        for leaf, begin, end in ranges)
+        elif self.__posting:
+            items = (KeyValue(leaf.keyList[i], value) for leaf, begin, end in ranges
+                     for i in range(end - 1, begin - 1, -1) for value in reversed(leaf.valueList[i]))
+        else:
+            items = (KeyValue(leaf.keyList[i], leaf.valueList[i]) for leaf, begin, end in ranges
+                     for i in range(end - 1, begin - 1, -1))
+        yield from islice(items, limit)
+
+    # 键值小于key（after为True时为不大于key）的键值对个数，从根结点向下，每层累加左边子树的计数，O(log n)
+    # 索引值左边子树的键值都不大于它，右边子树的键值都不小于它，
+    # 所以重复键值跨越多个结点时也不需要像__locate那样沿brother指针修正
+    def __rank(self, key, after=False):
+        bisect = bisect_right if after else bisect_left
+        node = self.__root
+        total = 0
+        while not node.isLeaf():
+            i = bisect(node.indexValueList, key)
+            total += sum(node.countList[:i])
+            node = node.pointerList[i]
+        if self.__stats is not None:
+            self.__visit(node)
+        i = bisect(node.keyList, key)
+        if self.__posting:
+            return total + sum(map(len, node.valueList[:i]))
+        return total + i
+
+    # 统计范围内键值对的个数，只数不取值，倒排表模式下累加倒排表长度
+    # 用上下界的排名相减，O(log n)，与范围内键值对的个数无关
+    def count(self, low=None, high=None, lowInclusive=True, highInclusive=True):
+        if low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        begin = 0 if low is None else self.__rank(low, not lowInclusive)
+        end = len(self) if high is None else self.__rank(high, highInclusive)
+        return max(0, end - begin)
+
+    def __len__(self):
+        return self.__size(self.__root)
+
+    # 键值小于key的键值对个数，即key第一次出现的位置（从0开始），O(log n)
+    def rank(self, key):
+        return self.__rank(key)
+
+    # 按键值顺序第i个键值对（从0开始，负数从末尾数起），从根结点向下按计数选择子女，O(log n)
+    def select(self, i):
+        total = len(self)
+        if i < 0:
+            i += total
+        if not 0 <= i < total:
+            raise IndexError('index out of range')
+        node = self.__root
+        while not node.isLeaf():
+            j = 0
+            while i >= node.countList[j]:
+                i -= node.countList[j]
+                j += 1
+            node = node.pointerList[j]
+        if self.__posting:
+            for key, values in zip(node.keyList, node.valueList):
+                if i < len(values):
+                    return KeyValue(key, values[i])
+                i -= len(values)
+        return KeyValue(node.keyList[i], node.valueList[i])
+
+    # 点查询，返回键值对应的所有值，倒排表模式下只需找到一个位置
+    def get(self, key):
+        if self.__posting:
+            leaf, index = self.__locate(key)
+            if index < len(leaf.keyList) and leaf.keyList[index] == key:
+                return list(leaf.valueList[index])
+            return []
+        return [keyValue.value for keyValue in self.scan(key, key)]
+
+    # 批量点查询，keys为从小到大的键值序列，逐个产出该键值对应的所有值（没有时为空list），结果与逐个get相同
+    # 始终记住上一个键值第一个>=它的位置（叶结点, 下标），它之前的键值都小于当前键值：
+    # 当前键值不大于该叶结点的最大键值时直接在叶结点内从该位置向后二分，否则沿brother指针看后面一片，
+    # 还不在其中才从根结点重新向下查找；相邻的查询大多落在同一片或下一片叶结点
+    def get_many(self, keys):
+        leaf, index = None, 0
+        for key in keys:
+            if leaf is not None and leaf.keyList and key <= leaf.keyList[-1]:
+                index = bisect_left(leaf.keyList, key, index)
+                if self.__stats is not None:
+                    self.__stats.add('node_visits')
+                    self.__stats.add('comparisons', (len(leaf.keyList) - index).bit_length())
+            elif leaf is not None and leaf.brother is not None and key <= leaf.brother.keyList[-1]:
+                leaf = leaf.brother
+                index = bisect_left(leaf.keyList, key)
+                if self.__stats is not None:
+                    self.__stats.add('brother_visits')
+                    self.__stats.add('comparisons', len(leaf.keyList).bit_length())
+            else:
+                leaf, index = self.__locate(key)
+            if self.__posting:
+                if index < len(leaf.keyList) and leaf.keyList[index] == key:
+                    yield list(leaf.valueList[index])
+                else:
+                    yield []
+                continue
+            # 重复的键值可能延续到后面的叶结点
+            values = []
+            node, i = leaf, index
+            while node is not None:
+                end = bisect_right(node.keyList, key, i)
+                values.extend(node.valueList[i:end])
+                if end < len(node.keyList):
+                    break
+                node, i = node.brother, 0
+            yield values
+
+    # 分页游标，见Cursor
+    def cursor(self, low=None, high=None, reverse=False, lowInclusive=True, highInclusive=True):
+        return Cursor(self, low, high, reverse, lowInclusive, highInclusive)
+
     # 查询，从根结点开始，逐渐向下进入内结点，最后进入叶结点
     def search(self, low=None, high=None):
         result = []
-        node = self.__root
-        leaf = self.__leaf
         if low is None and high is None:
             raise ValueError('no range')
         elif low is not None and high is not None and low > high:
             raise ValueError('lower can not be greater than upper')
 
-        # 寻找键值所在叶结点
-        def search_key(n, k):
-            if n.isLeaf():
-                sortedList = [x.key for x in n.keyValueList]
-                i = binary_search_left(sortedList, k)
-                return i, n
-            else:
-                i = binary_search_right(n.indexValueList, k)
-                return search_key(n.pointerList[i], k)
-
         if low is None:
-            # 寻找所有<=high的键值对，从第一片叶结点出发，沿着brother指针往后寻找，直到键值大于high
-            while True:
-                for keyValue in leaf.keyValueList:
-                    if keyValue.key <= high:
-                        result.append(keyValue)
-                    else:
-                        return result
-                    if leaf.brother is None:
-                        return result
-                    else:
-                        leaf = leaf.brother
-        elif high is None:
-            # 寻找所有>=low的键值对，先找到存储键值为low或者小于low的结点，从该叶结点往后查找直到最后
-            index, leaf = search_key(node, low)
-            result.extend(leaf.keyValueList[index:])
-            while True:
-                if leaf.brother is None:
-                    return result
-                else:
-                    leaf = leaf.brother
-                    result.extend(leaf.keyValueList)
+            # 没有下界，从第一片叶结点出发
+            leaf, index = self.__leaf, 0
         else:
-            # 如果low和high相等，先找到存储键值为low或者小于low的结点
-            # 如果该结点有和low相等的键值，则返回，否则返回空的list
-            if low == high:
-                index, leaf = search_key(node, low)
-                try:
-                    if leaf.keyValueList[index].key == low:
-                        result.append(leaf.keyValueList[index])
-                        return result
-                    else:
-                        return result
-                except IndexError:
-                    return result
-            else:
-                # 分别找到存储键值low和high的结点，从low所在结点出发往后寻找直到high所在结点
-                indexLow, leafLow = search_key(node, low)
-                indexHigh, leafHigh = search_key(node, high)
-                if leafLow is leafHigh:
-                    result.extend(leafLow.keyValueList[indexLow:indexHigh + 1])
-                    return result
-                else:
-                    result.extend(leafLow.keyValueList[indexLow:])
-                    leaf = leafLow
-                    while True:
-                        if leaf.brother is leafHigh:
-                            result.extend(leafHigh.keyValueList[:indexHigh + 1])
-                            return result
-                        else:
-                            result.extend(leaf.brother.keyValueList)
-                            leaf = leaf.brother
-
-    # 根据键值删除
-    def delete(self, key):
-        def merge(node, index):
-            leftChild = node.pointerList[index]
-            rightChild = node.pointerList[index + 1]
+            # 先找到第一个键值>=low的位置
+            leaf, index = self.__locate(low)
+        # 沿着brother指针往后寻找，直到键值大于high，每片叶结点内用二分查找确定上界
+        while leaf is not None:
+            end = len(leaf.keyList) if high is None else bisect_right(leaf.keyList, high)
+            result.extend(self.__key_values(leaf.keyList[index:end], leaf.valueList[index:end]))
+            if end < len(leaf.keyList):
+                return result
+            leaf = leaf.brother
+            index = 0
+        return result
+
+    def __merge(self, node, index):
+        leftChild = node.pointerList[index]
+        rightChild = node.pointerList[index + 1]
+        if leftChild.isLeaf():
+            # 如果合并的是叶结点，将右儿子值复制到左儿子
+            leftChild.keyList.extend(rightChild.keyList)
+            leftChild.valueList.extend(rightChild.valueList)
+            leftChild.brother = rightChild.brother
+        else:
+            # 如果合并的是内结点，将右儿子索引值和node结点index索引值复制到左儿子
+            leftChild.indexValueList.append(node.indexValueList[index])
+            leftChild.indexValueList.extend(rightChild.indexValueList)
+            # 将右儿子结点复制到左儿子
+            for rightChildChild in rightChild.pointerList:
+                rightChildChild.parent = leftChild
+            leftChild.pointerList.extend(rightChild.pointerList)
+            leftChild.countList.extend(rightChild.countList)
+        if self.__stats is not None:
+            self.__stats.add('leaf_merges' if leftChild.isLeaf() else 'inter_merges')
+        # 在node结点删除右儿子，右儿子的计数并入左儿子
+        del node.pointerList[index + 1]
+        node.countList[index] += node.countList[index + 1]
+        del node.countList[index + 1]
+        # 在node结点删除索引值（已经移入左儿子作为合并后的结点 或者 合并叶结点之后要删除该索引值）
+        # 索引值可能重复，故按位置删除
+        del node.indexValueList[index]
+        if not node.indexValueList and node.parent is None:
+            # 如果node结点索引清空了，删掉该结点，重置根结点
+            node.pointerList[0].parent = None
+            self.__root = node.pointerList[0]
+            del node
+            if self.__stats is not None:
+                self.__stats.add('root_merges')
+
+    # 从index借count个元素给index+1
+    def __transfer_leftToRight(self, node, index, count=1):
+        leftChild = node.pointerList[index]
+        rightChild = node.pointerList[index + 1]
+        if not leftChild.isLeaf():
+            # 将index的最后count个结点移到index+1的开头
+            moved = leftChild.pointerList[-count:]
+            for pointer in moved:
+                pointer.parent = rightChild
+            rightChild.pointerList[0:0] = moved
+            rightChild.countList[0:0] = leftChild.countList[-count:]
+            movedSize = sum(leftChild.countList[-count:])
+            # 左儿子末尾count-1个索引值和node的index索引值移到index+1的开头
+            n = len(leftChild.indexValueList)
+            indexValues = leftChild.indexValueList[n - count + 1:]
+            indexValues.append(node.indexValueList[index])
+            rightChild.indexValueList[0:0] = indexValues
+            # 更新node的index索引值
+            node.indexValueList[index] = leftChild.indexValueList[n - count]
+            # 删除index的最后count个结点和索引值
+            del leftChild.pointerList[-count:]
+            del leftChild.countList[-count:]
+            del leftChild.indexValueList[n - count:]
+        else:
+            # 将index的最后count个键值对移到index+1的开头
+            movedSize = sum(map(len, leftChild.valueList[-count:])) if self.__posting else count
+            rightChild.keyList[0:0] = leftChild.keyList[-count:]
+            rightChild.valueList[0:0] = leftChild.valueList[-count:]
+            del leftChild.keyList[-count:]
+            del leftChild.valueList[-count:]
+            # 更新node的index索引值
+            node.indexValueList[index] = self.__separator(leftChild, rightChild)
+        node.countList[index] -= movedSize
+        node.countList[index + 1] += movedSize
+        if self.__stats is not None:
+            self.__stats.add('inter_borrows' if not leftChild.isLeaf() else 'leaf_borrows')
+
+    # 从index+1借count个元素给index
+    def __transfer_rightToLeft(self, node, index, count=1):
+        leftChild = node.pointerList[index]
+        rightChild = node.pointerList[index + 1]
+        if not leftChild.isLeaf():
+            # 将index+1的前count个结点追加到index的末尾
+            moved = rightChild.pointerList[:count]
+            for pointer in moved:
+                pointer.parent = leftChild
+            leftChild.pointerList.extend(moved)
+            leftChild.countList.extend(rightChild.countList[:count])
+            movedSize = sum(rightChild.countList[:count])
+            # node的index索引值和右儿子开头count-1个索引值追加到index的末尾
+            leftChild.indexValueList.append(node.indexValueList[index])
+            leftChild.indexValueList.extend(rightChild.indexValueList[:count - 1])
+            # 更新node的index索引值
+            node.indexValueList[index] = rightChild.indexValueList[count - 1]
+            # 删除index+1的前count个结点和索引值
+            del rightChild.pointerList[:count]
+            del rightChild.countList[:count]
+            del rightChild.indexValueList[:count]
+        else:
+            # 将index+1的前count个键值对追加到index的末尾
+            movedSize = sum(map(len, rightChild.valueList[:count])) if self.__posting else count
+            leftChild.keyList.extend(rightChild.keyList[:count])
+            leftChild.valueList.extend(rightChild.valueList[:count])
+            del rightChild.keyList[:count]
+            del rightChild.valueList[:count]
+            # 更新node的index索引值
+            node.indexValueList[index] = self.__separator(leftChild, rightChild)
+        node.countList[index] += movedSize
+        node.countList[index + 1] -= movedSize
+        if self.__stats is not None:
+            self.__stats.add('inter_borrows' if not leftChild.isLeaf() else 'leaf_borrows')
+
+    # 自底向上调整，结点少于一半时，要么与兄弟结点合并（父结点随之少一个子女，继续向上调整），
+    # 要么从兄弟结点借元素，使两者元素个数平均
+    def __rebalance(self, node):
+        while node.parent is not None and node.isLessThanHalf():
+            parent = node.parent
+            index = parent.pointerList.index(node)
+            # 最右的结点与左兄弟调整，其余结点统一与右兄弟调整
+            if index == len(parent.indexValueList):
+                index -= 1
+            leftChild = parent.pointerList[index]
+            rightChild = parent.pointerList[index + 1]
             if leftChild.isLeaf():
-                # 如果合并的是叶结点，将右儿子值复制到左儿子
-                leftChild.keyValueList = leftChild.keyValueList \
-                                         + rightChild.keyValueList
-                leftChild.brother = rightChild.brother
-            else:
-                # 如果合并的是内结点，将右儿子索引值和node结点index索引值复制到左儿子
-                leftChild.indexValueList = \
-                    leftChild.indexValueList + [node.indexValueList[index]] \
-                    + rightChild.indexValueList
-                # 将右儿子结点复制到左儿子
-                leftChild.pointerList = leftChild.pointerList + rightChild.pointerList
-                for leftChildChild in leftChild.pointerList:
-                    leftChildChild.parent = leftChild
-            # 在node结点删除右儿子
-            node.pointerList.remove(rightChild)
-            # 在node结点删除索引值（已经移入左儿子作为合并后的结点 或者 合并叶结点之后要删除该索引值）
-            node.indexValueList.remove(node.indexValueList[index])
-            if not node.indexValueList and node.parent is None:
-                # 如果node结点索引清空了，删掉该结点，重置根结点
-                node.pointerList[0].parent = None
-                self.__root = node.pointerList[0]
-                del node
-                return self.__root
+                leftSize, rightSize = len(leftChild.keyList), len(rightChild.keyList)
+                canMerge = leftSize + rightSize <= self.__order - 1
             else:
-                return node.parent
-
-        def transfer_leftToRight(node, index):
-            leftChild = node.pointerList[index]
-            rightChild = node.pointerList[index + 1]
-            if not leftChild.isLeaf():
-                # 将index的最后一个结点追加到index+1的第一个结点
-                rightChild.pointerList. \
-                    insert(0, leftChild.pointerList[-1])
-                leftChild.pointerList[-1].parent = \
-                    rightChild
-                # 追加index+1的索引值
-                rightChild.indexValueList \
-                    .insert(0, node.indexValueList[index])
-                # 更新node的index+1的索引值
-                node.indexValueList[index] = \
-                    leftChild.indexValueList[-1]
-                # 删除index的最后一个结点和索引值
-                leftChild.pointerList.pop()
-                leftChild.indexValueList.pop()
-            else:
-                # 将index的最后一个结点追加到index+1的第一个结点
-                rightChild.keyValueList. \
-                    insert(0, leftChild.keyValueList[-1])
-                # 删除index最后一个结点
-                leftChild.keyValueList.pop()
-                # 更新node的index索引值
-                node.indexValueList[index] = rightChild. \
-                    keyValueList[0].key
-
-        def transfer_rightToLeft(node, index):
-            leftChild = node.pointerList[index]
-            rightChild = node.pointerList[index + 1]
-            if not leftChild.isLeaf():
-                # 将index+1的第一个结点追加到index的末尾
-                leftChild.pointerList. \
-                    append(rightChild.pointerList[0])
-                rightChild.pointerList[0].parent = \
-                    leftChild
-                # 追加index的index索引值
-                leftChild.indexValueList. \
-                    append(node.indexValueList[index])
-                # 更新node的index索引值
-                node.indexValueList[index] = \
-                    rightChild.indexValueList[0]
-                # 删除index+1的第一个结点和索引值
-                rightChild.pointerList. \
-                    remove(rightChild.pointerList[0])
-                rightChild.indexValueList. \
-                    remove(rightChild.indexValueList[0])
+                leftSize, rightSize = len(leftChild.pointerList), len(rightChild.pointerList)
+                canMerge = leftSize + rightSize <= self.__order
+            if canMerge:
+                self.__merge(parent, index)
+                node = parent
+            elif node is leftChild:
+                self.__transfer_rightToLeft(parent, index, (leftSize + rightSize) // 2 - leftSize)
+                return
             else:
-                # 将index+1的第一个结点追加到index的末尾
-                leftChild.keyValueList. \
-                    append(rightChild.keyValueList[0])
-                # 删除index+1的第一个结点
-                rightChild.keyValueList. \
-                    remove(rightChild.keyValueList[0])
-                # 更新node的index索引值
-                node.indexValueList[index] = rightChild. \
-                    keyValueList[0].key
-
-        # 递归删除
-        def delete_node(node, canDelete=True):
-            if node.isLeaf():
-                if canDelete:
-                    # 找到叶结点，删除对应的键值对（如果存在）
-                    sortedList = [x.key for x in node.keyValueList]
-                    index = binary_search_left(sortedList, key)
+                self.__transfer_leftToRight(parent, index, (leftSize + rightSize) // 2 - rightSize)
+                return
+
+    # 删除叶结点中index位置的键值对，倒排表模式下只删除倒排表中的一个值，倒排表空了才删除该键值
+    # 不更新祖先中的计数，由调用方在调整之前用__add_count一次更新
+    def __remove(self, leaf, index, position=0):
+        if self.__posting:
+            values = leaf.valueList[index]
+            del values[position]
+            if values:
+                return
+        del leaf.keyList[index]
+        del leaf.valueList[index]
+
+    # 根据键值删除，删除成功返回0，键值不存在返回-1
+    def delete(self, key):
+        # 找到键值最左出现的位置，删除对应的键值对（如果存在）
+        leaf, index = self.__locate(key)
+        if index == len(leaf.keyList) or leaf.keyList[index] != key:
+            return -1
+        self.__remove(leaf, index)
+        self.__add_count(leaf, -1)
+        self.__rebalance(leaf)
+        return 0
+
+    # 删除键值对应的所有键值对，返回删除的个数
+    def delete_all(self, key):
+        if self.__posting:
+            leaf, index = self.__locate(key)
+            if index == len(leaf.keyList) or leaf.keyList[index] != key:
+                return 0
+            count = len(leaf.valueList[index])
+            del leaf.keyList[index]
+            del leaf.valueList[index]
+            self.__add_count(leaf, -count)
+            self.__rebalance(leaf)
+            return count
+        return self.delete_many([key] * self.count(key, key))
+
+    # 删除一个键值和值都相等的键值对，删除成功返回0，不存在返回-1
+    def delete_value(self, key, value):
+        leaf, index = self.__locate(key)
+        while leaf is not None:
+            for i in range(index, len(leaf.keyList)):
+                if leaf.keyList[i] != key:
+                    return -1
+                if self.__posting:
                     try:
-                        keyValue = node.keyValueList[index]
-                    except IndexError:
+                        position = leaf.valueList[i].index(value)
+                    except ValueError:
                         return -1
-                    else:
-                        if keyValue.key != key:
-                            return -1
-                        else:
-                            # 正常删除之后，可能会引起结点合并等动作
-                            node.keyValueList.remove(keyValue)
-                            # 如果删除后结点数少于一半，需要在父节点进行调整，要么合并，要么从兄弟结点借
-                            if node.isLessThanHalf():
-                                delete_node(node.parent, False)
-                            else:
-                                # 如果删除后结点数目仍然合法，父节点的索引值可能需要改变
-                                if node.parent is not None:
-                                    index = binary_search_right(node.parent.indexValueList, key)
-                                    parent_indexList = node.parent.indexValueList
-                                    if node.keyValueList[0].key > parent_indexList[index - 1]:
-                                        parent_indexList[index - 1] = node.keyValueList[0].key
-                            return 0
-            else:
-                index = binary_search_right(node.indexValueList, key)
-                # 索引到的结点是最右的，可能需要从左兄弟结点借
-                if index == len(node.indexValueList):
-                    leftChild = node.pointerList[index - 1]
-                    rightChild = node.pointerList[index]
-                    # 如果索引到要删除key所在结点子女少于一半，则要合并或者借元素，否则正常删除
-                    if rightChild.isLessThanHalf():
-                        if rightChild.isLeaf():
-                            # 如果可以合并，就合并，否则从左兄弟借
-                            if len(rightChild.keyValueList) + len(leftChild.keyValueList) \
-                                    <= self.__order - 1:
-                                return delete_node(merge(node, index - 1), canDelete)
-                            else:
-                                transfer_leftToRight(node, index - 1)
-                        else:
-                            # 如果可以合并，则合并，否则从左兄弟借
-                            if len(rightChild.pointerList) + len(leftChild.pointerList) \
-                                    <= self.__order:
-                                return delete_node(merge(node, index - 1), canDelete)
-                            else:
-                                transfer_leftToRight(node, index - 1)
-                    else:
-                        if canDelete:
-                            return delete_node(rightChild, canDelete)
-                else:
-                    # 索引到的结点不是最右，统一从右兄弟结点借
-                    # 操作与上类似
-                    leftChild = node.pointerList[index]
-                    rightChild = node.pointerList[index + 1]
-                    if leftChild.isLessThanHalf():
-                        if leftChild.isLeaf():
-                            if len(rightChild.keyValueList) + len(leftChild.keyValueList) \
-                                    <= self.__order - 1:
-                                return delete_node(merge(node, index), canDelete)
-                            else:
-                                transfer_rightToLeft(node, index)
-                        else:
-                            if len(rightChild.pointerList) + len(leftChild.pointerList) \
-                                    <= self.__order:
-                                return delete_node(merge(node, index), canDelete)
-                            else:
-                                transfer_rightToLeft(node, index)
-                    else:
-                        if canDelete:
-                            return delete_node(leftChild, canDelete)
+                    self.__remove(leaf, i, position)
+                    self.__add_count(leaf, -1)
+                    self.__rebalance(leaf)
+                    return 0
+                if leaf.valueList[i] == value:
+                    self.__remove(leaf, i)
+                    self.__add_count(leaf, -1)
+                    self.__rebalance(leaf)
+                    return 0
+            leaf = leaf.brother
+            index = 0
+        return -1
 
-        return delete_node(self.__root)
+    # 批量删除，keys中每出现一次就删除一个对应的键值对，返回实际删除的个数
+    # 先排序，每片受影响的叶结点只从根结点向下查找一次，删完后该叶结点及其祖先最多各调整一次
+    def delete_many(self, keys):
+        keys = sorted(keys)
+        deleted = 0
+        j = 0
+        while j < len(keys):
+            leaf, index = self.__locate(keys[j])
+            if index == len(leaf.keyList):
+                # 剩余的键值都大于树中所有键值
+                break
+            # 不大于叶结点最大键值的键值都在这片叶结点中（只有等于最大键值的可能延续到后面的叶结点）
+            lastKey = leaf.keyList[-1]
+            end = bisect_right(keys, lastKey, j)
+            # 叶结点最多order-1个键值，直接在数组中删除
+            keyList = leaf.keyList
+            p = index
+            missing = 0
+            removed = 0
+            for key in keys[j:end]:
+                p = bisect_left(keyList, key, p)
+                if p < len(keyList) and keyList[p] == key:
+                    self.__remove(leaf, p)
+                    removed += 1
+                elif key == lastKey and not self.__posting:
+                    missing += 1
+            deleted += removed
+            self.__add_count(leaf, -removed)
+            self.__rebalance(leaf)
+            # 这片叶结点中已经没有的最大键值，留到下一轮到后面的叶结点中删除
+            j = end - missing
+        return deleted
 
 
 def test1():
@@ -459,9 +943,8 @@ def test2():
     bpTree = BplusTree(10)
     for kv in l1:
         bpTree.insert(kv)
-        print('insert ', kv)
     endTime = datetime.datetime.now()
-    print(str((endTime - startTime).seconds) + 's')
+    print(str((endTime - startTime).total_seconds()) + 's')
     print('end insert: ')
     print(len(bpTree.leaves()))
     bpTree.show()
@@ -476,5 +959,75 @@ def test2():
     print('Yes')
 
 
+# 随机插入、删除（单个和批量），每轮用有序列表核对count、rank、select
+# 整数键值和字节串键值（前缀压缩的叶结点、截断的索引值）各测一遍
+def test3(rounds=20, order=5):
+    import random
+    for typecode in ('i', 'bytes'):
+        convert = (lambda k: k) if typecode == 'i' else (lambda k: b'key%05d' % k)
+        for posting in (False, True):
+            model = sorted(convert(random.randint(1, 300)) for _ in range(500))
+            tree = BplusTree.bulk_load((KeyValue(key, key) for key in model), order, 0.7, typecode, posting)
+            right = True
+            for _ in range(rounds):
+                operation = random.randrange(4)
+                keys = [convert(random.randint(1, 300)) for _ in range(random.randint(1, 100))]
+                if operation == 0:
+                    for key in keys:
+                        tree.insert(KeyValue(key, key))
+                        insort(model, key)
+                elif operation == 1:
+                    tree.insert_many([KeyValue(key, key) for key in keys])
+                    for key in keys:
+                        insort(model, key)
+                elif operation == 2:
+                    for key in keys:
+                        tree.delete(key)
+                        i = bisect_left(model, key)
+                        if i < len(model) and model[i] == key:
+                            del model[i]
+                else:
+                    tree.delete_many(keys)
+                    for key in keys:
+                        i = bisect_left(model, key)
+                        if i < len(model) and model[i] == key:
+                            del model[i]
+                right = right and len(tree) == len(model) and tree.count() == len(model)
+                for _ in range(50):
+                    low, high = sorted(convert(random.randint(0, 301)) for _ in range(2))
+                    right = right and tree.count(low, high) == bisect_right(model, high) - bisect_left(model, low)
+                    right = right and tree.count(low, high, False, False) == \
+                        max(0, bisect_left(model, high) - bisect_right(model, low))
+                    right = right and tree.rank(low) == bisect_left(model, low)
+                    right = right and [x.key for x in tree.scan(low, high)] == \
+                        model[bisect_left(model, low):bisect_right(model, high)]
+                right = right and [tree.select(i).key for i in range(len(model))] == model
+                right = right and [x.key for x in tree.leaves()] == model
+            print('Right!' if right else 'Wrong!!!')
+
+
+# 100万个键值上count与len(search)的耗时对比
+def benchmark(records=1000000, order=64, queries=1000):
+    import random
+    keys = sorted(random.randint(1, records) for _ in range(records))
+    tree = BplusTree.bulk_load((KeyValue(key, None) for key in keys), order)
+    ranges = [sorted(random.randint(1, records) for _ in range(2)) for _ in range(queries)]
+    startTime = datetime.datetime.now()
+    for low, high in ranges:
+        len(tree.search(low, high))
+    endTime = datetime.datetime.now()
+    print('len(search):', (endTime - startTime).total_seconds() / queries * 1000, 'ms/query')
+    startTime = datetime.datetime.now()
+    for low, high in ranges:
+        tree.count(low, high)
+    endTime = datetime.datetime.now()
+    print('count:', (endTime - startTime).total_seconds() / queries * 1000, 'ms/query')
+    startTime = datetime.datetime.now()
+    for i in random.sample(range(records), queries):
+        tree.select(i)
+    endTime = datetime.datetime.now()
+    print('select:', (endTime - startTime).total_seconds() / queries * 1000, 'ms/query')
+
+
 if __name__ == '__main__':
     test2()
@@ -0,0 +1,127 @@
+import os
+from collections import OrderedDict
+
+frame_overhead = 120  # 每个缓存页在OrderedDict、大小表等簿记中的大致开销（字节）
+
+
+# 页文件，按固定大小的页读写，页号从0开始
+class PageFile:
+    def __init__(self, filename, pageSize):
+        self.pageSize = pageSize
+        mode = 'r+b' if os.path.exists(filename) else 'w+b'
+        self.file = open(filename, mode)
+        self.file.seek(0, os.SEEK_END)
+        self.pageCount = self.file.tell() // pageSize
+
+    def read(self, pageId):
+        self.file.seek(pageId * self.pageSize)
+        data = self.file.read(self.pageSize)
+        if len(data) != self.pageSize:
+            raise IOError('page ' + str(pageId) + ' is out of range')
+        return data
+
+    def write(self, pageId, data):
+        if len(data) > self.pageSize:
+            raise ValueError('page overflow')
+        self.file.seek(pageId * self.pageSize)
+        self.file.write(data.ljust(self.pageSize, b'\0'))
+        if pageId >= self.pageCount:
+            self.pageCount = pageId + 1
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+# LRU缓冲池，缓存反序列化后的页对象，总大小不超过memory字节
+# 反序列化后的页（Python的数组、list和每个值一个bytes对象）比磁盘上的页大好几倍，
+# 所以按页对象自己报告的内存占用（footprint()）加上簿记开销计算大小，而不是按页大小计算
+# 页在pin住期间可能被修改，取页、放入新页和释放（最后一次unpin）时重新计算它的大小
+# load(pageId, data)把页内容还原成对象，对象的toBytes()把对象写回页
+# 正在使用的页需要pin住，pin住的页不会被换出；所有页都被pin住时允许暂时超出容量，且至少保留一页
+class BufferPool:
+    def __init__(self, pageFile, load, memory=1024 * 1024):
+        self.pageFile = pageFile
+        self.load = load
+        self.memory = memory
+        self.used = 0  # 缓存的页对象的总大小（字节）
+        self.sizes = dict()  # 页号 -> 上次计算的大小
+        self.frames = OrderedDict()  # 页号 -> 页对象，按最近使用排序
+        self.dirtySet = set()
+        self.pinCount = dict()
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, pageId):
+        page = self.frames.get(pageId)
+        if page is not None:
+            self.hits += 1
+            self.frames.move_to_end(pageId)
+            return page
+        self.misses += 1
+        self.reads += 1
+        page = self.load(pageId, self.pageFile.read(pageId))
+        self.frames[pageId] = page
+        self.measure(pageId)
+        self.evict()
+        return page
+
+    # 放入新分配的页，新页一定是脏页
+    def put(self, pageId, page):
+        self.frames[pageId] = page
+        self.frames.move_to_end(pageId)
+        self.dirtySet.add(pageId)
+        self.measure(pageId)
+        self.evict()
+
+    # 重新计算页的大小
+    def measure(self, pageId):
+        size = self.frames[pageId].footprint() + frame_overhead
+        self.used += size - self.sizes.get(pageId, 0)
+        self.sizes[pageId] = size
+
+    def dirty(self, pageId):
+        self.dirtySet.add(pageId)
+
+    def pin(self, pageId):
+        self.pinCount[pageId] = self.pinCount.get(pageId, 0) + 1
+
+    def unpin(self, pageId):
+        count = self.pinCount[pageId] - 1
+        if count:
+            self.pinCount[pageId] = count
+        else:
+            del self.pinCount[pageId]
+            if pageId in self.frames:
+                self.measure(pageId)
+                self.evict()
+
+    # 换出最久未使用且未被pin住的页，脏页先写回
+    def evict(self):
+        while self.used > self.memory and len(self.frames) > 1:
+            victim = None
+            for pageId in self.frames:
+                if pageId not in self.pinCount:
+                    victim = pageId
+                    break
+            if victim is None:
+                return
+            page = self.frames.pop(victim)
+            self.used -= self.sizes.pop(victim)
+            if victim in self.dirtySet:
+                self.dirtySet.discard(victim)
+                self.pageFile.write(victim, page.toBytes())
+                self.writes += 1
+
+    # 将所有脏页写回磁盘
+    def flush(self):
+        for pageId in sorted(self.dirtySet):
+            self.pageFile.write(pageId, self.frames[pageId].toBytes())
+            self.writes += 1
+        self.dirtySet.clear()
+        self.pageFile.sync()
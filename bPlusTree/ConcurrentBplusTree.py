@@ -0,0 +1,291 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+
+from bPlusTree.BplusTree import BplusTree
+from bPlusTree.Cursor import Cursor
+from bPlusTree.KeyValue import KeyValue
+
+# 多读单写的B+树，用左右两份（Left-Right）实现读者和写者并行：
+# 树有两份内容相同的副本，读者总是在当前活跃的一份上查询，不加树的锁，不会等写者
+# 写者（同一时间一个，由写锁串行）先修改不活跃的一份，再一次赋值把它换成活跃的一份，
+# 等还在旧的一份上的读者都结束后，对旧的一份做同样的修改，两份重新一致
+# 读者只在进入和离开时在一把小锁内增减所在副本的读者计数，写者修改副本时不持有这把锁，
+# 所以再大的批量插入删除也不会挡住读者；代价是内存和写操作都是两倍
+# 换副本时新的读者等到旧副本上进行中的读操作结束（一次读操作的时间）再开始：它们本来不冲突，
+# 但有GIL时如果不等，旧副本上被打断的读者要和所有新读者轮流抢GIL，写者每次都要等好几个切换间隔
+# 不用结点级的锁耦合（latch crabbing）或路径复制（copy-on-write），因为BplusTree的插入删除沿parent指针
+# 自底向上调整计数、分裂合并，叶结点之间还有brother指针，两者都要改写树的全部修改路径
+# 范围扫描按页进行，每页是一次读操作，页与页之间读者不占着副本，写者不会被长扫描一直挡住
+
+
+# 复制一棵树：按叶结点顺序取出全部键值和值重新建树，倒排表的list也要复制，两份之间不能共用可变的值
+def copy_tree(tree):
+    keyList = []
+    valueList = []
+    for keys, values in tree.columns():
+        keyList.extend(keys)
+        valueList.extend(map(list, values) if tree.posting else values)
+    return BplusTree.from_columns(keyList, valueList, tree.order, typecode=tree.typecode, posting=tree.posting)
+
+
+class ConcurrentBplusTree:
+    def __init__(self, tree):
+        self.__trees = [tree, copy_tree(tree)]
+        self.__active = 0
+        self.__readers = [0, 0]  # 每一份上正在进行的读操作个数
+        self.__condition = threading.Condition(threading.Lock())
+        self.__writeLock = threading.Lock()
+        self.__draining = False  # 写者正在等旧副本上的读者离开
+
+    # 当前活跃的一份，只能用来读
+    @property
+    def tree(self):
+        return self.__trees[self.__active]
+
+    # 一次读操作：在活跃的一份上登记，结束时注销，最后一个离开旧副本的读者唤醒等待的写者
+    @contextmanager
+    def __reading(self):
+        with self.__condition:
+            while self.__draining:
+                self.__condition.wait()
+            index = self.__active
+            self.__readers[index] += 1
+        try:
+            yield self.__trees[index]
+        finally:
+            with self.__condition:
+                self.__readers[index] -= 1
+                if not self.__readers[index]:
+                    self.__condition.notify_all()
+
+    # 一次写操作：operation(tree)先作用在不活跃的一份上，换成活跃的之后，等旧的一份上的读者离开再作用一次
+    def __write(self, operation):
+        with self.__writeLock:
+            standby = 1 - self.__active
+            result = operation(self.__trees[standby])
+            with self.__condition:
+                self.__active = standby
+                self.__draining = True
+                while self.__readers[1 - standby]:
+                    self.__condition.wait()
+                self.__draining = False
+                self.__condition.notify_all()
+            operation(self.__trees[1 - standby])
+            return result
+
+    def insert(self, keyValue):
+        self.__write(lambda tree: tree.insert(keyValue))
+
+    def insert_many(self, keyValues):
+        keyValues = list(keyValues)
+        self.__write(lambda tree: tree.insert_many(keyValues))
+
+    def delete(self, key):
+        return self.__write(lambda tree: tree.delete(key))
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        return self.__write(lambda tree: tree.delete_many(keys))
+
+    def delete_all(self, key):
+        return self.__write(lambda tree: tree.delete_all(key))
+
+    def delete_value(self, key, value):
+        return self.__write(lambda tree: tree.delete_value(key, value))
+
+    def search(self, low=None, high=None):
+        with self.__reading() as tree:
+            return tree.search(low, high)
+
+    def count(self, low=None, high=None, lowInclusive=True, highInclusive=True):
+        with self.__reading() as tree:
+            return tree.count(low, high, lowInclusive, highInclusive)
+
+    def __len__(self):
+        with self.__reading() as tree:
+            return len(tree)
+
+    def rank(self, key):
+        with self.__reading() as tree:
+            return tree.rank(key)
+
+    def select(self, i):
+        with self.__reading() as tree:
+            return tree.select(i)
+
+    def get(self, key):
+        with self.__reading() as tree:
+            return tree.get(key)
+
+    def get_many(self, keys):
+        with self.__reading() as tree:
+            return list(tree.get_many(keys))
+
+    def leaves(self):
+        with self.__reading() as tree:
+            return tree.leaves()
+
+    # 供Cursor调用，每次取一页是一次读操作，可能在不同的副本上进行，游标按上一页最后的键值重新定位
+    def __scan_page(self, low, high, reverse, limit, lowInclusive, highInclusive):
+        with self.__reading() as tree:
+            return list(tree.scan(low, high, reverse, limit, lowInclusive, highInclusive))
+
+    # 惰性范围查询，每页（pageSize个）是一次读操作，页内是一致的，页与页之间可能穿插写操作
+    def scan(self, low=None, high=None, reverse=False, limit=None,
+             lowInclusive=True, highInclusive=True, pageSize=256):
+        cursor = Cursor(PageSource(self.__scan_page), low, high, reverse, lowInclusive, highInclusive)
+        remain = limit
+        while remain is None or remain > 0:
+            n = pageSize if remain is None else min(pageSize, remain)
+            page = cursor.fetch(n)
+            yield from page
+            if remain is not None:
+                remain -= len(page)
+            if len(page) < n:
+                return
+
+
+# Cursor只需要树的scan，这里把scan换成一次读操作
+class PageSource:
+    def __init__(self, scan):
+        self.scan = scan
+
+
+# 压力测试：多个写线程插入删除，多个读线程同时查询，检查每次查询结果都是有序且在范围内的，
+# 最后检查树的内容和所有写操作的结果一致、两份副本完全相同；
+# 再做一次很大的批量插入，检查期间读者一直在完成查询，最慢的一次查询远短于整个批量插入
+def test(order=8, writers=1, readers=8, seconds=3):
+    tree = ConcurrentBplusTree(BplusTree(order))
+    tree.insert_many(KeyValue(key, key) for key in range(0, 20000, 2))
+    stop = threading.Event()
+    errors = []
+    inserted = [[] for _ in range(writers)]
+    deleted = [0] * writers
+
+    def write(number):
+        r = random.Random(number)
+        while not stop.is_set():
+            key = r.randint(0, 20000)
+            if r.random() < 0.5:
+                tree.insert(KeyValue(key, key))
+                inserted[number].append(key)
+            elif r.random() < 0.9:
+                if tree.delete(key) == 0:
+                    deleted[number] += 1
+            else:
+                batch = [KeyValue(r.randint(0, 20000), 0) for _ in range(50)]
+                tree.insert_many(batch)
+                inserted[number].extend(x.key for x in batch)
+
+    def read(number):
+        r = random.Random(100 + number)
+        while not stop.is_set():
+            low = r.randint(0, 20000)
+            high = low + r.randint(0, 500)
+            result = [x.key for x in tree.search(low, high)]
+            if result != sorted(result) or any(k < low or k > high for k in result):
+                errors.append(('search', low, high))
+            result = [x.key for x in tree.scan(low, reverse=True, limit=300, pageSize=64)]
+            if result != sorted(result, reverse=True) or any(k > 20000 or k < 0 for k in result):
+                errors.append(('scan', low))
+            if tree.count(low, high) < 0:
+                errors.append(('count', low, high))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)] \
+              + [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    total = 10000 + sum(map(len, inserted)) - sum(deleted)
+    copies = tree._ConcurrentBplusTree__trees
+    if errors:
+        print('Wrong!!!', errors[:5])
+    elif len(tree.leaves()) != total:
+        print('Wrong!!!', len(tree.leaves()), total)
+    elif [(x.key, x.value) for x in copies[0].leaves()] != [(x.key, x.value) for x in copies[1].leaves()]:
+        print('Wrong!!! copies differ')
+    else:
+        print('Right!')
+
+    stop.clear()
+    latencies = []
+
+    def measure():
+        r = random.Random(0)
+        while not stop.is_set():
+            startTime = time.perf_counter()
+            tree.get(r.randint(0, 20000))
+            latencies.append(time.perf_counter() - startTime)
+
+    reader = threading.Thread(target=measure)
+    reader.start()
+    startTime = time.perf_counter()
+    tree.insert_many(KeyValue(key, key) for key in range(20001, 420001))
+    batchTime = time.perf_counter() - startTime
+    stop.set()
+    reader.join()
+    print('Right!' if latencies and max(latencies) < batchTime / 4 and len(tree) == total + 400000 else 'Wrong!!!')
+
+
+# 混合读写负载下的读吞吐量和读延迟：readers个线程做随机点查询和短范围查询，writers个线程持续插入删除，
+# batch大于0时写线程每次批量插入batch个键值再批量删除，报告读延迟的中位数和p99（毫秒）
+def benchmark(order=64, size=1000000, readers=8, writers=1, seconds=3, batch=0):
+    keys = sorted(random.randint(1, size) for _ in range(size))
+    tree = ConcurrentBplusTree(BplusTree.bulk_load((KeyValue(key, key) for key in keys), order))
+    stop = threading.Event()
+    latencies = [[] for _ in range(readers)]
+    writes = [0] * writers
+
+    def write(number):
+        r = random.Random(number)
+        while not stop.is_set():
+            if batch:
+                batchKeys = [r.randint(1, size) for _ in range(batch)]
+                tree.insert_many(KeyValue(key, key) for key in batchKeys)
+                tree.delete_many(batchKeys)
+                writes[number] += 2 * batch
+                continue
+            key = r.randint(1, size)
+            if r.random() < 0.5:
+                tree.insert(KeyValue(key, key))
+            else:
+                tree.delete(key)
+            writes[number] += 1
+
+    def read(number):
+        r = random.Random(100 + number)
+        while not stop.is_set():
+            key = r.randint(1, size)
+            startTime = time.perf_counter()
+            if r.random() < 0.8:
+                tree.get(key)
+            else:
+                tree.search(key, key + 100)
+            latencies[number].append(time.perf_counter() - startTime)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)] \
+              + [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    allLatencies = sorted(chain.from_iterable(latencies))
+    print('readers =', readers, 'writers =', writers, 'batch =', batch,
+          'reads/s =', len(allLatencies) // seconds, 'writes/s =', sum(writes) // seconds,
+          'read p50 =', round(allLatencies[len(allLatencies) // 2] * 1000, 3), 'ms',
+          'p99 =', round(allLatencies[len(allLatencies) * 99 // 100] * 1000, 3), 'ms')
+
+
+if __name__ == '__main__':
+    test()
+    for w in (0, 1):
+        benchmark(writers=w)
+    benchmark(writers=1, batch=1000)
@@ -0,0 +1,54 @@
+# 分页游标，每次fetch从上一页最后的键值重新定位，代价为O(log n + 页大小)，两次fetch之间树被修改也不会失效
+# 相同的键值可能跨页，记录最后一个键值已经取出的个数，重新定位后跳过这些键值对
+class Cursor:
+    def __init__(self, tree, low=None, high=None, reverse=False, lowInclusive=True, highInclusive=True):
+        if low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        self.__tree = tree
+        self.__low = low
+        self.__high = high
+        self.__reverse = reverse
+        self.__lowInclusive = lowInclusive
+        self.__highInclusive = highInclusive
+        self.__lastKey = None
+        self.__skip = 0
+        self.__done = False
+
+    # 上一页最后的键值，可以保存下来，之后用tree.cursor(low=lastKey, lowInclusive=False)继续查询
+    @property
+    def lastKey(self):
+        return self.__lastKey
+
+    def done(self):
+        return self.__done
+
+    # 取出下一页，最多n个键值对，取完之后返回空list
+    def fetch(self, n):
+        if self.__done or n <= 0:
+            return []
+        low, high = self.__low, self.__high
+        lowInclusive, highInclusive = self.__lowInclusive, self.__highInclusive
+        skip = 0
+        if self.__lastKey is not None:
+            skip = self.__skip
+            if self.__reverse:
+                high, highInclusive = self.__lastKey, True
+            else:
+                low, lowInclusive = self.__lastKey, True
+        result = list(self.__tree.scan(low, high, self.__reverse, n + skip, lowInclusive, highInclusive))
+        del result[:skip]
+        if len(result) < n:
+            self.__done = True
+        if result:
+            key = result[-1].key
+            same = 0
+            for keyValue in reversed(result):
+                if keyValue.key != key:
+                    break
+                same += 1
+            if key == self.__lastKey and same == len(result):
+                self.__skip += same
+            else:
+                self.__skip = same
+            self.__lastKey = key
+        return result
@@ -0,0 +1,335 @@
+import os
+import struct
+from array import array
+
+from bPlusTree import WriteAheadLog as wal
+from bPlusTree.BplusTree import BplusTree
+from bPlusTree.KeyValue import KeyValue
+
+# 可恢复的B+树：树本身在内存中，每次修改追加到预写日志，定期做检查点把整棵树写成二进制快照
+# 重启时先加载快照，再重放快照之后的日志
+# 快照格式：文件头，全部键值（定长数组），全部值（长度 + utf-8，倒排表模式下先写个数）
+
+SNAPSHOT_MAGIC = b'BPS1'
+SNAPSHOT_HEADER = struct.Struct('<4sQQIc?Q')  # 魔数 日志代号 日志位置 阶 键值类型 倒排表模式 键值个数
+LENGTH = struct.Struct('<i')
+
+
+def write_snapshot(tree, filename, generation, offset):
+    total = sum(len(keyList) for keyList, valueList in tree.columns())
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation, offset, tree.order,
+                                     tree.typecode.encode('ascii'), tree.posting, total))
+        for keyList, valueList in tree.columns():
+            f.write(keyList.tobytes())
+        for keyList, valueList in tree.columns():
+            chunk = []
+            for value in valueList:
+                if tree.posting:
+                    chunk.append(LENGTH.pack(len(value)))
+                    values = value
+                else:
+                    values = (value,)
+                for v in values:
+                    length, data = wal.encode_value(v)
+                    chunk.append(LENGTH.pack(length))
+                    chunk.append(data)
+            f.write(b''.join(chunk))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+
+# 读取快照，返回(树, 日志代号, 日志位置)
+def read_snapshot(filename):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    magic, generation, offset, order, typecode, posting, total = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('not a b+ tree snapshot')
+    typecode = typecode.decode('ascii')
+    keyList = array(typecode)
+    start = SNAPSHOT_HEADER.size
+    keyList.frombytes(data[start:start + total * keyList.itemsize])
+    position = start + total * keyList.itemsize
+
+    def read_value():
+        nonlocal position
+        length = LENGTH.unpack_from(data, position)[0]
+        position += LENGTH.size
+        end = position + max(length, 0)
+        value = wal.decode_value(length, data[position:end])
+        position = end
+        return value
+
+    valueList = []
+    for i in range(total):
+        if posting:
+            count = LENGTH.unpack_from(data, position)[0]
+            position += LENGTH.size
+            valueList.append([read_value() for _ in range(count)])
+        else:
+            valueList.append(read_value())
+    tree = BplusTree.from_columns(keyList, valueList, order, typecode=typecode, posting=posting)
+    return tree, generation, offset
+
+
+# 日志中键值为8字节有符号整数，键值数组的类型必须是取值范围不超过它的整数类型
+def log_typecode(typecode):
+    if not typecode or typecode not in 'bBhHiIlLqQ':
+        return False
+    return typecode.islower() or array(typecode).itemsize < 8
+
+
+class DurableBplusTree:
+    # path为文件名前缀，快照为path.snapshot，日志为path.wal；已有文件时order等参数以快照为准
+    # syncEvery为组提交的记录数，累计这么多条修改做一次fsync，commit()之前的修改没有确认，崩溃后可能丢失
+    # checkpointEvery为自动检查点的间隔（修改次数），None表示只在手动调用checkpoint()时做
+    def __init__(self, path, order=10, typecode='i', posting=False, syncEvery=1, checkpointEvery=None):
+        if not log_typecode(typecode):
+            raise ValueError('durable tree needs an integer typecode that fits in 8 signed bytes, got '
+                             + repr(typecode))
+        self.__snapshotFile = path + '.snapshot'
+        self.__logFile = path + '.wal'
+        self.__syncEvery = syncEvery
+        self.__checkpointEvery = checkpointEvery
+        self.__changes = 0
+        if os.path.exists(self.__snapshotFile):
+            self.__tree, generation, offset = read_snapshot(self.__snapshotFile)
+        else:
+            self.__tree = BplusTree(order, typecode, posting)
+            generation, offset = 0, wal.HEADER.size
+        end = None
+        if not os.path.exists(self.__logFile):
+            # 有快照却没有日志时，快照记录的日志位置已经没有意义，从新一代日志开始
+            if os.path.exists(self.__snapshotFile):
+                generation += 1
+        else:
+            logGeneration = wal.read_generation(self.__logFile)
+            if logGeneration == generation + 1:
+                # 检查点已经换了新日志，快照之后的修改都在新日志中
+                generation, offset = logGeneration, wal.HEADER.size
+            elif logGeneration != generation:
+                raise ValueError('write-ahead log does not match the snapshot')
+            end = self.__replay(offset)
+        self.__log = wal.WriteAheadLog(self.__logFile, generation, end)
+
+    # 重放日志，连续的插入或删除合并成批量操作，返回最后一条完整记录的结束位置
+    def __replay(self, offset):
+        end = offset
+        batchOp, batch = None, []
+
+        def apply():
+            if batchOp == wal.INSERT:
+                self.__tree.insert_many(batch)
+            elif batchOp == wal.DELETE:
+                self.__tree.delete_many(batch)
+            batch.clear()
+
+        for op, key, value, end in wal.read_records(self.__logFile, offset):
+            if op != batchOp:
+                apply()
+                batchOp = op
+            if op == wal.INSERT:
+                batch.append(KeyValue(key, value))
+            elif op == wal.DELETE:
+                batch.append(key)
+            elif op == wal.DELETE_ALL:
+                self.__tree.delete_all(key)
+            elif op == wal.DELETE_VALUE:
+                self.__tree.delete_value(key, value)
+        apply()
+        return end
+
+    @property
+    def tree(self):
+        return self.__tree
+
+    # 先检查键值和值都能写进日志和树（不能时报错，日志和树都不变），再追加日志，之后才修改内存中的树
+    # 删除不存在的键值也记日志，重放时同样什么也不删，结果一致
+    def __append(self, records):
+        for op, key, value in records:
+            array(self.__tree.typecode, [key])
+            wal.encode_value(value)
+        for op, key, value in records:
+            self.__log.append(op, key, value)
+
+    # 修改已经应用到树上，按需组提交和做检查点
+    def __logged(self, records):
+        self.__changes += len(records)
+        if self.__log.pending >= self.__syncEvery:
+            self.__log.commit()
+        if self.__checkpointEvery is not None and self.__changes >= self.__checkpointEvery:
+            self.checkpoint()
+
+    def insert(self, keyValue):
+        records = [(wal.INSERT, keyValue.key, keyValue.value)]
+        self.__append(records)
+        self.__tree.insert(keyValue)
+        self.__logged(records)
+
+    def insert_many(self, keyValues):
+        keyValues = list(keyValues)
+        records = [(wal.INSERT, x.key, x.value) for x in keyValues]
+        self.__append(records)
+        self.__tree.insert_many(keyValues)
+        self.__logged(records)
+
+    def delete(self, key):
+        records = [(wal.DELETE, key, None)]
+        self.__append(records)
+        result = self.__tree.delete(key)
+        self.__logged(records)
+        return result
+
+    def delete_many(self, keys):
+        records = [(wal.DELETE, key, None) for key in keys]
+        self.__append(records)
+        deleted = self.__tree.delete_many([key for op, key, value in records])
+        self.__logged(records)
+        return deleted
+
+    def delete_all(self, key):
+        records = [(wal.DELETE_ALL, key, None)]
+        self.__append(records)
+        deleted = self.__tree.delete_all(key)
+        self.__logged(records)
+        return deleted
+
+    def delete_value(self, key, value):
+        records = [(wal.DELETE_VALUE, key, value)]
+        self.__append(records)
+        result = self.__tree.delete_value(key, value)
+        self.__logged(records)
+        return result
+
+    def search(self, low=None, high=None):
+        return self.__tree.search(low, high)
+
+    def scan(self, *args, **kwargs):
+        return self.__tree.scan(*args, **kwargs)
+
+    def cursor(self, *args, **kwargs):
+        return self.__tree.cursor(*args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        return self.__tree.count(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.__tree)
+
+    def rank(self, key):
+        return self.__tree.rank(key)
+
+    def select(self, i):
+        return self.__tree.select(i)
+
+    def get(self, key):
+        return self.__tree.get(key)
+
+    def get_many(self, keys):
+        return self.__tree.get_many(keys)
+
+    def leaves(self):
+        return self.__tree.leaves()
+
+    # 提交（fsync）所有已追加的日志记录，返回之后之前的修改都已确认
+    def commit(self):
+        self.__log.commit()
+
+    # 检查点：写快照（记录它覆盖到的日志位置），再换一个新的空日志
+    # 两步之间崩溃时，恢复会从快照记录的位置重放旧日志，不会重复应用
+    def checkpoint(self):
+        self.__log.commit()
+        generation = self.__log.generation
+        write_snapshot(self.__tree, self.__snapshotFile, generation, self.__log.offset())
+        self.__log.close()
+        wal.create(self.__logFile, generation + 1)
+        self.__log = wal.WriteAheadLog(self.__logFile)
+        self.__changes = 0
+
+    def close(self):
+        self.__log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+def test():
+    import datetime
+    import random
+    path = 'durable'
+    for suffix in ('.snapshot', '.wal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    keys = [random.randint(1, 1000000) for _ in range(1000000)]
+    with DurableBplusTree(path, order=64, syncEvery=10000) as tree:
+        tree.insert_many(KeyValue(key, 'abcdefghijkl') for key in keys[:900000])
+        tree.checkpoint()
+        for key in keys[900000:]:
+            tree.insert(KeyValue(key, 'abcdefghijkl'))
+    startTime = datetime.datetime.now()
+    with DurableBplusTree(path) as tree:
+        endTime = datetime.datetime.now()
+        print('recover', tree.count(), 'keys in', (endTime - startTime).total_seconds(), 's')
+    for suffix in ('.snapshot', '.wal'):
+        os.remove(path + suffix)
+
+
+# 不能写进日志的键值类型直接拒绝；键值或值不合法的修改报错，树和日志都不变；随机修改（包括删除不存在的键值）后
+# 重新打开，恢复出的树与修改后的树相同
+def test2(rounds=200):
+    import random
+    path = 'durable2'
+    right = True
+    for typecode in ('bytes', 'd', 'Q', None):
+        try:
+            DurableBplusTree(path, typecode=typecode)
+            right = False
+        except ValueError:
+            pass
+    for suffix in ('.snapshot', '.wal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with DurableBplusTree(path, order=4) as tree:
+        for keyValue in (KeyValue(1 << 40, 'a'), KeyValue('1', 'a'), KeyValue(1, 1.5)):
+            try:
+                tree.insert(keyValue)
+                right = False
+            except (TypeError, ValueError, OverflowError):
+                pass
+        try:
+            tree.insert_many([KeyValue(1, 'a'), KeyValue(1 << 40, 'a')])
+            right = False
+        except OverflowError:
+            pass
+        right = right and len(tree) == 0 and tree.leaves() == []
+        for _ in range(rounds):
+            operation = random.randrange(5)
+            key = random.randint(1, 50)
+            if operation == 0:
+                tree.insert(KeyValue(key, random.choice(('a', 'b', None))))
+            elif operation == 1:
+                tree.insert_many(KeyValue(random.randint(1, 50), 'c') for _ in range(5))
+            elif operation == 2:
+                tree.delete(key)
+            elif operation == 3:
+                tree.delete_many(random.randint(1, 50) for _ in range(5))
+            else:
+                tree.delete_value(key, random.choice(('a', 'b', 'c', None)))
+            if random.random() < 0.02:
+                tree.checkpoint()
+        expected = [(x.key, x.value) for x in tree.leaves()]
+    with DurableBplusTree(path) as tree:
+        right = right and [(x.key, x.value) for x in tree.leaves()] == expected
+    for suffix in ('.snapshot', '.wal'):
+        os.remove(path + suffix)
+    print('Right!' if right else 'Wrong!!!')
+
+
+if __name__ == '__main__':
+    test()
@@ -1,8 +1,16 @@
+from array import array
+
+from bPlusTree.PrefixKeys import key_array
+
+
 class InterNode:
-    def __init__(self, order):
+    __slots__ = ('__order', 'indexValueList', 'pointerList', 'countList', 'parent')
+
+    def __init__(self, order, typecode='i'):
         self.__order = order
-        self.indexValueList = []  # 索引值
+        self.indexValueList = key_array(typecode)  # 索引值
         self.pointerList = []  # 指向某一个结点的指针
+        self.countList = array('q')  # 每个子女子树中值的个数，与pointerList一一对应
         self.parent = None
 
     @staticmethod
@@ -1,7 +1,15 @@
+from bPlusTree.PrefixKeys import key_column
+
+
+# 叶结点的键值和值分两列存放，键值为紧凑的定长数组（typecode为None时退化为list，为'bytes'时为前缀压缩的字节串列），
+# 可直接二分查找
 class LeafNode:
-    def __init__(self, order):
+    __slots__ = ('__order', 'keyList', 'valueList', 'brother', 'parent')
+
+    def __init__(self, order, typecode='i'):
         self.__order = order
-        self.keyValueList = []
+        self.keyList = key_column(typecode)
+        self.valueList = []
         self.brother = None
         self.parent = None
 
@@ -10,7 +18,7 @@ class LeafNode:
         return True
 
     def isFull(self):
-        return len(self.keyValueList) > self.__order - 1
+        return len(self.keyList) > self.__order - 1
 
     def isLessThanHalf(self):
-        return len(self.keyValueList) < (self.__order - 1) / 2
+        return len(self.keyList) < (self.__order - 1) / 2
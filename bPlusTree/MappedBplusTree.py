@@ -0,0 +1,426 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from bPlusTree.BplusTree import BplusTree, group_sizes
+from bPlusTree.KeyValue import KeyValue
+from bPlusTree.PrefixKeys import bytes_typecode
+
+# 只读的内存映射索引文件：把建好的BplusTree导出成不可变的文件，查询进程用mmap打开后直接在映射的缓冲区上查找，
+# 不反序列化、不在堆上重建结点，打开文件的时间与记录数无关；多个进程映射同一个文件时共享页缓存中的一份
+# 文件布局（本机字节序）：
+#   文件头，占一个缓存行（64字节）
+#   叶结点，按叶结点链的顺序连续存放，范围查询顺序读文件
+#   内结点，自底向上逐层存放，根结点在最后
+#   值的位置表（每个值一个int64，为该值在文件中的位置），值（1字节类型 + 4字节长度 + 内容）
+#   值可以是None、str（utf-8）、bytes或int（8字节有符号整数），如SecondaryIndex和Join.build_index中的整数和字节串
+# 每个结点从缓存行边界开始，结点头为5个int64：类型、键值个数、后一片叶结点的位置、前一片叶结点的位置（没有时为0）、
+# 结点中第一个值的序号（内结点为子树中值的个数）；其后为键值数组（定长，与树的typecode相同），
+# 叶结点再接倒排表模式下每个键值之前（含）值的累计个数（int64），内结点再接子女结点的位置（int64）
+# 叶结点就是原树的叶结点，内结点按阶数重新满装，子女之间用文件中的位置代替对象引用
+# 整个文件按键值类型和int64各转换（memoryview.cast）一次，查找时用bisect在其中的一段上二分，不复制
+
+MAGIC = b'BPM1'
+HEADER = struct.Struct('=4sc?xIqqqq')  # 魔数 键值类型 倒排表模式 阶 键值对个数 根结点 第一片叶结点 值的位置表
+NODE = struct.Struct('=qqqqq')  # 类型 键值个数 后一片叶结点 前一片叶结点 第一个值的序号（内结点为子树中值的个数）
+VALUE = struct.Struct('=bi')  # 值的类型 长度
+INTEGER = struct.Struct('=q')
+LINE = 64  # 缓存行大小，每个结点和文件总长度都按它对齐
+LEAF, INTER = 0, 1
+NONE, STR, BYTES, INT = 0, 1, 2, 3
+BROTHER, PREV, FIRST = 2, 3, 4  # 结点头中各项的下标
+
+
+# 值编码为(类型, 内容)，不支持的类型在写文件之前报错
+def encode_value(value):
+    if value is None:
+        return NONE, b''
+    if type(value) is str:
+        return STR, value.encode('utf-8')
+    if type(value) in (bytes, bytearray):
+        return BYTES, bytes(value)
+    if type(value) is int:
+        if not -(1 << 63) <= value < 1 << 63:
+            raise ValueError('int value out of range: ' + str(value))
+        return INT, INTEGER.pack(value)
+    raise TypeError('value of type ' + type(value).__name__ + ' can not be mapped')
+
+
+def decode_value(kind, data):
+    if kind == STR:
+        return str(data, 'utf-8')
+    if kind == BYTES:
+        return bytes(data)
+    if kind == INT:
+        return INTEGER.unpack(data)[0]
+    return None
+
+
+def align(size, boundary=LINE):
+    return -(-size // boundary) * boundary
+
+
+# 结点的键值数组之后，int64部分的起始位置
+def words_start(offset, n, itemsize):
+    return align(offset + NODE.size + n * itemsize, 8)
+
+
+# 把树导出成内存映射索引文件，先写临时文件再改名，写出过程中已映射旧文件的进程不受影响
+def write_mapped(tree, filename):
+    typecode = tree.typecode
+    if not typecode or typecode == bytes_typecode:
+        raise ValueError('only fixed-size keys can be mapped')
+    itemsize = array(typecode).itemsize
+    posting = tree.posting
+
+    # 先算出每个结点的位置，再写出
+    leaves = list(tree.columns())
+    offsets = []
+    sizes = []
+    position = LINE
+    for keyList, valueList in leaves:
+        offsets.append(position)
+        sizes.append(sum(map(len, valueList)) if posting else len(valueList))
+        position += align(words_start(0, len(keyList), itemsize) + (8 * len(keyList) if posting else 0))
+    leafEnd = position
+    # 逐层向上分组，每组一个内结点：(位置, 索引值, 子女位置, 子树中值的个数)
+    inters = []
+    level = offsets
+    minKeys = [keyList[0] if len(keyList) else 0 for keyList, valueList in leaves]
+    levelSizes = sizes
+    while len(level) > 1:
+        upper, upperMinKeys, upperSizes = [], [], []
+        start = 0
+        for size in group_sizes(len(level), tree.order, tree.order, -(-tree.order // 2)):
+            inters.append((position, minKeys[start + 1:start + size], level[start:start + size],
+                           sum(levelSizes[start:start + size])))
+            upper.append(position)
+            upperMinKeys.append(minKeys[start])
+            upperSizes.append(inters[-1][3])
+            position += align(words_start(0, size - 1, itemsize) + 8 * size)
+            start += size
+        level, minKeys, levelSizes = upper, upperMinKeys, upperSizes
+    root = level[0]
+    total = sum(sizes)
+    valueTable = position
+    # 值先全部编码，有不支持的值时不生成文件
+    table = array('q')
+    chunk = []
+    position = valueTable + 8 * total
+    for keyList, valueList in leaves:
+        for value in valueList:
+            for v in (value if posting else (value,)):
+                kind, data = encode_value(v)
+                table.append(position)
+                chunk.append(VALUE.pack(kind, len(data)))
+                chunk.append(data)
+                position += VALUE.size + len(data)
+
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, typecode.encode('ascii'), posting, tree.order, total, root, LINE,
+                            valueTable).ljust(LINE, b'\0'))
+        first = 0
+        for i, (keyList, valueList) in enumerate(leaves):
+            brother = offsets[i + 1] if i + 1 < len(offsets) else 0
+            prev = offsets[i - 1] if i else 0
+            node = NODE.pack(LEAF, len(keyList), brother, prev, first) + array(typecode, keyList).tobytes()
+            node = node.ljust(words_start(0, len(keyList), itemsize), b'\0')
+            if posting:
+                ends = array('q')
+                end = 0
+                for values in valueList:
+                    end += len(values)
+                    ends.append(end)
+                node += ends.tobytes()
+            f.write(node.ljust(align(len(node)), b'\0'))
+            first += sizes[i]
+        assert f.tell() == leafEnd
+        for offset, indexValues, children, size in inters:
+            node = NODE.pack(INTER, len(indexValues), 0, 0, size) + array(typecode, indexValues).tobytes()
+            node = node.ljust(words_start(0, len(indexValues), itemsize), b'\0') + array('q', children).tobytes()
+            f.write(node.ljust(align(len(node)), b'\0'))
+        # 值的位置表，然后是值本身
+        f.write(table.tobytes())
+        data = b''.join(chunk)
+        f.write(data.ljust(align(len(data)), b'\0'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
+
+
+class MappedBplusTree:
+    # 只读，查询接口与BplusTree相同（get、search、scan、count、rank、len），结果也相同
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, typecode, posting, order, total, root, leaf, valueTable = HEADER.unpack_from(self.__map)
+        if magic != MAGIC:
+            self.__map.close()
+            raise ValueError('not a mapped b+ tree file')
+        self.__typecode = typecode.decode('ascii')
+        self.__posting = posting
+        self.__order = order
+        self.__total = total
+        self.__root = root
+        self.__leaf = leaf
+        self.__valueTable = valueTable // 8
+        view = memoryview(self.__map)
+        self.__keys = view.cast(self.__typecode)
+        self.__words = view.cast('q')
+        self.__itemsize = self.__keys.itemsize
+        view.release()
+
+    def close(self):
+        if self.__map is not None:
+            self.__keys.release()
+            self.__words.release()
+            self.__map.close()
+            self.__map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    @property
+    def order(self):
+        return self.__order
+
+    @property
+    def typecode(self):
+        return self.__typecode
+
+    @property
+    def posting(self):
+        return self.__posting
+
+    def __len__(self):
+        return self.__total
+
+    # 结点的类型、键值个数、键值在键值视图中的起始下标
+    def __node(self, offset):
+        i = offset // 8
+        words = self.__words
+        return words[i], words[i + 1], (offset + NODE.size) // self.__itemsize
+
+    # 第i个值（全局序号）
+    def __value(self, i):
+        position = self.__words[self.__valueTable + i]
+        kind, length = VALUE.unpack_from(self.__map, position)
+        start = position + VALUE.size
+        return decode_value(kind, self.__map[start:start + length])
+
+    # 叶结点中第i个键值的值的序号范围[begin, end)
+    def __value_range(self, offset, n, i, j):
+        first = self.__words[offset // 8 + FIRST]
+        if not self.__posting:
+            return first + i, first + j
+        ends = words_start(offset, n, self.__itemsize) // 8
+        words = self.__words
+        return first + (words[ends + i - 1] if i else 0), first + (words[ends + j - 1] if j else 0)
+
+    # 从根结点向下找到key所在的叶结点，返回叶结点的位置、键值个数、键值的起始下标和叶结点内bisect的结果
+    def __descend(self, key, bisect):
+        keys, words, itemsize = self.__keys, self.__words, self.__itemsize
+        offset = self.__root
+        kind, n, start = self.__node(offset)
+        while kind == INTER:
+            i = bisect(keys, key, start, start + n) - start
+            offset = words[words_start(offset, n, itemsize) // 8 + i]
+            kind, n, start = self.__node(offset)
+        return offset, n, bisect(keys, key, start, start + n) - start
+
+    # 查找第一个键值>=key（after为True时为>key）的位置，返回所在叶结点的位置及下标，与BplusTree.__locate相同
+    def __locate(self, key, after=False):
+        words = self.__words
+        offset, n, i = self.__descend(key, bisect_right if after else bisect_left)
+        while i == n and words[offset // 8 + BROTHER]:
+            offset = words[offset // 8 + BROTHER]
+            n = words[offset // 8 + 1]
+            i = 0
+        return offset, i
+
+    # 查找最后一个键值<=key（before为True时为<key）的位置，不存在时下标为-1，与BplusTree.__locate_last相同
+    def __locate_last(self, key, before=False):
+        words = self.__words
+        offset, n, i = self.__descend(key, bisect_left if before else bisect_right)
+        i -= 1
+        while i < 0 and words[offset // 8 + PREV]:
+            offset = words[offset // 8 + PREV]
+            i = words[offset // 8 + 1] - 1
+        return offset, i
+
+    # 键值小于key（after为True时为不大于key）的值的个数，即第一个>=key（>key）的位置的值的序号
+    def __rank(self, key, after=False):
+        offset, i = self.__locate(key, after)
+        kind, n, start = self.__node(offset)
+        return self.__value_range(offset, n, i, i)[0]
+
+    # 沿叶结点链给出落在范围内的(叶结点位置, 键值个数, 键值起始下标, 起始下标, 结束下标)，
+    # reverse为True时从大到小，与BplusTree.__ranges相同
+    def __ranges(self, low, high, reverse, lowInclusive, highInclusive):
+        keys, words = self.__keys, self.__words
+        if not reverse:
+            if low is None:
+                offset, index = self.__leaf, 0
+            else:
+                offset, index = self.__locate(low, not lowInclusive)
+            while offset:
+                kind, n, start = self.__node(offset)
+                if high is None:
+                    end = n
+                elif highInclusive:
+                    end = bisect_right(keys, high, start + index, start + n) - start
+                else:
+                    end = bisect_left(keys, high, start + index, start + n) - start
+                yield offset, n, start, index, end
+                if end < n:
+                    return
+                offset = words[offset // 8 + BROTHER]
+                index = 0
+        else:
+            if high is None:
+                offset = self.__root
+                kind, n, start = self.__node(offset)
+                while kind == INTER:
+                    offset = words[words_start(offset, n, self.__itemsize) // 8 + n]
+                    kind, n, start = self.__node(offset)
+                index = n - 1
+            else:
+                offset, index = self.__locate_last(high, not highInclusive)
+            while offset:
+                kind, n, start = self.__node(offset)
+                if low is None:
+                    begin = 0
+                elif lowInclusive:
+                    begin = bisect_left(keys, low, start, start + index + 1) - start
+                else:
+                    begin = bisect_right(keys, low, start, start + index + 1) - start
+                yield offset, n, start, begin, index + 1
+                if begin > 0:
+                    return
+                offset = words[offset // 8 + PREV]
+                if offset:
+                    index = words[offset // 8 + 1] - 1
+
+    # 沿叶结点链产出KeyValue，参数和范围语义与BplusTree.scan相同
+    def scan(self, low=None, high=None, reverse=False, limit=None, lowInclusive=True, highInclusive=True):
+        if low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        yield from islice(self.__scan(low, high, reverse, lowInclusive, highInclusive), limit)
+
+    def __scan(self, low, high, reverse, lowInclusive, highInclusive):
+        keys = self.__keys
+        for offset, n, start, begin, end in self.__ranges(low, high, reverse, lowInclusive, highInclusive):
+            positions = range(end - 1, begin - 1, -1) if reverse else range(begin, end)
+            for i in positions:
+                key = keys[start + i]
+                first, stop = self.__value_range(offset, n, i, i + 1)
+                values = range(stop - 1, first - 1, -1) if reverse else range(first, stop)
+                for j in values:
+                    yield KeyValue(key, self.__value(j))
+
+    def search(self, low=None, high=None):
+        if low is None and high is None:
+            raise ValueError('no range')
+        return list(self.scan(low, high))
+
+    def get(self, key):
+        return [keyValue.value for keyValue in self.scan(key, key)]
+
+    # 用上下界的排名相减，O(log n)
+    def count(self, low=None, high=None, lowInclusive=True, highInclusive=True):
+        if low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        begin = 0 if low is None else self.__rank(low, not lowInclusive)
+        end = self.__total if high is None else self.__rank(high, highInclusive)
+        return max(0, end - begin)
+
+    def rank(self, key):
+        return self.__rank(key)
+
+    # 依次输出所有键值对
+    def leaves(self):
+        return list(self.__scan(None, None, False, True, True))
+
+
+# 随机建树（有重复键值，值为None、str、bytes和int，普通模式和倒排表模式），导出后映射打开，
+# 各种查询（包括从大到小的scan）的结果与原树相同；有不支持的值时报错且不生成文件
+def test(rounds=20, order=5):
+    import random
+    filename = 'mapped.idx'
+    right = True
+    for posting in (False, True):
+        for _ in range(rounds):
+            n = random.randint(0, 2000)
+            tree = BplusTree(order, posting=posting)
+            for _ in range(n):
+                value = random.choice((None, 'abcdefghijkl', '属性B' + str(random.randint(0, 9)), b'abc\x00\xff',
+                                       random.randint(-(1 << 63), (1 << 63) - 1), 0))
+                tree.insert(KeyValue(random.randint(-100, n // 2), value))
+            write_mapped(tree, filename)
+            with MappedBplusTree(filename) as mapped:
+                right = right and len(mapped) == len(tree)
+                right = right and [(x.key, x.value) for x in mapped.leaves()] == \
+                    [(x.key, x.value) for x in tree.leaves()]
+                for _ in range(20):
+                    low, high = sorted(random.randint(-120, n // 2 + 20) for _ in range(2))
+                    lowInclusive, highInclusive = random.random() < 0.5, random.random() < 0.5
+                    right = right and mapped.get(low) == tree.get(low)
+                    right = right and [(x.key, x.value) for x in mapped.search(low, high)] == \
+                        [(x.key, x.value) for x in tree.search(low, high)]
+                    right = right and [(x.key, x.value) for x in mapped.scan(low, None, False, 7, lowInclusive)] == \
+                        [(x.key, x.value) for x in tree.scan(low, None, False, 7, lowInclusive)]
+                    for bounds in ((low, high), (None, high), (low, None), (None, None)):
+                        right = right and [(x.key, x.value) for x in mapped.scan(*bounds, True, None, lowInclusive,
+                                                                                 highInclusive)] == \
+                            [(x.key, x.value) for x in tree.scan(*bounds, True, None, lowInclusive, highInclusive)]
+                    right = right and mapped.count(low, high, lowInclusive, highInclusive) == \
+                        tree.count(low, high, lowInclusive, highInclusive)
+                    right = right and mapped.rank(high) == tree.rank(high)
+    os.remove(filename)
+    for value in (1.5, 1 << 63):
+        tree = BplusTree(order)
+        tree.insert(KeyValue(1, value))
+        try:
+            write_mapped(tree, filename)
+            right = False
+        except (TypeError, ValueError):
+            right = right and not os.path.exists(filename) and not os.path.exists(filename + '.tmp')
+    print('Right!' if right else 'Wrong!!!')
+
+
+# 100万条记录：查询进程启动时从CSV重建树 vs 打开映射文件，以及两者的点查询耗时
+def benchmark(filename='../data.csv', order=64, queries=100000):
+    import datetime
+    import random
+    from bPlusTree.BplusTree import read_data
+    indexFile = 'mapped.idx'
+    startTime = datetime.datetime.now()
+    tree = BplusTree.bulk_load(sorted(read_data(filename), key=lambda x: x.key), order)
+    endTime = datetime.datetime.now()
+    print('rebuild from csv:', (endTime - startTime).total_seconds(), 's')
+    write_mapped(tree, indexFile)
+    print('file size:', os.path.getsize(indexFile) / len(tree), 'B/record')
+    startTime = datetime.datetime.now()
+    mapped = MappedBplusTree(indexFile)
+    endTime = datetime.datetime.now()
+    print('open mapped:', (endTime - startTime).total_seconds() * 1000, 'ms')
+    keys = [random.randint(1, len(tree)) for _ in range(queries)]
+    for name, index in (('tree', tree), ('mapped', mapped)):
+        startTime = datetime.datetime.now()
+        for key in keys:
+            index.get(key)
+        endTime = datetime.datetime.now()
+        print(name, 'get:', (endTime - startTime).total_seconds() / queries * 1000000, 'us/query')
+    mapped.close()
+    os.remove(indexFile)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,408 @@
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+
+from bPlusTree.BufferPool import BufferPool, PageFile
+from bPlusTree.KeyValue import KeyValue
+
+# 磁盘上的B+树，整个索引存放在一个页文件中，页大小固定
+# 第0页为元信息页，其余为叶结点页、内结点页或空闲页
+# 结点之间用页号代替对象引用，通过缓冲池访问，内存占用不超过缓冲池大小
+# 键值为4字节整型，值为定长字节串（默认12字节，对应属性B）
+
+MAGIC = b'BPT1'
+META = struct.Struct('<4sIIiiii')  # 魔数 页大小 值长度 根结点 第一片叶结点 空闲页链表头 下一个新页号
+HEADER = struct.Struct('<BxHi')  # 页类型 元素个数 兄弟页号（空闲页为下一空闲页号）
+LEAF, INTER, FREE = 0, 1, 2
+NONE = -1
+
+
+class PagedLeaf:
+    def __init__(self):
+        self.keyList = array('i')
+        self.valueList = []
+        self.brother = NONE
+
+    @staticmethod
+    def isLeaf():
+        return True
+
+    def toBytes(self):
+        return HEADER.pack(LEAF, len(self.keyList), self.brother) \
+               + self.keyList.tobytes() + b''.join(self.valueList)
+
+    # 内存占用（字节）：对象本身、键值数组、值的list和其中每个定长的bytes对象
+    def footprint(self):
+        values = len(self.valueList) * sys.getsizeof(self.valueList[0]) if self.valueList else 0
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.keyList) \
+            + sys.getsizeof(self.valueList) + values
+
+
+class PagedInter:
+    def __init__(self):
+        self.indexValueList = array('i')
+        self.pointerList = array('i')
+
+    @staticmethod
+    def isLeaf():
+        return False
+
+    def toBytes(self):
+        return HEADER.pack(INTER, len(self.indexValueList), NONE) \
+               + self.indexValueList.tobytes() + self.pointerList.tobytes()
+
+    def footprint(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sys.getsizeof(self.indexValueList) \
+            + sys.getsizeof(self.pointerList)
+
+
+class PagedFree:
+    def __init__(self, nextFree):
+        self.nextFree = nextFree
+
+    def toBytes(self):
+        return HEADER.pack(FREE, 0, self.nextFree)
+
+    def footprint(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+
+
+class PagedBplusTree:
+    # memory为缓冲池大小（字节），页大小决定了结点的阶
+    def __init__(self, filename, pageSize=4096, valueSize=12, memory=1024 * 1024):
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        if exists:
+            # 已有的索引文件，以元信息页中记录的页大小和值长度为准
+            with open(filename, 'rb') as f:
+                magic, pageSize, valueSize, self.__root, self.__leaf, self.__free, self.__next = \
+                    META.unpack(f.read(META.size))
+            if magic != MAGIC:
+                raise ValueError('not a b+ tree page file')
+        self.__file = PageFile(filename, pageSize)
+        self.__pageSize = pageSize
+        self.__valueSize = valueSize
+        # 叶结点最多存放leafCapacity个键值，内结点最多存放interCapacity个子女
+        self.__leafCapacity = (pageSize - HEADER.size) // (4 + valueSize)
+        self.__interCapacity = (pageSize - HEADER.size + 4) // 8
+        if self.__leafCapacity < 2 or self.__interCapacity < 3:
+            raise ValueError('page size is too small')
+        self.__pool = BufferPool(self.__file, self.__load, memory)
+        self.__pinned = []
+        if not exists:
+            self.__free = NONE
+            self.__next = 1
+            self.__root = self.__leaf = self.__allocate(PagedLeaf())
+            self.flush()
+
+    @property
+    def pool(self):
+        return self.__pool
+
+    def __load(self, pageId, data):
+        kind, count, brother = HEADER.unpack_from(data)
+        offset = HEADER.size
+        if kind == LEAF:
+            page = PagedLeaf()
+            page.brother = brother
+            page.keyList.frombytes(data[offset:offset + 4 * count])
+            offset += 4 * count
+            size = self.__valueSize
+            page.valueList = [data[offset + i * size:offset + (i + 1) * size] for i in range(count)]
+        elif kind == INTER:
+            page = PagedInter()
+            page.indexValueList.frombytes(data[offset:offset + 4 * count])
+            offset += 4 * count
+            page.pointerList.frombytes(data[offset:offset + 4 * (count + 1)])
+        else:
+            page = PagedFree(brother)
+        return page
+
+    # 取页并pin住，一次操作结束后统一释放
+    def __page(self, pageId):
+        self.__pool.pin(pageId)
+        self.__pinned.append(pageId)
+        return self.__pool.get(pageId)
+
+    def __release(self):
+        for pageId in self.__pinned:
+            self.__pool.unpin(pageId)
+        self.__pinned.clear()
+
+    # 分配新页，优先复用空闲页
+    def __allocate(self, page):
+        if self.__free != NONE:
+            pageId = self.__free
+            self.__free = self.__page(pageId).nextFree
+        else:
+            pageId = self.__next
+            self.__next += 1
+        self.__pool.put(pageId, page)
+        self.__pool.pin(pageId)
+        self.__pinned.append(pageId)
+        return pageId
+
+    def __deallocate(self, pageId):
+        self.__pool.put(pageId, PagedFree(self.__free))
+        self.__free = pageId
+
+    def __encode(self, value):
+        if value is None:
+            value = b''
+        elif isinstance(value, str):
+            value = value.encode('utf-8')
+        if len(value) > self.__valueSize:
+            raise ValueError('value is longer than ' + str(self.__valueSize) + ' bytes')
+        return value.ljust(self.__valueSize, b'\0')
+
+    @staticmethod
+    def __decode(value):
+        return value.rstrip(b'\0').decode('utf-8')
+
+    def __isLessThanHalf(self, page):
+        if page.isLeaf():
+            return len(page.keyList) < self.__leafCapacity / 2
+        return len(page.pointerList) < self.__interCapacity / 2
+
+    # 从根结点向下找到第一个键值>=key（left为True）或>key的叶结点，返回路径[(页号, 页, 子女下标)]
+    def __descend(self, key, left):
+        path = []
+        pageId = self.__root
+        page = self.__page(pageId)
+        while not page.isLeaf():
+            if left:
+                i = bisect_left(page.indexValueList, key)
+            else:
+                i = bisect_right(page.indexValueList, key)
+            path.append((pageId, page, i))
+            pageId = page.pointerList[i]
+            page = self.__page(pageId)
+        path.append((pageId, page, None))
+        return path
+
+    # 路径移动到下一片叶结点：向上找到还有右兄弟的结点，再沿最左子女向下
+    def __next_path(self, path):
+        path.pop()
+        while path and path[-1][2] == len(path[-1][1].pointerList) - 1:
+            path.pop()
+        if not path:
+            return False
+        pageId, page, i = path.pop()
+        path.append((pageId, page, i + 1))
+        pageId = page.pointerList[i + 1]
+        page = self.__page(pageId)
+        while not page.isLeaf():
+            path.append((pageId, page, 0))
+            pageId = page.pointerList[0]
+            page = self.__page(pageId)
+        path.append((pageId, page, None))
+        return True
+
+    def insert(self, keyValue):
+        try:
+            path = self.__descend(keyValue.key, False)
+            pageId, leaf, _ = path.pop()
+            index = bisect_right(leaf.keyList, keyValue.key)
+            leaf.keyList.insert(index, keyValue.key)
+            leaf.valueList.insert(index, self.__encode(keyValue.value))
+            self.__pool.dirty(pageId)
+            if len(leaf.keyList) <= self.__leafCapacity:
+                return
+            # 分裂叶结点，新叶结点的最小键值上升到父结点
+            mid = len(leaf.keyList) // 2
+            newLeaf = PagedLeaf()
+            newLeaf.keyList = leaf.keyList[mid:]
+            newLeaf.valueList = leaf.valueList[mid:]
+            newLeaf.brother = leaf.brother
+            del leaf.keyList[mid:]
+            del leaf.valueList[mid:]
+            newId = leaf.brother = self.__allocate(newLeaf)
+            upKey = newLeaf.keyList[0]
+            # 逐层向上插入索引值，父结点满了继续分裂
+            while path:
+                pageId, parent, i = path.pop()
+                parent.indexValueList.insert(i, upKey)
+                parent.pointerList.insert(i + 1, newId)
+                self.__pool.dirty(pageId)
+                if len(parent.pointerList) <= self.__interCapacity:
+                    return
+                mid = len(parent.pointerList) // 2
+                newInter = PagedInter()
+                newInter.indexValueList = parent.indexValueList[mid:]
+                newInter.pointerList = parent.pointerList[mid:]
+                upKey = parent.indexValueList[mid - 1]
+                del parent.indexValueList[mid - 1:]
+                del parent.pointerList[mid:]
+                newId = self.__allocate(newInter)
+            # 根结点分裂，创建新根
+            newRoot = PagedInter()
+            newRoot.indexValueList.append(upKey)
+            newRoot.pointerList.extend([self.__root, newId])
+            self.__root = self.__allocate(newRoot)
+        finally:
+            self.__release()
+
+    # 删除键值最左出现的一个键值对，成功返回0，不存在返回-1
+    def delete(self, key):
+        try:
+            path = self.__descend(key, True)
+            leaf = path[-1][1]
+            index = bisect_left(leaf.keyList, key)
+            while index == len(leaf.keyList):
+                if not self.__next_path(path):
+                    return -1
+                leaf = path[-1][1]
+                index = bisect_left(leaf.keyList, key)
+            if leaf.keyList[index] != key:
+                return -1
+            del leaf.keyList[index]
+            del leaf.valueList[index]
+            self.__pool.dirty(path[-1][0])
+            self.__rebalance(path)
+            return 0
+        finally:
+            self.__release()
+
+    # 自底向上调整，结点少于一半时与兄弟结点合并或者从兄弟结点借
+    def __rebalance(self, path):
+        pageId, page, _ = path.pop()
+        while path and self.__isLessThanHalf(page):
+            parentId, parent, index = path.pop()
+            # 最右的结点与左兄弟调整，其余结点与右兄弟调整
+            if index == len(parent.indexValueList):
+                index -= 1
+            leftId = parent.pointerList[index]
+            rightId = parent.pointerList[index + 1]
+            left = self.__page(leftId)
+            right = self.__page(rightId)
+            self.__pool.dirty(leftId)
+            self.__pool.dirty(rightId)
+            self.__pool.dirty(parentId)
+            if left.isLeaf():
+                if len(left.keyList) + len(right.keyList) <= self.__leafCapacity:
+                    left.keyList.extend(right.keyList)
+                    left.valueList.extend(right.valueList)
+                    left.brother = right.brother
+                    self.__merge(parent, index, rightId)
+                elif pageId == leftId:
+                    left.keyList.append(right.keyList.pop(0))
+                    left.valueList.append(right.valueList.pop(0))
+                    parent.indexValueList[index] = right.keyList[0]
+                    return
+                else:
+                    right.keyList.insert(0, left.keyList.pop())
+                    right.valueList.insert(0, left.valueList.pop())
+                    parent.indexValueList[index] = right.keyList[0]
+                    return
+            else:
+                if len(left.pointerList) + len(right.pointerList) <= self.__interCapacity:
+                    left.indexValueList.append(parent.indexValueList[index])
+                    left.indexValueList.extend(right.indexValueList)
+                    left.pointerList.extend(right.pointerList)
+                    self.__merge(parent, index, rightId)
+                elif pageId == leftId:
+                    left.indexValueList.append(parent.indexValueList[index])
+                    left.pointerList.append(right.pointerList.pop(0))
+                    parent.indexValueList[index] = right.indexValueList.pop(0)
+                    return
+                else:
+                    right.indexValueList.insert(0, parent.indexValueList[index])
+                    right.pointerList.insert(0, left.pointerList.pop())
+                    parent.indexValueList[index] = left.indexValueList.pop()
+                    return
+            pageId, page = parentId, parent
+        # 根结点为内结点且索引清空时，唯一的子女成为新的根结点
+        if not path and not page.isLeaf() and not page.indexValueList:
+            self.__root = page.pointerList[0]
+            self.__deallocate(pageId)
+
+    # 合并后在父结点删除右儿子及其索引值，并回收右儿子的页
+    def __merge(self, parent, index, rightId):
+        del parent.indexValueList[index]
+        del parent.pointerList[index + 1]
+        self.__deallocate(rightId)
+
+    # 范围查询，语义与BplusTree.search相同
+    def search(self, low=None, high=None):
+        if low is None and high is None:
+            raise ValueError('no range')
+        elif low is not None and high is not None and low > high:
+            raise ValueError('lower can not be greater than upper')
+        result = []
+        try:
+            if low is None:
+                pageId, index = self.__leaf, 0
+            else:
+                path = self.__descend(low, True)
+                pageId = path[-1][0]
+                index = bisect_left(path[-1][1].keyList, low)
+            while pageId != NONE:
+                leaf = self.__pool.get(pageId)
+                for i in range(index, len(leaf.keyList)):
+                    key = leaf.keyList[i]
+                    if high is not None and key > high:
+                        return result
+                    result.append(KeyValue(key, self.__decode(leaf.valueList[i])))
+                pageId = leaf.brother
+                index = 0
+            return result
+        finally:
+            self.__release()
+
+    # 依次输出所有叶结点存储的键值对
+    def leaves(self):
+        result = []
+        pageId = self.__leaf
+        while pageId != NONE:
+            leaf = self.__pool.get(pageId)
+            result.extend(KeyValue(k, self.__decode(v)) for k, v in zip(leaf.keyList, leaf.valueList))
+            pageId = leaf.brother
+        return result
+
+    def height(self):
+        height = 1
+        page = self.__pool.get(self.__root)
+        while not page.isLeaf():
+            height += 1
+            page = self.__pool.get(page.pointerList[0])
+        return height
+
+    # 写回元信息页和所有脏页
+    def flush(self):
+        meta = META.pack(MAGIC, self.__pageSize, self.__valueSize,
+                         self.__root, self.__leaf, self.__free, self.__next)
+        self.__file.write(0, meta)
+        self.__pool.flush()
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+def test():
+    import random
+    filename = 'paged.idx'
+    if os.path.exists(filename):
+        os.remove(filename)
+    keys = [random.randint(1, 100000) for _ in range(100000)]
+    with PagedBplusTree(filename, memory=64 * 4096) as tree:
+        for key in keys:
+            tree.insert(KeyValue(key, 'v' + str(key)))
+        print('height =', tree.height(), 'hits =', tree.pool.hits, 'misses =', tree.pool.misses)
+    with PagedBplusTree(filename, memory=64 * 4096) as tree:
+        print([str(x) for x in tree.search(100, 120)])
+        for key in keys[:50000]:
+            tree.delete(key)
+        print(len(tree.leaves()) == 50000)
+    os.remove(filename)
+
+
+if __name__ == '__main__':
+    test()
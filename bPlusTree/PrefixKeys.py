@@ -0,0 +1,155 @@
+from array import array
+
+# 键值为字节串（如12字节的属性B）时叶结点的键值列，前缀压缩存放：
+# 叶结点内键值有序，所有键值的最长公共前缀就是第一个和最后一个键值的公共前缀，只存一份，
+# 每个键值只存去掉公共前缀之后的后缀，后缀依次拼接在一个bytearray中，ends[i]为第i个后缀的结束位置
+# 和list一样支持下标、切片、insert、append、extend、del，可以直接用bisect二分查找
+# 在中间插入的键值一定以公共前缀开头，只有插入到两端且不以公共前缀开头时才需要缩短前缀、整列重建；
+# 删除两端的键值后公共前缀可能变长，同样整列重建
+
+bytes_typecode = 'bytes'
+
+
+def common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return a[:i]
+
+
+# 后缀截断的分隔值：right中大于left的最短前缀，满足 left < 分隔值 <= right（left等于right时为right）
+# 作为内结点的索引值，左边子树的键值都不大于它，右边子树的键值都不小于它，和用right本身作索引值效果相同
+def separator(left, right):
+    return right[:len(common_prefix(left, right)) + 1]
+
+
+# 叶结点的键值列：typecode为'bytes'时为PrefixKeys，为None时为list，否则为定长数组
+def key_column(typecode, keys=()):
+    if typecode == bytes_typecode:
+        return PrefixKeys(keys)
+    if typecode:
+        return array(typecode, keys)
+    return list(keys)
+
+
+# 内结点的索引值列和建树时的整列键值：定长数组，字节串长短不一，放在list中
+def key_array(typecode):
+    if typecode and typecode != bytes_typecode:
+        return array(typecode)
+    return []
+
+
+class PrefixKeys:
+    __slots__ = ('prefix', 'data', 'ends')
+
+    def __init__(self, keys=()):
+        self.__set(list(keys))
+
+    # 由完整的键值列表重建
+    def __set(self, keys):
+        self.prefix = common_prefix(keys[0], keys[-1]) if keys else b''
+        n = len(self.prefix)
+        self.data = bytearray(b''.join(key[n:] for key in keys))
+        self.ends = array('I')
+        end = 0
+        for key in keys:
+            end += len(key) - n
+            self.ends.append(end)
+
+    # 删除或切片之后公共前缀可能变长，重建
+    def __grow(self):
+        if len(self.ends) > 1 and len(common_prefix(self[0], self[-1])) > len(self.prefix):
+            self.__set(list(self))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __iter__(self):
+        prefix, data, start = self.prefix, self.data, 0
+        for end in self.ends:
+            yield prefix + data[start:end]
+            start = end
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self.ends))
+            if step != 1:
+                return PrefixKeys(list(self)[i])
+            # 连续的一段直接截取后缀，不逐个拼出完整键值
+            result = PrefixKeys()
+            if start < stop:
+                begin = self.ends[start - 1] if start else 0
+                result.prefix = self.prefix
+                result.data = self.data[begin:self.ends[stop - 1]]
+                result.ends = array('I', (end - begin for end in self.ends[start:stop]))
+                result.__grow()
+            return result
+        n = len(self.ends)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('index out of range')
+        return self.prefix + self.data[self.ends[i - 1] if i else 0:self.ends[i]]
+
+    def __setitem__(self, i, keys):
+        if not isinstance(i, slice):
+            raise TypeError('keys can only be replaced by slice')
+        allKeys = list(self)
+        allKeys[i] = keys
+        self.__set(allKeys)
+
+    def __delitem__(self, i):
+        n = len(self.ends)
+        if isinstance(i, slice):
+            keys = list(self)
+            del keys[i]
+            self.__set(keys)
+            return
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('index out of range')
+        start = self.ends[i - 1] if i else 0
+        size = self.ends[i] - start
+        del self.data[start:self.ends[i]]
+        del self.ends[i]
+        ends = self.ends
+        for j in range(i, n - 1):
+            ends[j] -= size
+        # 删除两端的键值后公共前缀可能变长
+        if i == 0 or i == n - 1:
+            self.__grow()
+
+    def insert(self, i, key):
+        n = len(self.ends)
+        if i < 0:
+            i = max(0, i + n)
+        i = min(i, n)
+        if not n or not key.startswith(self.prefix):
+            keys = list(self)
+            keys.insert(i, key)
+            self.__set(keys)
+            return
+        suffix = key[len(self.prefix):]
+        start = self.ends[i - 1] if i else 0
+        self.data[start:start] = suffix
+        ends = self.ends
+        ends.insert(i, start)
+        size = len(suffix)
+        for j in range(i, n + 1):
+            ends[j] += size
+
+    def append(self, key):
+        if not self.ends or not key.startswith(self.prefix):
+            self.insert(len(self.ends), key)
+            return
+        self.data += key[len(self.prefix):]
+        self.ends.append(len(self.data))
+
+    def extend(self, keys):
+        for key in keys:
+            self.append(key)
+
+    def __repr__(self):
+        return 'PrefixKeys(' + repr(list(self)) + ')'
@@ -0,0 +1,253 @@
+from collections import Counter
+from itertools import islice
+
+from bPlusTree.BplusTree import BplusTree
+from bPlusTree.KeyValue import KeyValue
+from bPlusTree.PrefixKeys import bytes_typecode
+
+# 属性B上的二级索引：以B（utf-8字节串）为键值，值为记录的主键A，B相同的记录各占一个位置
+# （随机生成的B几乎没有重复，不用倒排表，省去每个键值一个list）
+# 索引树的叶结点前缀压缩，内结点的索引值截断为最短的分隔值（见PrefixKeys），随机生成的12个小写字母
+# 前几个字符重复很多，省下的空间随树变大而增加
+# 支持精确查找和前缀范围查找（前缀p对应键值范围[p, p的后继)）
+# IndexedBplusTree包装主键上的BplusTree，插入和删除时同步修改二级索引，两者始终一致
+
+
+def encode(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+def decode(value):
+    return value.decode('utf-8') if isinstance(value, (bytes, bytearray)) else value
+
+
+# 以prefix开头的字节串都小于它的最小字节串，不存在（prefix全为0xff）时为None
+def next_prefix(prefix):
+    prefix = prefix.rstrip(b'\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+class SecondaryIndex:
+    # typecode为None时键值用普通list存放，不做前缀压缩（用于对比）
+    def __init__(self, order=64, typecode=bytes_typecode):
+        self.__tree = BplusTree(order, typecode)
+
+    # 由主键树的所有记录建索引：按(B, A)排序后自底向上批量建树
+    @classmethod
+    def build(cls, primary, order=64, fill=1.0, typecode=bytes_typecode):
+        pairs = []
+        for keyList, valueList in primary.columns():
+            if primary.posting:
+                pairs.extend((encode(value), key) for key, values in zip(keyList, valueList) for value in values)
+            else:
+                pairs.extend(zip(map(encode, valueList), keyList))
+        pairs.sort()
+        index = cls(order, typecode)
+        index.__tree = BplusTree.from_columns([value for value, key in pairs], [key for value, key in pairs],
+                                              order, fill, typecode)
+        return index
+
+    @property
+    def tree(self):
+        return self.__tree
+
+    def __len__(self):
+        return len(self.__tree)
+
+    # 记录(key, value)插入主键树之后调用
+    def add(self, key, value):
+        self.__tree.insert(KeyValue(encode(value), key))
+
+    # 记录(key, value)从主键树删除之后调用
+    def remove(self, key, value):
+        return self.__tree.delete_value(encode(value), key)
+
+    # B等于value的所有记录的主键
+    def get(self, value):
+        return self.__tree.get(encode(value))
+
+    # B以prefix开头的记录，按B的顺序产出KeyValue(A, B)
+    def scan_prefix(self, prefix, limit=None):
+        prefix = encode(prefix)
+        for keyValue in self.__tree.scan(prefix, next_prefix(prefix), limit=limit, highInclusive=False):
+            yield KeyValue(keyValue.value, decode(keyValue.key))
+
+    # B以prefix开头的记录个数，O(log n)
+    def count_prefix(self, prefix):
+        prefix = encode(prefix)
+        return self.__tree.count(prefix, next_prefix(prefix), highInclusive=False)
+
+
+class IndexedBplusTree:
+    # tree为主键A上的BplusTree（可以已有数据），在其记录上建B的二级索引
+    def __init__(self, tree, order=64):
+        self.__tree = tree
+        self.__index = SecondaryIndex.build(tree, order)
+
+    @property
+    def tree(self):
+        return self.__tree
+
+    @property
+    def index(self):
+        return self.__index
+
+    def insert(self, keyValue):
+        self.__tree.insert(keyValue)
+        self.__index.add(keyValue.key, keyValue.value)
+
+    def insert_many(self, keyValues):
+        keyValues = list(keyValues)
+        self.__tree.insert_many(keyValues)
+        for keyValue in keyValues:
+            self.__index.add(keyValue.key, keyValue.value)
+
+    # 主键树删除的是键值最左出现的记录，先取出它的B
+    def delete(self, key):
+        row = next(self.__tree.scan(key, key, limit=1), None)
+        result = self.__tree.delete(key)
+        if result == 0:
+            self.__index.remove(key, row.value)
+        return result
+
+    # keys中键值出现m次就删除该键值最左的m条记录，先取出它们的B
+    def delete_many(self, keys):
+        keys = list(keys)
+        rows = []
+        for key, m in Counter(keys).items():
+            rows.extend(islice(self.__tree.scan(key, key), m))
+        deleted = self.__tree.delete_many(keys)
+        for row in rows:
+            self.__index.remove(row.key, row.value)
+        return deleted
+
+    def delete_all(self, key):
+        values = self.__tree.get(key)
+        deleted = self.__tree.delete_all(key)
+        for value in values:
+            self.__index.remove(key, value)
+        return deleted
+
+    def delete_value(self, key, value):
+        result = self.__tree.delete_value(key, value)
+        if result == 0:
+            self.__index.remove(key, value)
+        return result
+
+    def search(self, low=None, high=None):
+        return self.__tree.search(low, high)
+
+    def scan(self, *args, **kwargs):
+        return self.__tree.scan(*args, **kwargs)
+
+    def count(self, *args, **kwargs):
+        return self.__tree.count(*args, **kwargs)
+
+    def get(self, key):
+        return self.__tree.get(key)
+
+    def leaves(self):
+        return self.__tree.leaves()
+
+    def __len__(self):
+        return len(self.__tree)
+
+    # 按B精确查找，返回主键A的列表
+    def find(self, value):
+        return self.__index.get(value)
+
+    # 按B的前缀查找，产出KeyValue(A, B)
+    def find_prefix(self, prefix, limit=None):
+        return self.__index.scan_prefix(prefix, limit)
+
+    def count_prefix(self, prefix):
+        return self.__index.count_prefix(prefix)
+
+
+# 随机插入、删除，每轮检查索引和主键树中的记录一致，精确查找、前缀查找和逐条扫描的结果相同
+def test(records=3000, rounds=30, order=8):
+    import random
+
+    def word():
+        return ''.join(random.choice('abc') for _ in range(3)) + ''.join(
+            random.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(9))
+
+    right = True
+    for posting in (False, True):
+        rows = sorted((random.randint(1, records // 2), word()) for _ in range(records))
+        table = IndexedBplusTree(BplusTree.bulk_load((KeyValue(k, v) for k, v in rows), order, posting=posting),
+                                 order)
+        for _ in range(rounds):
+            operation = random.randrange(5)
+            keys = [random.randint(1, records // 2) for _ in range(random.randint(2, 50))]
+            if operation == 0:
+                for key in keys:
+                    table.insert(KeyValue(key, word()))
+            elif operation == 1:
+                table.insert_many([KeyValue(key, word()) for key in keys])
+            elif operation == 2:
+                for key in keys:
+                    table.delete(key)
+            elif operation == 3:
+                table.delete_many(keys)
+            else:
+                table.delete_all(keys[0])
+                values = table.get(keys[1])
+                if values:
+                    table.delete_value(keys[1], values[-1])
+            allRows = [(x.key, x.value) for x in table.leaves()]
+            # 索引中的(B, A)和主键树中的记录一一对应
+            right = right and len(table.index) == len(allRows)
+            right = right and sorted((decode(x.key), x.value) for x in table.index.tree.leaves()) == \
+                sorted((v, k) for k, v in allRows)
+            value = random.choice(allRows)[1]
+            right = right and sorted(table.find(value)) == sorted(k for k, v in allRows if v == value)
+            prefix = value[:random.randint(0, 4)]
+            matches = sorted((v, k) for k, v in allRows if v.startswith(prefix))
+            right = right and sorted((x.value, x.key) for x in table.find_prefix(prefix)) == matches
+            right = right and table.count_prefix(prefix) == len(matches)
+            right = right and [x.value for x in table.find_prefix(prefix)] == [v for v, k in matches]
+    print('Right!' if right else 'Wrong!!!')
+
+
+# 100万条记录上按B查找：逐条扫描主键树 vs 二级索引；索引大小：前缀压缩 vs 普通list存放键值
+def benchmark(filename='../data.csv', order=64, queries=1000):
+    import datetime
+    import random
+    import tracemalloc
+    from bPlusTree.BplusTree import read_data
+    rows = sorted(read_data(filename), key=lambda x: x.key)
+    tree = BplusTree.bulk_load(rows, order)
+    values = [random.choice(rows).value for _ in range(queries)]
+    startTime = datetime.datetime.now()
+    for value in values[:10]:
+        [x.key for x in tree.scan() if x.value == value]
+    endTime = datetime.datetime.now()
+    print('scan:', (endTime - startTime).total_seconds() / 10 * 1000, 'ms/query')
+    tracemalloc.start()
+    table = IndexedBplusTree(tree, order)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    startTime = datetime.datetime.now()
+    for value in values:
+        table.find(value)
+    endTime = datetime.datetime.now()
+    print('index:', (endTime - startTime).total_seconds() / queries * 1000, 'ms/query')
+    startTime = datetime.datetime.now()
+    for value in values:
+        list(table.find_prefix(value[:4]))
+    endTime = datetime.datetime.now()
+    print('prefix (4 chars):', (endTime - startTime).total_seconds() / queries * 1000, 'ms/query')
+    tracemalloc.start()
+    plain = SecondaryIndex.build(tree, order, typecode=None)
+    plainSize = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('index size:', size / len(rows), 'B/record, without prefix compression:', plainSize / len(rows),
+          'B/record')
+    del plain
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,100 @@
+import os
+import struct
+import zlib
+
+# 预写日志，只追加，每条记录对应一次插入或删除操作
+# 文件头为魔数和代号（每次检查点之后换一个新的日志文件，代号加一）
+# 记录格式：crc32 操作 键值 值长度（-1表示None） 值（utf-8），crc32覆盖记录中其余部分，用来识别写了一半的尾部记录
+
+MAGIC = b'WAL1'
+HEADER = struct.Struct('<4sQ')  # 魔数 代号
+RECORD = struct.Struct('<IBqi')  # crc32 操作 键值 值长度
+INSERT, DELETE, DELETE_ALL, DELETE_VALUE = 1, 2, 3, 4
+
+
+def encode_value(value):
+    if value is None:
+        return -1, b''
+    if not isinstance(value, str):
+        raise TypeError('value must be str or None')
+    data = value.encode('utf-8')
+    return len(data), data
+
+
+def decode_value(length, data):
+    return None if length < 0 else data.decode('utf-8')
+
+
+def pack_record(op, key, value=None):
+    length, data = encode_value(value)
+    body = RECORD.pack(0, op, key, length)[4:] + data
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+# 从offset开始逐条读出(操作, 键值, 值, 记录结束位置)，遇到不完整或校验失败的记录就停止
+def read_records(filename, offset=HEADER.size):
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            crc, op, key, length = RECORD.unpack(head)
+            data = f.read(max(length, 0))
+            if len(data) < max(length, 0) or zlib.crc32(head[4:] + data) != crc:
+                return
+            offset += RECORD.size + len(data)
+            yield op, key, decode_value(length, data), offset
+
+
+def read_generation(filename):
+    with open(filename, 'rb') as f:
+        magic, generation = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('not a write-ahead log')
+    return generation
+
+
+class WriteAheadLog:
+    # 打开日志文件并从end处继续追加（end之后为写坏的尾部，截掉），文件不存在时以generation创建
+    def __init__(self, filename, generation=0, end=None):
+        self.filename = filename
+        if not os.path.exists(filename):
+            create(filename, generation)
+        self.generation = read_generation(filename)
+        self.file = open(filename, 'r+b')
+        if end is not None:
+            self.file.truncate(end)
+        self.file.seek(0, os.SEEK_END)
+        self.buffer = []
+        self.pending = 0  # 已追加但还没有提交（fsync）的记录数
+
+    def offset(self):
+        return self.file.tell() + sum(map(len, self.buffer))
+
+    def append(self, op, key, value=None):
+        self.buffer.append(pack_record(op, key, value))
+        self.pending += 1
+
+    # 组提交：一次write和一次fsync把缓冲的所有记录写到磁盘，返回之后这些操作才算确认
+    def commit(self):
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+# 新建一个只有文件头的日志文件，先写临时文件再原子替换
+def create(filename, generation):
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, filename)
@@ -0,0 +1,111 @@
+import time
+from collections import deque
+
+# 归并阶段的双缓冲I/O：读一块的同时在后台线程中预读同一顺串的下一块，写一块的同时继续归并
+# 每个顺串同一时间最多有一个读请求在进行，输出同一时间最多有一个写请求在进行，
+# 所以每个输入和输出都只多占一块内存，调用方需要按 2 * (路数 + 1) 块计算块大小
+# 文件读写在系统调用中会释放GIL，读写和归并可以真正重叠
+# executor为None时不用后台线程，读写都在调用时同步完成，每个输入和输出只占一块
+# stats为性能计数（见Instrument.py）时记录读写的字节数和块数、读写的耗时（read、write）
+# 以及归并线程等待读写完成的时间（read_wait、write_wait），为None时不计数
+
+
+# 文件当前位置，读写前后相减即为读写的字节数；逐行迭代过的文本文件不能tell，按0计
+def position(f):
+    try:
+        return f.tell()
+    except OSError:
+        return 0
+
+
+class BlockReader:
+    # names为一个顺串的文件列表（Merge.py中一个子集合由多个块文件组成），按顺序读
+    # read(f, count)从文件中读至多count个元素，读到文件末尾时返回空
+    def __init__(self, names, read, block_size, executor, stats=None):
+        self.names = deque(names)
+        self.read = read
+        self.block_size = block_size
+        self.executor = executor
+        self.stats = stats
+        self.file = None
+        self.future = executor.submit(self.__read) if executor is not None else None
+
+    def __read(self):
+        while True:
+            if self.file is None:
+                if not self.names:
+                    return []
+                self.file = open(self.names.popleft(), 'rb')
+            block = self.read(self.file, self.block_size) if self.stats is None else self.__counted_read()
+            if len(block):
+                return block
+            self.file.close()
+            self.file = None
+
+    def __counted_read(self):
+        startTime, start = time.perf_counter(), position(self.file)
+        block = self.read(self.file, self.block_size)
+        self.stats.add_time('read', time.perf_counter() - startTime)
+        self.stats.add('bytes_read', position(self.file) - start)
+        if len(block):
+            self.stats.add('blocks_read')
+        return block
+
+    # 取出已经读好的一块，同时开始预读下一块；顺串读完时返回空
+    def next(self):
+        if self.executor is None:
+            return self.__read()
+        if self.stats is None:
+            block = self.future.result()
+        else:
+            with self.stats.timer('read_wait'):
+                block = self.future.result()
+        if len(block):
+            self.future = self.executor.submit(self.__read)
+        return block
+
+    def close(self):
+        if self.future is not None:
+            self.future.result()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BlockWriter:
+    # write(f, block)把一块写到文件f，交给后台线程执行，下一次写之前等上一次写完，保证顺序
+    def __init__(self, f, write, executor, stats=None):
+        self.file = f
+        self.write = write if stats is None else self.__counted_write
+        self.executor = executor
+        self.stats = stats
+        self.future = None
+        self.__write = write
+
+    def __counted_write(self, f, block):
+        startTime, start = time.perf_counter(), position(f)
+        self.__write(f, block)
+        self.stats.add_time('write', time.perf_counter() - startTime)
+        self.stats.add('bytes_written', position(f) - start)
+        self.stats.add('blocks_written')
+
+    # 等上一次写完
+    def __wait(self):
+        if self.stats is None:
+            self.future.result()
+        else:
+            with self.stats.timer('write_wait'):
+                self.future.result()
+
+    def submit(self, block):
+        if self.executor is None:
+            self.write(self.file, block)
+            return
+        if self.future is not None:
+            self.__wait()
+        self.future = self.executor.submit(self.write, self.file, block)
+
+    def close(self):
+        if self.future is not None:
+            self.__wait()
+            self.future = None
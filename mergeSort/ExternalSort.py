@@ -0,0 +1,726 @@
+import heapq
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import chain, islice
+
+import numpy as np
+
+import ReadData
+from mergeSort import BlockIO, Record
+
+# 内存大小可配置的多趟外部归并排序，Merge.py中块大小、子集合大小和记录数都是写死的，只能做一趟4路归并
+# 内存按每个键值4字节计算，memory字节一次可以放 memory // 4 个键值
+# 第一趟：每次读满内存，内排序后写成一个顺串
+# 之后：每次取fan_in个顺串，各放一块到内存，再留一块作为输出，做fan_in路归并，直到只剩一个顺串
+# 顺串比fan_in多时需要多趟归并，每次合并最短的fan_in个顺串（k叉哈夫曼树），总I/O量最小
+# fan_in在趟数最少的路数中取这样安排之后归并读写量最小的一个（见choose_fan_in）
+# 第一趟也可以用置换选择生成顺串，随机数据上顺串平均长度约为内存的2倍，接近有序的数据只生成一个顺串
+# 顺串为二进制文件（连续的4字节整数），输入可以是CSV或者二进制记录文件（.bin，见Record.py）
+# payload为True时对整条16字节记录（A和B）排序，内存按每条记录16字节计算，记录始终放在numpy结构化数组中，
+# 只有参与比较的键值会变成Python整数；stable为True时键值相同的记录保持输入中的先后顺序
+# workers大于1时第一趟用多个进程并行生成顺串，内存平均分给每个进程，第i块输入总是写成第i个顺串
+# prefetch为True时归并阶段双缓冲（见BlockIO.py），每个输入和输出占两块，块大小相应减半
+# engine为'numpy'时顺串用np.sort排序，归并按块用searchsorted切分后整段排序，结果和逐个归并完全一样
+
+key_size = 4
+min_block_size = 1024  # 一块至少1024个键值（4KB），块太小读写次数太多
+
+
+class SortPlan:
+    def __init__(self, records, memory, run_size, block_size, fan_in, runs, steps, item_size=key_size):
+        self.records = records
+        self.memory = memory
+        self.run_size = run_size
+        self.block_size = block_size
+        self.fan_in = fan_in
+        self.runs = runs
+        self.item_size = item_size
+        # 每一步为(输入顺串编号列表, 输出顺串编号, 输出顺串键值个数)，0..runs-1为第一趟生成的顺串
+        self.steps = steps
+        # 第一趟读一遍写一遍，之后每一步读写一遍输出顺串的大小；最后一步写的是结果文件
+        self.passes, self.merge_records = schedule_cost(steps, runs)
+        self.read_records = records + self.merge_records
+        self.write_records = records + self.merge_records
+        # 实际排序时第一趟（生成顺串）和归并阶段各自的耗时（秒），只做计划时为None
+        self.run_time = None
+        self.merge_time = None
+
+    def __str__(self):
+        unit = ' keys' if self.item_size == key_size else ' records'
+        lines = ['records: ' + str(self.records),
+                 'memory: ' + str(self.memory) + ' bytes',
+                 'run size: ' + str(self.run_size) + unit + ', runs: ' + str(self.runs),
+                 'block size: ' + str(self.block_size) + unit + ', fan-in: ' + str(self.fan_in),
+                 'merge passes: ' + str(self.passes) + ', merge steps: ' + str(len(self.steps)),
+                 'planned I/O: read ' + str(self.read_records * self.item_size) + ' bytes, write '
+                 + str(self.write_records * self.item_size) + ' bytes']
+        if self.run_time is not None:
+            lines.append('time: runs ' + '%.3f' % self.run_time + 's, merge ' + '%.3f' % self.merge_time + 's')
+        return '\n'.join(lines)
+
+
+# 按顺串大小安排归并步骤：先补足空顺串使(个数 - 1)能被(fan_in - 1)整除，然后每次合并最短的fan_in个
+# stable为True时只合并相邻的顺串（一趟一趟从前往后每fan_in个一组），归并时编号小的顺串优先，保持输入顺序
+def schedule(sizes, fan_in, stable=False):
+    heap = [(size, num) for num, size in enumerate(sizes)]
+    if len(heap) <= 1:
+        return []
+    if stable:
+        return stable_schedule(heap, fan_in)
+    dummy = (1 - len(heap)) % (fan_in - 1)
+    heap.extend((0, -1) for _ in range(dummy))
+    heapq.heapify(heap)
+    steps = []
+    num = len(sizes)
+    while len(heap) > 1:
+        group = [heapq.heappop(heap) for _ in range(min(fan_in, len(heap)))]
+        size = sum(x[0] for x in group)
+        steps.append(([x[1] for x in group if x[1] >= 0], num, size))
+        heapq.heappush(heap, (size, num))
+        num += 1
+    return steps
+
+
+def stable_schedule(runs, fan_in):
+    steps = []
+    num = len(runs)
+    while len(runs) > 1:
+        merged = []
+        for i in range(0, len(runs), fan_in):
+            group = runs[i:i + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            size = sum(x[0] for x in group)
+            steps.append(([x[1] for x in group], num, size))
+            merged.append((size, num))
+            num += 1
+        runs = merged
+    return steps
+
+
+# 归并步骤的趟数（从第一趟的顺串到结果最长经过几步归并）和归并阶段读写的记录数
+def schedule_cost(steps, runs):
+    depth = [0] * (runs + len(steps))
+    for inputs, output, size in steps:
+        depth[output] = max(depth[i] for i in inputs) + 1
+    return max(depth) if depth else 0, sum(size for inputs, output, size in steps)
+
+
+# 块不小于min_block_size时允许的最大路数
+def max_fan_in(capacity, buffers=1):
+    return max(2, capacity // (buffers * min_block_size) - 1)
+
+
+# 用允许的最大路数归并runs个顺串最少需要几趟
+def merge_passes(runs, capacity, buffers=1):
+    passes, reach = 0, 1
+    while reach < runs:
+        reach *= max_fan_in(capacity, buffers)
+        passes += 1
+    return passes
+
+
+# 双缓冲让块大小减半，路数上限也跟着减半，如果因此要多归并一趟就得不偿失，这时不用双缓冲
+def use_prefetch(runs, capacity):
+    return merge_passes(runs, capacity, 2) == merge_passes(runs, capacity, 1)
+
+
+# 按顺串大小sizes确定归并路数：先用允许的最大路数算出最少需要几趟，
+# 再从够用的最小路数到允许的最大路数逐个安排归并步骤，取趟数最少、其中归并阶段读写量最小的路数；
+# 读写量相同时取较小的路数，块更大。归并步骤只对所选路数最优，所以路数本身也要按读写量来选，
+# 只取够用的最小路数常常比更大的路数多读写（如最多15路、16个等长顺串时，够用的4路要读写32个顺串，15路只要18个）
+# 返回(归并路数, 块大小)，buffers为每个输入和输出占的块数，双缓冲时为2
+def choose_fan_in(sizes, capacity, buffers=1, stable=False):
+    runs = len(sizes)
+    passes = merge_passes(runs, capacity, buffers)
+    fan_in = 2
+    if passes:
+        fan_in = max(2, round(runs ** (1 / passes)))
+        while fan_in ** passes < runs:
+            fan_in += 1
+        while fan_in > 2 and (fan_in - 1) ** passes >= runs:
+            fan_in -= 1
+        candidates = range(fan_in, max(fan_in, min(max_fan_in(capacity, buffers), runs)) + 1)
+        fan_in = min(candidates, key=lambda f: schedule_cost(schedule(sizes, f, stable), runs) + (f,))
+    return fan_in, max(1, capacity // (buffers * (fan_in + 1)))
+
+
+# 根据记录数和内存大小确定顺串大小、块大小和归并路数
+# 置换选择时顺串长度按随机数据的期望值（内存的2倍）估计
+# 并行生成顺串时每个进程分到 1 / workers 的内存，顺串相应变短，归并仍在一个进程中使用全部内存
+def plan(records, memory=1024 * 1024, block_size=None, replacement=False, payload=False, stable=False,
+         workers=1, prefetch=False, engine='python'):
+    item_size = Record.record_size if payload else key_size
+    capacity = memory // item_size
+    if capacity < 3:
+        raise ValueError('memory budget is too small')
+    if workers > 1 and replacement:
+        raise ValueError('replacement selection runs in a single process')
+    run_size = 2 * capacity if replacement else max(1, capacity // workers)
+    runs = -(-records // run_size)
+    sizes = [run_size] * (records // run_size)
+    if records % run_size:
+        sizes.append(records % run_size)
+    buffers = 2 if prefetch and use_prefetch(runs, capacity) else 1
+    if block_size is None:
+        fan_in, block_size = choose_fan_in(sizes, capacity, buffers, stable)
+    else:
+        fan_in = capacity // (buffers * block_size) - 1
+        if fan_in < 2:
+            raise ValueError('block size is too large for the memory budget')
+    # NumPy引擎的输出最多和所有输入块一样大，路数不变（归并步骤和结果与逐个归并相同），块再减半
+    if engine == 'numpy':
+        block_size = max(1, block_size // 2)
+    return SortPlan(records, memory, run_size, block_size, fan_in, runs, schedule(sizes, fan_in, stable), item_size)
+
+
+# 由文件大小和开头一段的平均行长估计记录数，用于开始之前给出计划
+def estimate_records(filename):
+    size = os.path.getsize(filename)
+    if Record.is_record_file(filename):
+        return size // Record.record_size
+    with open(filename, 'rb') as f:
+        sample = f.read(65536)
+    lines = sample.count(b'\n')
+    if len(sample) == size or lines <= 1:
+        return max(lines - 1 + (not sample.endswith(b'\n')), 0)
+    return round(size / (len(sample) / lines)) - 1
+
+
+def run_file(temp, num):
+    return os.path.join(temp, 'run-' + str(num) + '.bin')
+
+
+# 按块读入键值，每次返回一个至多size个键值的列表
+def read_chunks(filename, size):
+    if Record.is_record_file(filename):
+        for records in Record.read_record_chunks(filename, size):
+            yield records['key'].tolist()
+    else:
+        yield from ReadData.read_keys(filename, size)
+
+
+# 第一趟：每次读入run_size个键值，排序后写成一个顺串，返回每个顺串的大小
+def make_runs(filename, run_size, temp):
+    sizes = []
+    for keys in read_chunks(filename, run_size):
+        keys.sort()
+        with open(run_file(temp, len(sizes)), 'wb') as f:
+            Record.write_keys(f, keys)
+        sizes.append(len(keys))
+    return sizes
+
+
+# 置换选择生成顺串：内存中是一个小根堆，每次输出堆顶，再读入一个键值
+# 读入的键值不小于刚输出的键值时放入堆中，还能留在当前顺串；否则留到下一个顺串（和堆共用内存）
+# 堆空时当前顺串结束，留下来的键值建堆开始下一个顺串；输出缓冲为一小块，也算在内存里
+def replacement_runs(filename, capacity, temp):
+    out_size = min(min_block_size, max(1, capacity // 4))
+    heap_size = max(1, capacity - out_size)
+    keys = chain.from_iterable(read_chunks(filename, out_size))
+    current = list(islice(keys, heap_size))
+    heapq.heapify(current)
+    pending = []
+    sizes = []
+    while current:
+        size = 0
+        output_block = []
+        with open(run_file(temp, len(sizes)), 'wb') as f:
+            while current:
+                key_min = current[0]
+                output_block.append(key_min)
+                key = next(keys, None)
+                if key is None:
+                    heapq.heappop(current)
+                elif key >= key_min:
+                    heapq.heapreplace(current, key)
+                else:
+                    heapq.heappop(current)
+                    pending.append(key)
+                if len(output_block) == out_size:
+                    Record.write_keys(f, output_block)
+                    size += len(output_block)
+                    output_block.clear()
+            Record.write_keys(f, output_block)
+            size += len(output_block)
+        sizes.append(size)
+        current, pending = pending, []
+        heapq.heapify(current)
+    return sizes
+
+
+# 把多个顺串归并成一个，每个输入顺串各占一块内存，输出一块满了就写回
+# text为True时输出为文本（每行一个键值），用于最后一步写结果文件
+# prefetch为True时预读每个顺串的下一块、在后台写输出块
+def merge_runs(inputs, output, block_size, text=False, prefetch=False, stats=None):
+    write = Record.write_text if text else Record.write_keys
+    with ThreadPoolExecutor(len(inputs) + 1) if prefetch else nullcontext() as executor:
+        readers = [BlockIO.BlockReader([name], Record.read_keys, block_size, executor, stats) for name in inputs]
+        blocks = [deque(reader.next()) for reader in readers]
+        heap = [(block.popleft(), num) for num, block in enumerate(blocks) if block]
+        heapq.heapify(heap)
+        output_block = []
+        with open(output, 'w' if text else 'wb') as out:
+            writer = BlockIO.BlockWriter(out, write, executor, stats)
+            while heap:
+                key_min, num = heap[0]
+                output_block.append(key_min)
+                if len(output_block) == block_size:
+                    writer.submit(output_block)
+                    output_block = []
+                block = blocks[num]
+                if not block:
+                    block = blocks[num] = deque(readers[num].next())
+                if block:
+                    heapq.heapreplace(heap, (block.popleft(), num))
+                else:
+                    heapq.heappop(heap)
+            writer.submit(output_block)
+            writer.close()
+        for reader in readers:
+            reader.close()
+
+
+# 整条记录的第一趟：每次读入run_size条记录，按键值排序后写成一个顺串
+def make_record_runs(filename, run_size, temp, stable=False):
+    sizes = []
+    for records in Record.read_record_chunks(filename, run_size):
+        order = records['key'].argsort(kind='stable' if stable else 'quicksort')
+        with open(run_file(temp, len(sizes)), 'wb') as f:
+            Record.write_records(f, records[order])
+        sizes.append(len(records))
+    return sizes
+
+
+# 整条记录的置换选择，所有记录都在一个容量固定的numpy数组（pool）中，不为每条记录建Python对象：
+# 当前顺串的记录按键值排好序放在数组末尾[lo:]，留给下一个顺串的记录按读入顺序放在开头[:pending]，中间是空位
+# 每次输出当前顺串最小的一块，再读入同样多的记录：不小于刚输出的最后一个键值的还能留在当前顺串，
+# 排序后用searchsorted插入到末尾有序的一段中（整段向前移到空出来的位置）；其余的留到下一个顺串
+# 当前顺串用完时把留下来的记录稳定排序后移到末尾，开始下一个顺串
+# 插入时排在键值相同的记录之后，留下来的记录稳定排序，所以置换选择生成的顺串总是稳定的
+def replacement_record_runs(filename, capacity, temp):
+    out_size = min(min_block_size, max(1, capacity // 4))
+    heap_size = max(1, capacity - out_size)
+    pool = np.empty(heap_size, Record.record_dtype)
+    chunks = Record.read_record_chunks(filename, out_size)
+    buffered = pool[:0]
+
+    # 读至多count条记录，读入的块多出来的部分留到下一次
+    def read(count):
+        nonlocal buffered
+        while len(buffered) < count:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            buffered = np.concatenate((buffered, chunk))
+        records, buffered = buffered[:count], buffered[count:]
+        return records
+
+    # 把排好序的early插入末尾有序的一段，插入点相同的记录一起放；返回插入后有序一段的开头
+    def insert(lo, early):
+        points, starts = np.unique(pool['key'][lo:].searchsorted(early['key'], 'right'), return_index=True)
+        base = lo - len(early)
+        previous = 0
+        for point, start, end in zip(points.tolist(), starts.tolist(), starts[1:].tolist() + [len(early)]):
+            pool[base + previous + start:base + point + start] = pool[lo + previous:lo + point]
+            pool[base + point + start:base + point + end] = early[start:end]
+            previous = point
+        return base
+
+    pending = 0
+    while pending < heap_size:
+        records = read(min(out_size, heap_size - pending))
+        if not len(records):
+            break
+        pool[pending:pending + len(records)] = records
+        pending += len(records)
+    sizes = []
+    while pending:
+        order = pool['key'][:pending].argsort(kind='stable')
+        pool[heap_size - pending:] = pool[:pending][order]
+        lo = heap_size - pending
+        pending = 0
+        size = 0
+        with open(run_file(temp, len(sizes)), 'wb') as f:
+            while lo < heap_size:
+                count = min(out_size, heap_size - lo)
+                Record.write_records(f, pool[lo:lo + count])
+                size += count
+                last = pool['key'][lo + count - 1]
+                lo += count
+                records = read(count)
+                if not len(records):
+                    continue
+                joins = records['key'] >= last
+                late = records[~joins]
+                pool[pending:pending + len(late)] = late
+                pending += len(late)
+                early = records[joins]
+                if len(early):
+                    lo = insert(lo, early[early['key'].argsort(kind='stable')])
+        sizes.append(size)
+    return sizes
+
+
+# 整条记录的多路归并：每个输入顺串一块记录（numpy数组），键值直接在块的key列上按位置取，
+# 堆中只有每个顺串当前的(键值, 顺串序号)，不为块中的每条记录建Python对象
+# 输出块只在一个int32数组中记下每条记录来自哪个顺串，每个顺串贡献的是它当前块中连续的一段，写出时按来源整段复制
+# 某个顺串的块用完、要读下一块之前先把输出块写出，保证复制时来源块还在
+# output为.bin时输出二进制记录文件，否则输出CSV
+def merge_record_runs(inputs, output, block_size, prefetch=False, stats=None):
+    binary = Record.is_record_file(output)
+    with ThreadPoolExecutor(len(inputs) + 1) if prefetch else nullcontext() as executor:
+        readers = [BlockIO.BlockReader([name], Record.read_records, block_size, executor, stats) for name in inputs]
+        blocks = [reader.next() for reader in readers]
+        keys = [block['key'] if len(block) else [] for block in blocks]
+        starts = [0] * len(inputs)
+        positions = [0] * len(inputs)
+        sources = np.empty(block_size, np.int32)
+        count = 0
+        heap = [(int(key_list[0]), num) for num, key_list in enumerate(keys) if len(key_list)]
+        heapq.heapify(heap)
+
+        def flush():
+            nonlocal count
+            source = sources[:count]
+            output_block = np.empty(count, Record.record_dtype)
+            for num in range(len(inputs)):
+                if positions[num] > starts[num]:
+                    output_block[source == num] = blocks[num][starts[num]:positions[num]]
+                    starts[num] = positions[num]
+            writer.submit(output_block)
+            count = 0
+
+        with open(output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as out:
+            if not binary:
+                out.write('key,value\n')
+            writer = BlockIO.BlockWriter(out, Record.write_records if binary else Record.write_csv, executor,
+                                        stats)
+            while heap:
+                num = heap[0][1]
+                sources[count] = num
+                count += 1
+                position = positions[num] = positions[num] + 1
+                key_list = keys[num]
+                if position == len(key_list):
+                    flush()
+                    blocks[num] = readers[num].next()
+                    key_list = keys[num] = blocks[num]['key'] if len(blocks[num]) else []
+                    starts[num] = positions[num] = position = 0
+                    if not len(key_list):
+                        heapq.heappop(heap)
+                        continue
+                heapq.heapreplace(heap, (int(key_list[position]), num))
+                if count == block_size:
+                    flush()
+            flush()
+            writer.close()
+        for reader in readers:
+            reader.close()
+
+
+# 在子进程中排序一块数据（键值数组或结构化记录数组）并写成顺串，返回顺串大小
+def sort_run(data, name, payload=False, stable=False):
+    kind = 'stable' if stable else 'quicksort'
+    if payload:
+        data = data[data['key'].argsort(kind=kind)]
+    else:
+        data = np.sort(data, kind=kind)
+    with open(name, 'wb') as f:
+        data.tofile(f)
+    return len(data)
+
+
+# 在子进程中从二进制记录文件读出第start条开始的count条记录，排序后写成顺串
+def sort_slice(filename, start, count, name, payload=False, stable=False):
+    with open(filename, 'rb') as f:
+        f.seek(start * Record.record_size)
+        records = Record.read_records(f, count)
+    return sort_run(records if payload else records['key'], name, payload, stable)
+
+
+# 多进程生成顺串，每块输入交给一个进程排序和写回，顺串编号就是输入块的序号，和完成的先后无关
+# 二进制记录文件由各进程按位置自己读；CSV由主进程解析，提交给进程池的块在完成之前一直留在主进程中，
+# 所以解析下一块之前先等到处理中的块少于进程数，处理中的块加上正在解析的一块不超过进程数块，即不超过memory
+def parallel_runs(filename, run_size, temp, workers, payload=False, stable=False):
+    with ProcessPoolExecutor(workers) as pool:
+        if Record.is_record_file(filename):
+            total = os.path.getsize(filename) // Record.record_size
+            futures = [pool.submit(sort_slice, filename, start, min(run_size, total - start),
+                                   run_file(temp, num), payload, stable)
+                       for num, start in enumerate(range(0, total, run_size))]
+            return [future.result() for future in futures]
+        chunks = ReadData.read_chunks(filename, run_size, payload)
+        sizes = []
+        pending = deque()
+        while True:
+            if len(pending) == workers:
+                sizes.append(pending.popleft().result())
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            keys, values = chunk
+            data = Record.to_records(keys, values) if payload else keys
+            pending.append(pool.submit(sort_run, data, run_file(temp, len(sizes) + len(pending)), payload, stable))
+            del chunk, keys, values, data
+        sizes.extend(future.result() for future in pending)
+        return sizes
+
+
+# NumPy引擎的第一趟（只有键值）：每次读入run_size个键值为numpy数组，np.sort后写成顺串
+def make_numpy_runs(filename, run_size, temp, stable=False):
+    if Record.is_record_file(filename):
+        chunks = (records['key'] for records in Record.read_record_chunks(filename, run_size))
+    else:
+        chunks = (keys for keys, values in ReadData.read_chunks(filename, run_size, False))
+    return [sort_run(keys, run_file(temp, num), False, stable) for num, keys in enumerate(chunks)]
+
+
+# NumPy引擎的多路归并，按块而不是按元素进行：
+# 每个顺串当前块的最后一个键值是这个顺串在内存中的上界，取所有上界中最小的bound，
+# 比bound小的元素一定都已经在内存中，用searchsorted在每个顺串中找到分界，切下来拼接后做一次稳定排序输出
+# 键值等于bound的元素要和逐个归并一样按顺串编号输出：上界为bound、编号最小的顺串first整块输出，
+# 编号比它小的顺串输出到bound（含），编号比它大的只输出到bound（不含），它们等于bound的元素留到first之后
+# 每一轮至少用完一个块，输出最多和所有输入块一样大，所以内存按输入的两倍计算
+def merge_numpy_runs(inputs, output, block_size, text=False, payload=False, prefetch=False, stats=None):
+    if payload:
+        read = Record.read_records
+        binary = Record.is_record_file(output)
+        write = Record.write_records if binary else Record.write_csv
+    else:
+        read = Record.read_key_array
+        binary = not text
+        write = Record.write_keys if binary else (lambda f, keys: Record.write_text(f, keys.tolist()))
+    with ThreadPoolExecutor(len(inputs) + 1) if prefetch else nullcontext() as executor:
+        readers = [BlockIO.BlockReader([name], read, block_size, executor, stats) for name in inputs]
+        blocks = [reader.next() for reader in readers]
+        starts = [0] * len(inputs)
+        active = [num for num in range(len(inputs)) if len(blocks[num])]
+        with open(output, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as out:
+            if payload and not binary:
+                out.write('key,value\n')
+            writer = BlockIO.BlockWriter(out, write, executor, stats)
+            while active:
+                keys = [blocks[num]['key'] if payload else blocks[num] for num in active]
+                bound, first = min((key_list[-1], i) for i, key_list in enumerate(keys))
+                pieces = []
+                for i, num in enumerate(active):
+                    if i == first:
+                        end = len(keys[i])
+                    else:
+                        end = max(starts[num], int(keys[i].searchsorted(bound, 'right' if i < first else 'left')))
+                    pieces.append(blocks[num][starts[num]:end])
+                    starts[num] = end
+                merged = np.concatenate(pieces)
+                if payload:
+                    merged = merged[merged['key'].argsort(kind='stable')]
+                else:
+                    merged.sort(kind='stable')
+                writer.submit(merged)
+                for num in active:
+                    if starts[num] == len(blocks[num]):
+                        blocks[num] = readers[num].next()
+                        starts[num] = 0
+                active = [num for num in active if len(blocks[num])]
+            writer.close()
+        for reader in readers:
+            reader.close()
+
+
+# 外部排序入口：给定内存大小（字节）对任意大小的输入排序，结果写到output，每行一个键值（text为False时为二进制）
+# records为None时由文件大小估计记录数，开始之前打印计划，归并步骤按实际的顺串大小重新安排
+# replacement为True时用置换选择生成顺串
+# payload为True时对整条记录排序，output为.bin时输出二进制记录文件，否则输出CSV（key,value）
+# workers大于1时用workers个进程并行生成顺串，prefetch为True时归并阶段双缓冲，engine为'python'或'numpy'
+# stats为性能计数（见Instrument.py）时记录归并阶段读写的字节数、块数和读写耗时（见BlockIO.py），
+# 生成顺串和归并的耗时（timers中的runs、merge），以及一次排序的汇总（操作external_sort）
+def external_sort(filename='../data.csv', output='result.txt', memory=1024 * 1024, block_size=None,
+                  temp='temp/', records=None, replacement=False, verbose=True, text=True,
+                  payload=False, stable=False, workers=1, prefetch=True, engine='python', stats=None):
+    if engine not in ('python', 'numpy'):
+        raise ValueError('unknown engine ' + str(engine))
+    if records is None:
+        records = estimate_records(filename)
+    sort_plan = plan(records, memory, block_size, replacement, payload, stable, workers, prefetch, engine)
+    if verbose:
+        print(sort_plan)
+    capacity = memory // sort_plan.item_size
+    os.makedirs(temp, exist_ok=True)
+    startTime = time.perf_counter()
+    if workers > 1:
+        sizes = parallel_runs(filename, sort_plan.run_size, temp, workers, payload, stable)
+    elif payload and replacement:
+        sizes = replacement_record_runs(filename, capacity, temp)
+    elif payload:
+        sizes = make_record_runs(filename, sort_plan.run_size, temp, stable)
+    elif replacement:
+        sizes = replacement_runs(filename, capacity, temp)
+    elif engine == 'numpy':
+        sizes = make_numpy_runs(filename, sort_plan.run_size, temp, stable)
+    else:
+        sizes = make_runs(filename, sort_plan.run_size, temp)
+    runTime = time.perf_counter() - startTime
+    # 实际的顺串个数和估计的不同时（置换选择、记录数估计有误差），按实际个数重新确定归并路数
+    fan_in, block = sort_plan.fan_in, sort_plan.block_size
+    if block_size is None:
+        prefetch = prefetch and use_prefetch(len(sizes), capacity)
+        fan_in, block = choose_fan_in(sizes, capacity, 2 if prefetch else 1, stable)
+        if engine == 'numpy':
+            block = max(1, block // 2)
+    steps = schedule(sizes, fan_in, stable)
+    startTime = time.perf_counter()
+    if not steps:
+        if sizes and payload and not Record.is_record_file(output):
+            Record.records_to_csv(run_file(temp, 0), output)
+            os.remove(run_file(temp, 0))
+        elif sizes and not payload and text:
+            Record.keys_to_text(run_file(temp, 0), output)
+            os.remove(run_file(temp, 0))
+        elif sizes:
+            os.replace(run_file(temp, 0), output)
+        else:
+            with open(output, 'w', encoding='utf-8') as f:
+                if payload and not Record.is_record_file(output):
+                    f.write('key,value\n')
+    for number, (inputs, num, size) in enumerate(steps):
+        names = [run_file(temp, i) for i in inputs]
+        target = output if number == len(steps) - 1 else run_file(temp, num)
+        if engine == 'numpy':
+            merge_numpy_runs(names, target, block, text and number == len(steps) - 1, payload, prefetch, stats)
+        elif payload:
+            merge_record_runs(names, target, block, prefetch, stats)
+        elif number == len(steps) - 1:
+            merge_runs(names, target, block, text, prefetch, stats)
+        else:
+            merge_runs(names, target, block, False, prefetch, stats)
+        for name in names:
+            os.remove(name)
+    result = SortPlan(sum(sizes), memory, sort_plan.run_size, block, fan_in, len(sizes), steps, sort_plan.item_size)
+    result.run_time = runTime
+    result.merge_time = time.perf_counter() - startTime
+    if stats is not None:
+        stats.add_time('runs', result.run_time)
+        stats.add_time('merge', result.merge_time)
+        stats.record('external_sort', {'records': result.records, 'runs': result.runs, 'passes': result.passes,
+                                       'merge_steps': len(steps), 'run_bytes_read': os.path.getsize(filename),
+                                       'run_bytes_written': result.records * result.item_size,
+                                       'seconds': result.run_time + result.merge_time})
+    return result
+
+
+def write_test_file(filename, keys, values=None):
+    if values is None:
+        values = ['abcdefghijkl'] * len(keys)
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('key,value\n')
+        f.writelines(str(key) + ',' + value + '\n' for key, value in zip(keys, values))
+
+
+# 用很小的内存对随机数据排序，强制多趟归并，和内置排序的结果对比
+def test(records=100000, memory=16 * 1024):
+    import random
+    keys = [random.randint(1, records) for _ in range(records)]
+    write_test_file('test.csv', keys)
+    for engine in ('python', 'numpy'):
+        for replacement in (False, True):
+            result = external_sort('test.csv', 'test_result.txt', memory, temp='test_temp/',
+                                   replacement=replacement, verbose=False, engine=engine)
+            print(result)
+            with open('test_result.txt', 'r', encoding='utf-8') as f:
+                print('Right!' if [int(line) for line in f] == sorted(keys) else 'Wrong!!!')
+            os.remove('test_result.txt')
+    # 整条记录排序，值为输入中的序号，键值重复很多，检查稳定排序的结果和内置的稳定排序完全一致
+    keys = [random.randint(1, records // 10 + 1) for _ in range(records)]
+    values = ['%012d' % i for i in range(records)]
+    write_test_file('test.csv', keys, values)
+    expected = sorted(zip(keys, values), key=lambda x: x[0])
+    for engine, replacement in (('python', False), ('python', True), ('numpy', False), ('numpy', True)):
+        for output in ('test_result.bin', 'test_result.csv'):
+            result = external_sort('test.csv', output, memory, temp='test_temp/', replacement=replacement,
+                                   verbose=False, payload=True, stable=True, engine=engine)
+            print(result)
+            if output.endswith('.bin'):
+                with open(output, 'rb') as f:
+                    sortedRecords = Record.read_records(f)
+                actual = list(zip(sortedRecords['key'].tolist(), np.char.decode(sortedRecords['value']).tolist()))
+            else:
+                actual = list(ReadData.read_pairs(output))
+            print('Right!' if actual == expected else 'Wrong!!!')
+            os.remove(output)
+    # 并行生成顺串，CSV输入和二进制记录输入
+    Record.csv_to_records('test.csv', 'test.bin')
+    for name in ('test.csv', 'test.bin'):
+        result = external_sort(name, 'test_result.bin', memory, temp='test_temp/', verbose=False,
+                               payload=True, stable=True, workers=3)
+        print(result)
+        with open('test_result.bin', 'rb') as f:
+            sortedRecords = Record.read_records(f)
+        actual = list(zip(sortedRecords['key'].tolist(), np.char.decode(sortedRecords['value']).tolist()))
+        print('Right!' if actual == expected else 'Wrong!!!')
+        os.remove('test_result.bin')
+    # 不稳定排序时两种引擎的输出也要逐字节相同
+    outputs = []
+    for engine in ('python', 'numpy'):
+        external_sort('test.bin', 'test_result.bin', memory, temp='test_temp/', verbose=False,
+                      payload=True, engine=engine)
+        with open('test_result.bin', 'rb') as f:
+            outputs.append(f.read())
+        os.remove('test_result.bin')
+    print('Right!' if outputs[0] == outputs[1] else 'Wrong!!!')
+    os.remove('test.bin')
+    os.remove('test.csv')
+    os.rmdir('test_temp/')
+
+
+# 比较两种顺串生成方式的顺串个数和时间：随机数据和接近有序的数据（1%的位置随机交换到附近）
+def benchmark(records=1000000, memory=1024 * 1024):
+    import datetime
+    import random
+    keys = [random.randint(1, records) for _ in range(records)]
+    nearly = sorted(keys)
+    for _ in range(records // 100):
+        i = random.randrange(records)
+        j = min(records - 1, i + random.randint(1, 1000))
+        nearly[i], nearly[j] = nearly[j], nearly[i]
+    for name, data in (('random', keys), ('nearly sorted', nearly)):
+        write_test_file('bench.csv', data)
+        for replacement in (False, True):
+            startTime = datetime.datetime.now()
+            result = external_sort('bench.csv', 'bench_result.txt', memory, temp='bench_temp/',
+                                   records=records, replacement=replacement, verbose=False)
+            endTime = datetime.datetime.now()
+            print(name, 'replacement selection' if replacement else 'sort', 'runs =', result.runs,
+                  'merge passes =', result.passes, 'time =', (endTime - startTime).total_seconds(), 's')
+            os.remove('bench_result.txt')
+    os.remove('bench.csv')
+    os.rmdir('bench_temp/')
+
+
+# 并行生成顺串的加速比：二进制记录输入，只计第一趟的时间
+def parallel_benchmark(records=4000000, memory=64 * 1024 * 1024, workers=(1, 2, 4, 8, 16)):
+    import datetime
+    keys = np.random.randint(1, records + 1, records).astype(np.int32)
+    with open('bench.bin', 'wb') as f:
+        Record.write_records(f, Record.to_records(keys, np.full(records, 'abcdefghijkl')))
+    os.makedirs('bench_temp/', exist_ok=True)
+    for n in workers:
+        run_size = plan(records, memory, payload=True, workers=n).run_size
+        startTime = datetime.datetime.now()
+        if n > 1:
+            sizes = parallel_runs('bench.bin', run_size, 'bench_temp/', n, payload=True)
+        else:
+            sizes = make_record_runs('bench.bin', run_size, 'bench_temp/')
+        endTime = datetime.datetime.now()
+        print('workers =', n, 'runs =', len(sizes), 'time =', (endTime - startTime).total_seconds(), 's')
+        for num in range(len(sizes)):
+            os.remove(run_file('bench_temp/', num))
+    os.remove('bench.bin')
+    os.rmdir('bench_temp/')
+
+
+if __name__ == '__main__':
+    external_sort()
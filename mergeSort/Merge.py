@@ -1,162 +1,176 @@
+import heapq
 import os
-import sys
+import re
+import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice, zip_longest
 
-import pandas as pd
+import numpy as np
+
+import ReadData
+from mergeSort import BlockIO, Record, Verify
 
 # 计划分成4个子集合，每个子集合5块，一块有52428个元素
 # 最后一个子集合有一块只有3868个元素
 # 内存一次可放5块
 # 先对每个子集合内排序，再做4路归并（1块作为输出）
+# 子集合的块文件为二进制（连续的4字节整数，temp/<子集合>-<块>.bin），以前的文本块文件（.txt）仍然可以读
+# temp/中其他名字的文件（如ExternalSort.py的顺串run-<编号>.bin）不是块文件，合并时忽略
 
 block_size = 52428  # 一块有52428个元素
 child_sets_size = 5 * block_size  # 一个子集合有5块（4个子集合）
-record_size = 1000000
+temp_file_pattern = re.compile(r'(\d+)-(\d+)\.(bin|txt)')
 
 
 # 每个子集合先内排序，再划分为多块，写回磁盘
 def handle_child_sets(child_sets, sets_num):
-    block = []
-    block_num = 1
-    size = 0
-    # 先排序
-    for key in sorted(child_sets):
-        size += 1
-        block.append(key)
-        if len(block) == block_size or \
-                size == len(child_sets):
-            # 将每块写回磁盘
-            file_name = 'temp/' + str(sets_num) + '-' + str(block_num) + '.txt'
-            with open(file_name, 'w', encoding='utf-8') as f:
-                for k in block:
-                    f.write(str(k) + '\n')
-            block.clear()
-            block_num += 1
-
-
-# 划分子集合
-def split(filename='../data.csv', run=False):
+    # 先排序（np.sort，不逐个元素处理），再按块切分
+    keys = np.sort(np.asarray(child_sets, np.int32))
+    for block_num, start in enumerate(range(0, len(keys), block_size), 1):
+        # 将每块写回磁盘，同名的旧文本块文件删掉
+        file_name = 'temp/' + str(sets_num) + '-' + str(block_num)
+        with open(file_name + '.bin', 'wb') as f:
+            keys[start:start + block_size].tofile(f)
+        if os.path.exists(file_name + '.txt'):
+            os.remove(file_name + '.txt')
+
+
+# 划分子集合，stats为性能计数（见Instrument.py）时记录耗时（timers中的runs）
+def split(filename='../data.csv', run=False, stats=None):
     if run:
+        startTime = time.perf_counter()
+        os.makedirs('temp/', exist_ok=True)
         child_sets = []
         num = 1
-        data = pd.read_csv(filename, sep=',')
-        for number, keyValue in data.iterrows():
-            key = int(keyValue["key"])
-            child_sets.append(key)
-            if len(child_sets) == child_sets_size \
-                    or number == record_size - 1:
+        # 一次读一块，子集合满了就内排序写回，最后不满的一个子集合在读完之后处理
+        for keys in ReadData.read_keys(filename, block_size):
+            child_sets.extend(keys)
+            if len(child_sets) == child_sets_size:
                 handle_child_sets(child_sets, num)
                 num += 1
                 child_sets.clear()
+        if child_sets:
+            handle_child_sets(child_sets, num)
+        if stats is not None:
+            stats.add_time('runs', time.perf_counter() - startTime)
 
 
-# 获得划分子集合之后的文件，每个子集合对应一个队列，队列里面是文件名称
+# 获得划分子集合之后的文件，每个子集合对应一个队列，队列里面是按块号排好序的文件名称
 def get_temp_file():
     file_dict = dict()
-    for file in os.listdir('temp/'):
-        key = int(file[:file.index('-')])
+    matches = filter(None, map(temp_file_pattern.fullmatch, os.listdir('temp/')))
+    for match in sorted(matches, key=lambda x: (int(x.group(1)), int(x.group(2)))):
+        key = int(match.group(1))
         file_dict.setdefault(key, deque())
-        file_dict.get(key).append(file)
+        file_dict.get(key).append(match.group(0))
     return file_dict
 
 
 # 读每一块到队列
 def read_block(filename):
-    result = deque()
+    if filename.endswith('.bin'):
+        with open(filename, 'rb') as f:
+            return deque(Record.read_keys(f, os.path.getsize(filename) // Record.key_size))
     with open(filename, 'r', encoding='utf-8') as f:
-        for line in f.readlines():
-            result.append(int(line.strip()))
-    return result
+        return deque(int(line) for line in f.readlines())
 
 
-# 写回结果
+# 写回结果，一块一次写出
 def write_block(block, filename='result.txt'):
     with open(filename, 'a', encoding='utf-8') as f:
-        for key in block:
-            f.write(str(key) + '\n')
+        Record.write_text(f, block)
+
 
+# 从块文件中读至多count个键值，二进制块文件和以前的文本块文件都可以读
+def read_keys(f, count):
+    if f.name.endswith('.bin'):
+        return Record.read_keys(f, count)
+    return [int(line) for line in islice(f, count)]
 
-# 多路归并
-def merge(run=False):
+
+# 多路归并，子集合个数不限
+# 用小根堆维护每个子集合当前最小的元素，堆中元素为(键值, 子集合编号)，
+# 每输出一个元素只需O(log k)次比较，且按编号而不是按值找到来源，键值重复时也不会找错子集合
+# prefetch为True时双缓冲（见BlockIO.py）：每个子集合预读下一段、输出在后台写，
+# 为了不超过5块的内存，每次读写半块，每个子集合和输出各占两个半块
+# stats为性能计数（见Instrument.py）时记录读写的字节数、块数、读写耗时（见BlockIO.py）和归并的耗时（merge）
+def merge(run=False, filename='result.txt', prefetch=True, stats=None):
     if run:
-        # 初始化，将每个子集合的第一块加载到字典block_dict中
+        startTime = time.perf_counter()
         file_dict = get_temp_file()
-        block_dict = dict()
-        for num in file_dict.keys():
-            file_queue = file_dict.get(num)
-            block_dict.setdefault(num)
-            block_dict[num] = read_block('temp/' + file_queue.popleft())
-        # 输出块
-        output_block = []
-        # 比较块
-        compare_block = []
-        # 从加载到内存的块中分别取第一个元素（最小的）到比较块中
-        for num in block_dict.keys():
-            key_queue = block_dict.get(num)
-            compare_block.append(key_queue.popleft())
-        while True:
-            # 如果输出块已经满了，写回磁盘
-            if len(output_block) == block_size:
-                write_block(output_block)
-                output_block.clear()
-            # 找到比较块中最小的元素，写到输出块
-            key_min = sorted(compare_block)[0]
-            if key_min == sys.maxsize:
-                write_block(output_block)
-                return
-            output_block.append(key_min)
-            # 找到比较块中最小元素的位置，进而找到其对应的子集合，
-            # 从而找到该子集合的块，从中取出最小元素放到比较块中
-            location = compare_block.index(key_min) + 1
-            key_queue = block_dict.get(location)
-            if key_queue is None:
-                # 如果是None，意味着此子集合已经遍历完了，就将比较块中对应位置设为最大整数
-                compare_block[location - 1] = sys.maxsize
-            else:
-                compare_block[location - 1] = key_queue.popleft()
-            # 如果某子集合的块元素被消耗完了，就加载下一块，如果没有下一块，那就设为None
-            if not key_queue:
-                file_queue = file_dict.get(location)
-                if len(file_queue) != 0:
-                    block_dict[location] = read_block('temp/' + file_queue.popleft())
-                else:
-                    block_dict[location] = None
+        size = block_size // 2 if prefetch else block_size
+        with ThreadPoolExecutor(len(file_dict) + 1) if prefetch else nullcontext() as executor:
+            # 初始化，每个子集合的块文件按顺序读，取出第一段，第一个元素放入堆
+            readers = dict()
+            block_dict = dict()
+            heap = []
+            for num, file_queue in file_dict.items():
+                readers[num] = BlockIO.BlockReader(['temp/' + file for file in file_queue], read_keys, size, executor,
+                                                   stats)
+                key_queue = block_dict[num] = deque(readers[num].next())
+                if key_queue:
+                    heap.append((key_queue.popleft(), num))
+            heapq.heapify(heap)
+            # 结果文件只打开一次，清空上一次的结果
+            with open(filename, 'w', encoding='utf-8') as out:
+                writer = BlockIO.BlockWriter(out, Record.write_text, executor, stats)
+                # 输出块
+                output_block = []
+                while heap:
+                    # 堆顶就是所有子集合中最小的元素，写到输出块
+                    key_min, num = heap[0]
+                    output_block.append(key_min)
+                    # 如果输出块已经满了，写回磁盘
+                    if len(output_block) == size:
+                        writer.submit(output_block)
+                        output_block = []
+                    # 如果该子集合当前一段元素被消耗完了，就取下一段
+                    key_queue = block_dict[num]
+                    if not key_queue:
+                        key_queue = block_dict[num] = deque(readers[num].next())
+                    # 从该子集合取出下一个元素替换堆顶，如果此子集合已经遍历完了，就把它移出堆
+                    if key_queue:
+                        heapq.heapreplace(heap, (key_queue.popleft(), num))
+                    else:
+                        heapq.heappop(heap)
+                writer.submit(output_block)
+                writer.close()
+            for reader in readers.values():
+                reader.close()
+        if stats is not None:
+            stats.add_time('merge', time.perf_counter() - startTime)
 
 
 # 使用python内置函数直接对原数据排序，作为标准结果进行对比
+# 需要把全部数据读进内存，超出了外部排序的内存限制，只适合小数据；校验结果用verify()
 def standard_sort(run=False, filename='../data.csv'):
     if run:
         child_sets = []
-        data = pd.read_csv(filename, sep=',')
-        for number, keyValue in data.iterrows():
-            key = int(keyValue["key"])
-            child_sets.append(key)
+        for keys in ReadData.read_keys(filename):
+            child_sets.extend(keys)
+        open('standard.txt', 'w').close()
         write_block(sorted(child_sets), 'standard.txt')
 
 
-# 比较和标准版的差别，说明正确性
+# 比较和标准版的差别，说明正确性，两个文件逐行同时读，不整个读进内存，输出第一处不同的行号
 def compare():
-    my = read_block('result.txt')
-    standard = read_block('standard.txt')
-    # 如果两个队列数目不一样，肯定不正确
-    if my.__len__() != standard.__len__():
-        print('Wrong!!!')
-        return
-    while True:
-        x = my.popleft()
-        y = standard.popleft()
-        # 如果同一位置数不相等，肯定不正确
-        if x != y:
-            print('Wrong!!!')
-            break
-        # 上面已经确保两队列长度相等，故只需判断当一个队列空就说明正确
-        if not my:
-            print('Right!')
-            break
+    with open('result.txt', 'r', encoding='utf-8') as my, open('standard.txt', 'r', encoding='utf-8') as standard:
+        for number, (x, y) in enumerate(zip_longest(my, standard)):
+            # 一个文件先结束（条数不同）或者同一位置数不相等，肯定不正确
+            if x is None or y is None or int(x) != int(y):
+                print('Wrong!!! at line', number + 1)
+                return
+    print('Right!')
+
+
+# 流式校验结果：有序，并且是原数据的一个排列（见Verify.py），不需要标准排序结果
+def verify(filename='../data.csv', result='result.txt'):
+    print(Verify.verify(filename, result))
 
 
 if __name__ == '__main__':
-    split()
+    split(run=True)
     merge(True)
-    standard_sort()
-    compare()
+    verify()
@@ -0,0 +1,118 @@
+from array import array
+
+import numpy as np
+
+import ReadData
+
+# 二进制定长记录，和实验要求的记录一致：4字节整数A（小端） + 12字节字符串B（utf-8，不足补0），一条16字节
+# 整块用numpy的fromfile/tofile读写，不再逐行格式化和解析
+# 只有键值的文件（顺串、结果）为连续的4字节整数，用array('i')的fromfile/tofile读写
+
+record_dtype = np.dtype([('key', '<i4'), ('value', 'S12')])
+record_size = record_dtype.itemsize  # 16
+key_size = 4
+
+
+def is_record_file(filename):
+    return filename.endswith('.bin')
+
+
+# 从文件当前位置读至多count条记录，返回numpy结构化数组
+def read_records(f, count=-1):
+    return np.fromfile(f, record_dtype, count)
+
+
+def write_records(f, records):
+    np.asarray(records, record_dtype).tofile(f)
+
+
+# 从文件当前位置读至多count个键值，返回array('i')
+def read_keys(f, count):
+    keys = array('i')
+    try:
+        keys.fromfile(f, count)
+    except EOFError:
+        pass
+    return keys
+
+
+# 从文件当前位置读至多count个键值，返回numpy数组
+def read_key_array(f, count):
+    return np.fromfile(f, np.int32, count)
+
+
+def write_keys(f, keys):
+    if not isinstance(keys, array):
+        keys = array('i', keys)
+    keys.tofile(f)
+
+
+# 按块读入记录文件或CSV文件，每次返回一个至多size条记录的结构化数组
+def read_record_chunks(filename, size):
+    if is_record_file(filename):
+        with open(filename, 'rb') as f:
+            while True:
+                records = read_records(f, size)
+                if not len(records):
+                    return
+                yield records
+    else:
+        for keys, values in ReadData.read_chunks(filename, size):
+            yield to_records(keys, values)
+
+
+# 键值数组和值（字符串）数组合成结构化数组
+def to_records(keys, values):
+    records = np.empty(len(keys), record_dtype)
+    records['key'] = keys
+    records['value'] = np.char.encode(values, 'utf-8')
+    return records
+
+
+# CSV（key,value）转为二进制记录文件
+def csv_to_records(csvFile, recordFile, chunk=65536):
+    with open(recordFile, 'wb') as f:
+        for records in read_record_chunks(csvFile, chunk):
+            write_records(f, records)
+
+
+# 二进制记录文件转为CSV（key,value）
+def records_to_csv(recordFile, csvFile, chunk=65536):
+    with open(recordFile, 'rb') as f, open(csvFile, 'w', encoding='utf-8') as out:
+        out.write('key,value\n')
+        while True:
+            records = read_records(f, chunk)
+            if not len(records):
+                break
+            write_csv(out, records)
+
+
+# 一次写出一块记录的CSV行（不含表头）
+def write_csv(f, records):
+    values = np.char.decode(records['value'], 'utf-8').tolist()
+    f.write(''.join(str(k) + ',' + v + '\n' for k, v in zip(records['key'].tolist(), values)))
+
+
+# 二进制键值文件转为文本（每行一个键值，和result.txt格式一致）
+def keys_to_text(keyFile, textFile, chunk=65536):
+    with open(keyFile, 'rb') as f, open(textFile, 'w', encoding='utf-8') as out:
+        while True:
+            keys = read_keys(f, chunk)
+            if not keys:
+                break
+            write_text(out, keys)
+
+
+# 文本（每行一个键值）转为二进制键值文件
+def text_to_keys(textFile, keyFile, chunk=65536):
+    with open(textFile, 'r', encoding='utf-8') as f, open(keyFile, 'wb') as out:
+        lines = f.readlines(chunk * 8)
+        while lines:
+            write_keys(out, [int(line) for line in lines])
+            lines = f.readlines(chunk * 8)
+
+
+# 一次写出一块键值的文本
+def write_text(f, keys):
+    if len(keys):
+        f.write('\n'.join(map(str, keys)) + '\n')
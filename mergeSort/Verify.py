@@ -0,0 +1,170 @@
+import numpy as np
+
+import ReadData
+from mergeSort import Record
+
+# 流式校验外部排序的结果，不需要再做一次全量排序，内存只和块大小有关
+# 有序：逐块检查相邻键值，块与块之间比较上一块的最后一个键值，报告第一个逆序的位置
+# 是输入的一个排列：输入和输出各算一遍与顺序无关的校验和（条数，键值的和与异或，
+# 每条记录哈希值的和与异或），两边相等即认为记录的多重集合相同
+# 输入和输出可以是CSV、二进制记录文件（.bin）或每行一个键值的文本（如result.txt），
+# payload为True时哈希值包含B，能发现键值对调、B被改动等错误
+
+chunk_size = 65536
+mask = (1 << 64) - 1
+
+
+# splitmix64的混合函数，对uint64数组逐个计算，溢出按模2^64处理
+def mix(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class Checksum:
+    def __init__(self):
+        self.count = 0
+        self.keySum = 0
+        self.keyXor = 0
+        self.hashSum = 0
+        self.hashXor = 0
+
+    # keys为整数数组，values为None或S12数组
+    def add(self, keys, values=None):
+        if not len(keys):
+            return
+        keys = np.asarray(keys, np.int64)
+        self.count += len(keys)
+        self.keySum += int(keys.sum())
+        self.keyXor ^= int(np.bitwise_xor.reduce(keys))
+        h = mix(keys.astype(np.uint64))
+        if values is not None:
+            # 12字节的B补到16字节，看成两个uint64依次混入
+            data = np.zeros((len(values), 16), np.uint8)
+            data[:, :12] = np.ascontiguousarray(values, 'S12').view(np.uint8).reshape(-1, 12)
+            words = data.view('<u8')
+            h = mix(h ^ words[:, 0])
+            h = mix(h ^ words[:, 1])
+        self.hashSum = (self.hashSum + int(h.sum(dtype=np.uint64))) & mask
+        self.hashXor ^= int(np.bitwise_xor.reduce(h))
+
+    def fields(self):
+        return [('count', self.count), ('key sum', self.keySum), ('key xor', self.keyXor),
+                ('hash sum', self.hashSum), ('hash xor', self.hashXor)]
+
+
+class Report:
+    def __init__(self):
+        self.sorted = True
+        self.permutation = True
+        self.offset = None  # 第一个逆序记录的位置（从0开始），有序时为None
+        self.messages = []
+
+    @property
+    def ok(self):
+        return self.sorted and self.permutation
+
+    def __str__(self):
+        if self.ok:
+            return 'Right!'
+        return 'Wrong!!! ' + '; '.join(self.messages)
+
+
+# 每行一个键值的文本文件（没有逗号）
+def is_key_text(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return ',' not in f.readline()
+
+
+# 逐块产出(键值数组, B数组或None)，B统一为S12
+def read_chunks(filename, payload=False, size=chunk_size):
+    if Record.is_record_file(filename):
+        for records in Record.read_record_chunks(filename, size):
+            yield records['key'], records['value'] if payload else None
+    elif is_key_text(filename):
+        if payload:
+            raise ValueError(filename + ' has no payload')
+        with open(filename, 'rb') as f:
+            lines = f.readlines(size * 8)
+            while lines:
+                yield np.array(lines).astype(np.int64), None
+                lines = f.readlines(size * 8)
+    else:
+        for keys, values in ReadData.read_chunks(filename, size, payload):
+            yield keys, np.char.encode(values, 'utf-8').astype('S12') if payload else None
+
+
+def checksum(filename, payload=False):
+    result = Checksum()
+    for keys, values in read_chunks(filename, payload):
+        result.add(keys, values)
+    return result
+
+
+# 校验output是input排好序的结果，返回Report
+def verify(inputFile, outputFile, payload=False):
+    report = Report()
+    expected = checksum(inputFile, payload)
+    actual = Checksum()
+    offset = 0
+    last = None
+    for keys, values in read_chunks(outputFile, payload):
+        if not len(keys):
+            continue
+        if report.sorted:
+            if last is not None and keys[0] < last:
+                report.sorted = False
+                report.offset = offset
+            else:
+                down = np.flatnonzero(keys[1:] < keys[:-1])
+                if len(down):
+                    report.sorted = False
+                    report.offset = offset + int(down[0]) + 1
+            if not report.sorted:
+                report.messages.append('not sorted at record ' + str(report.offset))
+        last = keys[-1]
+        offset += len(keys)
+        actual.add(keys, values)
+    for (name, x), (_, y) in zip(expected.fields(), actual.fields()):
+        if x != y:
+            report.permutation = False
+            report.messages.append(name + ' differs: input ' + str(x) + ', output ' + str(y))
+    return report
+
+
+def test(records=200000):
+    import os
+    from mergeSort import ExternalSort
+    keys = np.random.randint(1, records // 10, records)
+    values = ['%012d' % i for i in range(records)]
+    ExternalSort.write_test_file('verify.csv', keys.tolist(), values)
+    ExternalSort.external_sort('verify.csv', 'verify.bin', 64 * 1024, temp='verify_temp/', verbose=False,
+                               payload=True, engine='numpy')
+    ExternalSort.external_sort('verify.csv', 'verify.txt', 64 * 1024, temp='verify_temp/', verbose=False)
+    print(verify('verify.csv', 'verify.bin', True))
+    print(verify('verify.csv', 'verify.txt'))
+    with open('verify.bin', 'rb') as f:
+        sortedRecords = Record.read_records(f)
+    # 交换两个不同键值的记录：不再有序，但仍是排列
+    changes = np.flatnonzero(np.diff(sortedRecords['key']))
+    i = int(changes[len(changes) // 2]) + 1
+    broken = sortedRecords.copy()
+    broken[[i - 1, i]] = broken[[i, i - 1]]
+    with open('verify_broken.bin', 'wb') as f:
+        Record.write_records(f, broken)
+    print(verify('verify.csv', 'verify_broken.bin', True), '(expected at record', i, ')')
+    # 两条键值不同的记录交换B：仍然有序，但不是原来的记录（B和键值对应错了）
+    broken = sortedRecords.copy()
+    j = int(np.flatnonzero(broken['key'] != broken['key'][0])[0])
+    broken['value'][0], broken['value'][j] = broken['value'][j], broken['value'][0]
+    with open('verify_broken.bin', 'wb') as f:
+        Record.write_records(f, broken)
+    print(verify('verify.csv', 'verify_broken.bin', True))
+    for name in ('verify.csv', 'verify.bin', 'verify.txt', 'verify_broken.bin'):
+        os.remove(name)
+    os.rmdir('verify_temp/')
+
+
+if __name__ == '__main__':
+    test()